@@ -0,0 +1,86 @@
+"""Benchmark of helpers.ts_analysis.bfast_wrapper.run_bfast_monitor
+
+Fits synthetic time-series (a seasonal signal with a drop in the monitoring
+period for every third point) where groups of points share the same dates, as
+points of the same path/row with the same clear observations do, and reports
+the throughput per group size. A group size of 1 corresponds to the former
+per-point fitting. With --compare, the groups are checked against the bfast
+package fitted point by point.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bfast --points 1000 --group-sizes 1,10,50,250
+"""
+import argparse
+import time
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
+from helpers.ts_analysis.ragged import EPOCH, RaggedTimeSeries, to_day_numbers
+
+BFAST_PARAMS = {
+    'start_monitor': '2000-01-01', 'freq': 365, 'k': 3, 'hfrac': 0.25, 'trend': True, 'level': 0.05, 'backend': 'python'
+}
+
+
+def synthetic_groups(points, group_size, images=400, seed=42):
+    # points in groups with the same dates since 1990
+    rng = np.random.default_rng(seed)
+    day_range = np.arange(to_day_numbers('1990-01-01'), to_day_numbers('2017-01-01'))
+    days, values = [], []
+    for group in range(0, points, group_size):
+        group_days = np.sort(rng.choice(day_range, images, replace=False)).astype(np.int32)
+        for point in range(group, min(group + group_size, points)):
+            y = 6000 + 500 * np.sin(2 * np.pi * group_days / 365.25) + rng.normal(0, 150, images)
+            if point % 3 == 0:
+                y[group_days > rng.choice(group_days[images // 2:])] -= 2500
+            days.append(group_days)
+            values.append(y.astype(np.float32))
+
+    offsets = np.concatenate([[0], np.cumsum([len(d) for d in days])])
+    return RaggedTimeSeries.from_offsets(np.arange(points), offsets, np.concatenate(days), {'ndfi': np.concatenate(values)})
+
+
+def compare(ts, result):
+    # the bfast package, point by point as the former implementation
+    from bfast import BFASTMonitor
+
+    start_monitor = dt.strptime(BFAST_PARAMS['start_monitor'], '%Y-%m-%d')
+    params = {key: value for key, value in BFAST_PARAMS.items() if key != 'start_monitor'}
+    for i in range(len(ts)):
+        model = BFASTMonitor(start_monitor=start_monitor, **params)
+        dates = pd.DatetimeIndex(EPOCH + ts.point_days(i).astype('timedelta64[D]'))
+        model.fit(ts.point_values(i, 'ndfi')[:, None, None], dates)
+        assert model.breaks[0, 0] < 0 or np.isclose(result.bfast_magnitude[i], model.magnitudes[0, 0], rtol=1e-4)
+        assert (model.breaks[0, 0] < 0) == (result.bfast_change_date[i] < 0)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--group-sizes', default='1,10,50,250')
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    config_dict = {'ts_params': {'ts_band': 'ndfi', 'point_id': 'point_id'}, 'bfast_params': BFAST_PARAMS}
+    print(f'{"group size":>10} {"groups":>7} {"time (s)":>9} {"points/s":>9}')
+    for group_size in [int(size) for size in args.group_sizes.split(',')]:
+        ts = synthetic_groups(args.points, group_size)
+        df = pd.DataFrame({'point_id': ts.point_ids})
+
+        start = time.time()
+        result = run_bfast_monitor(df, config_dict, ts)
+        duration = time.time() - start
+
+        if args.compare:
+            compare(ts, result)
+        groups = -(-args.points // group_size)
+        print(f'{group_size:>10} {groups:>7} {duration:>9.2f} {args.points / duration:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
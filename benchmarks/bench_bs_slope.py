@@ -0,0 +1,76 @@
+"""Benchmark of helpers.ts_analysis.bootstrap_slope.run_bs_slope
+
+Compares the batched implementation, which solves the slopes of all bootstraps
+of the points of a block in closed form, against the former per-point loop of
+np.random.choice and np.linalg.lstsq, on synthetic time-series with a drop in
+the middle. As both draw their own random subsamples, the statistics are
+compared against the spread of the bootstrap slopes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bs_slope --points 200 --bootstraps 1000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.bootstrap_slope import run_bs_slope
+from helpers.ts_analysis.ragged import decimal_years
+from benchmarks.bench_cusum import synthetic_ts
+
+
+def slope(x, y):
+    A = np.vstack([x, np.ones(len(x))]).T
+    m, c = np.linalg.lstsq(A, y, rcond=None)[0]
+    return m
+
+
+def legacy_bootstrap_slope(y, x, nr_bootstraps):
+    # the former implementation, one lstsq per bootstrap
+    boot_means = []
+    for _ in range(nr_bootstraps):
+        rand_idx = sorted(np.random.choice(np.arange(y.size), int(y.size * .66), replace=False))
+        boot_means.append(slope(x[rand_idx], y[rand_idx]))
+    boot_means = np.array(boot_means)
+    return np.mean(boot_means), np.std(boot_means), np.max(boot_means), np.min(boot_means)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=200)
+    parser.add_argument('--bootstraps', type=int, default=1000)
+    args = parser.parse_args()
+
+    ts = synthetic_ts(args.points)
+    years = decimal_years(ts.days)
+    columns = ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_max', 'bs_slope_min']
+
+    start = time.time()
+    legacy = pd.DataFrame([
+        legacy_bootstrap_slope(ts.point_values(i, 'ndfi').astype(np.float64), years[ts.starts[i]:ts.ends[i]], args.bootstraps)
+        for i in range(len(ts))
+    ], columns=columns)
+    legacy_time = time.time() - start
+
+    config_dict = {
+        'ts_params': {'ts_band': 'ndfi', 'point_id': 'point_id'},
+        'bs_slope_params': {'nr_of_bootstraps': args.bootstraps, 'seed': 42}
+    }
+    start = time.time()
+    batched = run_bs_slope(pd.DataFrame({'point_id': ts.point_ids}), config_dict, ts)
+    batched_time = time.time() - start
+
+    # mean slopes within a few standard errors of each other
+    error = np.abs(batched.bs_slope_mean - legacy.bs_slope_mean) / (legacy.bs_slope_sd / np.sqrt(args.bootstraps))
+    assert np.median(error) < 2
+    print(
+        f' {args.points} points, {args.bootstraps} bootstraps: loop {legacy_time:.2f}s, '
+        f'batched {batched_time:.2f}s, speedup {legacy_time / batched_time:.0f}x'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark of helpers.ts_analysis.cusum.run_cusum_deforest
+
+Compares the batched implementation, which runs the bootstrap of a block of
+points as padded matrices, against the per-point processing of the former
+implementation (cusum_deforest called point by point, without the TensorFlow
+overhead), on synthetic time-series with a drop in the middle. Change dates and
+magnitudes are checked to be identical, and the batched run is repeated with
+several numbers of threads. With --tolerance, the early-stopping bootstrap is
+timed as well.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cusum --points 1000 --bootstraps 1000 --workers 1,2,4 --tolerance 0.01
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.cusum import cusum_deforest, run_cusum_deforest
+from helpers.ts_analysis.ragged import RaggedTimeSeries, decimal_years, to_day_numbers
+
+
+def synthetic_ts(points, seed=42):
+    # 300 to 500 observations per point since 2000, with a drop at a random date
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(300, 500, points)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    days = np.concatenate([
+        np.sort(rng.choice(17 * 365, length, replace=False)) + to_day_numbers('2000-01-02') for length in lengths
+    ]).astype(np.int32)
+    values = rng.normal(8000, 500, offsets[-1]).astype(np.float32)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        values[rng.integers(start, end):end] -= rng.uniform(0, 3000)
+    return RaggedTimeSeries.from_offsets(np.arange(points), offsets, days, {'ndfi': values})
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--bootstraps', type=int, default=1000)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--tolerance', type=float)
+    args = parser.parse_args()
+
+    ts = synthetic_ts(args.points)
+    df = pd.DataFrame({'point_id': ts.point_ids})
+    years = decimal_years(ts.days)
+
+    start = time.time()
+    per_point = pd.DataFrame(
+        [cusum_deforest([ts.point_values(i, 'ndfi'), years[ts.starts[i]:ts.ends[i]], ts.point_ids[i], args.bootstraps])
+         for i in range(len(ts))],
+        columns=['cusum_change_date', 'cusum_confidence', 'cusum_magnitude', 'point_id']
+    )
+    per_point_time = time.time() - start
+    print(f' per point: {per_point_time:.2f}s ({args.points} points, {args.bootstraps} bootstraps)')
+
+    print(f'{"workers":>8} {"batched (s)":>12} {"speedup":>8}')
+    for workers in [int(w) for w in args.workers.split(',')]:
+        config_dict = {
+            'ts_params': {'ts_band': 'ndfi', 'point_id': 'point_id'},
+            'cusum_params': {'nr_of_bootstraps': args.bootstraps, 'max_workers': workers, 'seed': 42}
+        }
+        start = time.time()
+        batched = run_cusum_deforest(df, config_dict, ts)
+        batched_time = time.time() - start
+
+        assert np.array_equal(batched.cusum_change_date, per_point.cusum_change_date)
+        assert np.allclose(batched.cusum_magnitude, per_point.cusum_magnitude, rtol=1e-5)
+        print(f'{workers:>8} {batched_time:>12.2f} {per_point_time / batched_time:>7.1f}x')
+
+    if args.tolerance:
+        config_dict['cusum_params']['tolerance'] = args.tolerance
+        start = time.time()
+        adaptive = run_cusum_deforest(df, config_dict, ts)
+        adaptive_time = time.time() - start
+
+        error = np.abs(adaptive.cusum_confidence - batched.cusum_confidence).max()
+        print(
+            f' early stopping: {adaptive_time:.2f}s ({batched_time / adaptive_time:.1f}x), '
+            f'{adaptive.cusum_bootstraps.mean():.0f} bootstraps per point on average, '
+            f'max. confidence difference {error:.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Benchmark of helpers.ts_analysis.jrc_nrt.run_jrc_nrt
+
+Runs the nrt monitors on synthetic time-series (a drop at a random date) of
+increasing numbers of points and reports the size of the (time, 1, point) cube
+next to the size of the former (time, y, x) grid of scattered points, which has
+a pixel for every combination of their x and y coordinates.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_jrc_nrt --points 100,1000,5000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from helpers.ts_analysis.jrc_nrt import point_cube, run_jrc_nrt
+from benchmarks.bench_cusum import synthetic_ts
+
+TS_PARAMS = {
+    'start_calibration': '2000-01-01', 'start_monitor': '2010-01-01', 'end_monitor': '2017-01-01',
+    'point_id': 'point_id', 'ts_band': 'ndfi'
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', default='100,1000,5000')
+    args = parser.parse_args()
+
+    print(f'{"points":>7} {"dates":>6} {"cube (MB)":>10} {"grid (MB)":>10} {"time (s)":>9}')
+    for points in [int(p) for p in args.points.split(',')]:
+        ts = synthetic_ts(points)
+        da = point_cube(ts, 'ndfi')
+        grid_bytes = da.sizes['time'] * points ** 2 * da.dtype.itemsize
+
+        start = time.time()
+        result = run_jrc_nrt(pd.DataFrame({'point_id': ts.point_ids}), {'ts_params': TS_PARAMS}, ts)
+        duration = time.time() - start
+
+        assert len(result) == points
+        print(f'{points:>7} {da.sizes["time"]:>6} {da.nbytes / 1e6:>10.1f} {grid_bytes / 1e6:>10.1f} {duration:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark of the thread and process executors of the time-series algorithms
+
+Runs cusum, bs_slope, ts_metrics and bfast on synthetic time-series with
+executor 'threads' and 'processes' for each number of workers, checks that both
+give the same results and reports the speedup over a single thread. With
+processes, the time-series are placed in shared memory once and each task only
+pickles the offsets of its points, the bytes sent per task are reported for
+both. The scaling is bound by the number of cores of the machine.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_process_pool --points 4000 --workers 8,16,32
+"""
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
+from helpers.ts_analysis.bootstrap_slope import run_bs_slope
+from helpers.ts_analysis.cusum import run_cusum_deforest
+from helpers.ts_analysis.timescan import run_timescan_metrics
+from benchmarks.bench_bfast import BFAST_PARAMS, synthetic_groups
+from benchmarks.bench_cusum import synthetic_ts
+
+ALGORITHMS = {
+    'cusum': (run_cusum_deforest, 'cusum_params', {'nr_of_bootstraps': 1000, 'seed': 42}),
+    'bs_slope': (run_bs_slope, 'bs_slope_params', {'nr_of_bootstraps': 1000, 'seed': 42}),
+    'ts_metrics': (
+        run_timescan_metrics, 'ts_metrics_params',
+        {'outlier_removal': True, 'z_threshhold': 3, 'extra_metrics': ['count', 'iqr'], 'points_per_block': 256}
+    ),
+    'bfast': (run_bfast_monitor, 'bfast_params', BFAST_PARAMS),
+}
+
+
+def timed_run(algorithm, ts, executor, workers):
+    # one run of an algorithm with the given executor
+    run, key, params = ALGORITHMS[algorithm]
+    config_dict = {
+        'ts_params': {'ts_band': 'ndfi', 'point_id': 'point_id'},
+        key: dict(params, executor=executor, max_workers=workers)
+    }
+    start = time.time()
+    result = run(pd.DataFrame({'point_id': ts.point_ids}), config_dict, ts)
+    return result, time.time() - start
+
+
+def task_bytes(ts, points_per_block=256):
+    # pickled size of the time-series of a block of points, copied and shared
+    block = np.arange(min(points_per_block, len(ts)))
+    buffer, shared_ts = ts.share()
+    with buffer:
+        return len(pickle.dumps(ts.take(block))), len(pickle.dumps(shared_ts.take(block)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=4000)
+    parser.add_argument('--workers', default='8,16,32')
+    parser.add_argument('--algorithms', default='cusum,bs_slope,ts_metrics,bfast')
+    args = parser.parse_args()
+
+    print(f' {os.cpu_count()} cores, {args.points} points')
+    copied, shared = task_bytes(synthetic_ts(args.points))
+    print(f' time-series per task of 256 points: {copied / 1e6:.2f} MB pickled, {shared / 1e3:.1f} kB shared')
+
+    print(f'{"algorithm":>10} {"executor":>9} {"workers":>8} {"time (s)":>9} {"speedup":>8}')
+    for algorithm in args.algorithms.split(','):
+        # groups of 50 points with the same dates for bfast
+        ts = synthetic_groups(args.points, 50) if algorithm == 'bfast' else synthetic_ts(args.points)
+
+        reference, reference_time = timed_run(algorithm, ts, 'threads', 1)
+        print(f'{algorithm:>10} {"threads":>9} {1:>8} {reference_time:>9.2f} {1:>7.1f}x')
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for executor in ['threads', 'processes']:
+                result, duration = timed_run(algorithm, ts, executor, workers)
+                pd.testing.assert_frame_equal(result, reference)
+                print(f'{algorithm:>10} {executor:>9} {workers:>8} {duration:>9.2f} {reference_time / duration:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark of helpers.ee.get_time_series.structure_ts_data
+
+Compares the single-pass implementation against the former per-point loop,
+which filtered the full chunk once per point, on synthetic chunks of Landsat
+time-series covered by several path/rows and with duplicate L8/L9 dates. The
+outputs of both are checked to be identical.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_structure_ts --points 250,5000 --images 300
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from helpers.ee.get_time_series import structure_ts_data
+
+BANDS = ['green', 'red', 'nir', 'swir1', 'swir2', 'ndfi']
+
+
+def legacy_structure_ts_data(df, point_id_name, bands):
+    # the former implementation, one boolean filter over the chunk per point
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.imageID.apply(lambda x: x.split('_')[-1]), format='%Y%m%d'))
+
+    d = {}
+    for i, point in enumerate(df[point_id_name].unique()):
+
+        # (with a stable sort, so rows with equal dates compare deterministically)
+        sub = df[df[point_id_name] == point].sort_index(kind='stable')
+        sub['pathrow'] = sub.imageID.apply(lambda x: x.split('_')[-2])
+
+        if len(sub.pathrow.unique()) > 1:
+            length = -1
+            for pathrow in sub.pathrow.unique():
+                l = len(sub[sub.pathrow == pathrow])
+                if l > length:
+                    pr = pathrow
+                    length = l
+            sub = sub[sub.pathrow == pr]
+
+        sub = sub[~sub.index.duplicated(keep='first')]
+
+        ts_dict = {}
+        for band in bands:
+            ts_dict.update({band: sub[band].tolist()})
+
+        d[i] = {
+            'point_idx': i,
+             point_id_name: point,
+            'dates': sub.index,
+            'ts': ts_dict,
+            'images': len(sub),
+            'geometry': sub.geometry.head(1).values[0]
+        }
+
+    return gpd.GeoDataFrame(pd.DataFrame.from_dict(d, orient='index')).set_geometry('geometry')
+
+
+def synthetic_chunk(points, images, seed=42):
+    # rows ordered by image, as returned by Earth Engine
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('1985-01-01') + np.sort(rng.choice(32 * 365, images, replace=False))
+    # some L9 images on the same dates as L8 images
+    l9 = rng.random(images) < 0.1
+    image_ids = [
+        f'{"LC09" if dup else "LC08"}_{196 + image % 3:03d}{55 + image % 2:03d}_{str(date).replace("-", "")}'
+        for image, (date, dup) in enumerate(zip(dates, l9))
+    ] + [f'LC08_{196 + image % 3:03d}{55 + image % 2:03d}_{str(date).replace("-", "")}' for image, date in enumerate(dates[l9])]
+
+    # each point is only covered by a random subset of the images
+    point_ids = rng.permutation(points) * 7
+    image_idx, point_idx = np.nonzero(rng.random((len(image_ids), points)) < 0.8)
+    lon, lat = rng.uniform(-8, -3, points), rng.uniform(5, 10, points)
+    df = pd.DataFrame({'point_id': point_ids[point_idx], 'imageID': np.array(image_ids)[image_idx]})
+    for band in BANDS:
+        df[band] = rng.integers(-10000, 10000, len(df)).astype(np.float32)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(lon[point_idx], lat[point_idx]))
+
+
+def assert_identical(a, b):
+    assert list(a.columns) == list(b.columns) and a.index.equals(b.index)
+    for (_, row_a), (_, row_b) in zip(a.iterrows(), b.iterrows()):
+        assert row_a['point_id'] == row_b['point_id'] and row_a['images'] == row_b['images']
+        assert row_a['dates'].equals(row_b['dates']) and row_a['dates'].name == row_b['dates'].name
+        assert row_a['ts'] == row_b['ts'] and row_a['geometry'].equals(row_b['geometry'])
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', default='250,5000')
+    parser.add_argument('--images', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f'{"points":>8} {"rows":>10} {"loop (s)":>10} {"single pass (s)":>16} {"speedup":>8}')
+    for points in [int(p) for p in args.points.split(',')]:
+
+        df = synthetic_chunk(points, args.images)
+
+        start = time.time()
+        legacy = legacy_structure_ts_data(df.copy(), 'point_id', BANDS)
+        legacy_time = time.time() - start
+
+        start = time.time()
+        result = structure_ts_data(df.copy(), 'point_id', BANDS)
+        new_time = time.time() - start
+
+        assert_identical(legacy, result.drop(columns='pathrow'))
+        print(f'{points:>8} {len(df):>10} {legacy_time:>10.2f} {new_time:>16.2f} {legacy_time / new_time:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark of parsing the time-series download of get_time_series
+
+Compares the former GeoJSON path (r.json() + GeoDataFrame.from_features) with
+the csv path (read_ts_csv) on a synthetic response shaped like the one Earth
+Engine returns for a full Landsat stack. Each parser runs in a fresh process,
+so the reported peak RSS is not influenced by the other one.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ts_download --points 250 --images 800
+"""
+import argparse
+import io
+import json
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+BANDS = ['green', 'red', 'nir', 'swir1', 'swir2', 'ndfi']
+
+
+def synthetic_rows(points, images, seed=42):
+    rng = np.random.default_rng(seed)
+    lon, lat = rng.uniform(-8, -3, points), rng.uniform(5, 10, points)
+    dates = np.datetime64('1985-01-01') + np.sort(rng.choice(32 * 365, images, replace=False))
+    for image, date in enumerate(dates):
+        image_id = f'LC08_{196 + image % 3:03d}{55 + image % 2:03d}_{str(date).replace("-", "")}'
+        values = rng.integers(-10000, 10000, (points, len(BANDS)))
+        for point in range(points):
+            yield point, image_id, lon[point], lat[point], values[point]
+
+
+def geojson_body(points, images):
+    features = []
+    for i, (point, image_id, lon, lat, values) in enumerate(synthetic_rows(points, images)):
+        properties = {'point_id': point, 'imageID': image_id, **dict(zip(BANDS, values.tolist()))}
+        features.append({
+            'type': 'Feature', 'id': f'{i}', 'properties': properties,
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]}
+        })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode()
+
+
+def csv_body(points, images):
+    lines = [','.join(['point_id', 'imageID', 'lon', 'lat'] + BANDS)]
+    for point, image_id, lon, lat, values in synthetic_rows(points, images):
+        lines.append(','.join([str(point), image_id, str(float(lon)), str(float(lat))] + [str(v) for v in values]))
+    return '\n'.join(lines).encode()
+
+
+def run(path, body_file, queue):
+
+    import geopandas as gpd
+    from helpers.ee.get_time_series import read_ts_csv
+
+    with open(body_file, 'rb') as f:
+        body = f.read()
+    stream = io.BytesIO(body)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    if path == 'geojson':
+        gdf = gpd.GeoDataFrame.from_features(json.loads(stream.read()))
+    else:
+        gdf = read_ts_csv(stream, 'point_id', BANDS)
+    elapsed = time.time() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((len(body), len(gdf), elapsed, (peak - baseline) / 1024))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=250)
+    parser.add_argument('--images', type=int, default=800)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    print(f'{"format":>8} {"body (MB)":>10} {"rows":>9} {"parse (s)":>10} {"peak RSS (MB)":>14}')
+    for path in ['geojson', 'csv']:
+
+        # build the body here, so it does not count towards the peak of the parsing process
+        with tempfile.NamedTemporaryFile(suffix=f'.{path}') as body_file:
+            body_file.write(geojson_body(args.points, args.images) if path == 'geojson' else csv_body(args.points, args.images))
+            body_file.flush()
+
+            queue = ctx.Queue()
+            process = ctx.Process(target=run, args=(path, body_file.name, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f'Parsing the {path} body failed')
+            size, rows, elapsed, peak = queue.get()
+
+        print(f'{path:>8} {size / 1e6:>10.1f} {rows:>9} {elapsed:>10.2f} {peak:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
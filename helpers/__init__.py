@@ -1,7 +1,12 @@
-from helpers.sampling.grid import squared_grid, hexagonal_grid, upload_to_ee, save_locally, plot_samples
+from helpers.sampling.grid import squared_grid, hexagonal_grid, squared_grid_tiles, hexagonal_grid_tiles, upload_to_ee, save_locally, save_tiles_locally, plot_samples
 
 from helpers.ee.get_time_series import get_time_series
 from helpers.ee.util import processing_grid, get_random_point, get_center_point, set_id 
+from helpers.ee.tasks import TaskManager
+from helpers.ee.http import RequestTimer
+from helpers.ee.scheduler import RequestScheduler
+from helpers.ee.backend import EarthEngineBackend
+from helpers.ee.offline_backend import OfflineBackend
 from helpers.ee.landsat.landsat_collection import landsat_collection
 from helpers.ee.ccdc import run_ccdc
 from helpers.ee.landtrendr import run_landtrendr
@@ -12,5 +17,8 @@ from helpers.ts_analysis.bootstrap_slope import run_bs_slope
 from helpers.ts_analysis.timescan import run_timescan_metrics
 from helpers.ts_analysis.jrc_nrt import run_jrc_nrt
 from helpers.ts_analysis.helpers import subset_ts, plot_timeseries, smooth_ts, remove_outliers, plot_stats_per_class
+from helpers.ts_analysis.ragged import RaggedTimeSeries
 
+from helpers.parquet import write_results_parquet, read_results_parquet
+from helpers.ts_cache import TimeSeriesCache
 from helpers.get_change_data import get_change_data
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+
+def chunk_key(chunk, param_string):
+    """Name of a chunk of plan_chunks, derived from its points, so it does not depend on the planning"""
+
+    digest = hashlib.md5(','.join(str(point_id) for point_id in chunk['point_ids']).encode()).hexdigest()[:16]
+    return f'{param_string}_{digest}'
+
+
+class CheckpointStore:
+    """Append-only record of the processed chunks of a run
+
+    The results of each chunk are written to their own pickle file, to a
+    temporary name first and renamed when complete. Afterwards the chunk and
+    its point ids are registered in a SQLite database within one transaction.
+    A chunk therefore either counts as done with all its points, or not at
+    all, whenever the run is interrupted, and nothing is ever rewritten.
+    Failed chunks are recorded as well, with their error.
+
+    Parameters
+    ----------
+    tmpdir : str or Path
+        folder of the database and the chunk files
+    """
+
+    def __init__(self, tmpdir):
+        self.tmpdir = Path(tmpdir)
+        self.parts = self.tmpdir.joinpath('parts')
+        self.parts.mkdir(parents=True, exist_ok=True)
+        self.db_file = self.tmpdir.joinpath('checkpoints.sqlite')
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS chunks '
+            '(key TEXT PRIMARY KEY, status TEXT, file TEXT, points INTEGER, error TEXT, finished REAL)'
+        )
+        self._db.execute('CREATE TABLE IF NOT EXISTS points (point_id PRIMARY KEY, chunk TEXT)')
+
+        # chunk files written, but not registered before an interruption
+        registered = {row[0] for row in self._db.execute("SELECT file FROM chunks WHERE status = 'done'")}
+        for file in self.parts.glob('*'):
+            if file.name not in registered:
+                file.unlink()
+
+    def done(self, key):
+        """Whether the chunk has been processed"""
+
+        with self._lock:
+            row = self._db.execute('SELECT status FROM chunks WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    def add(self, key, df, point_id_name):
+        """Register the results of a chunk
+
+        Points already registered by another chunk are left out, so every
+        point appears once in the assembled results.
+        """
+
+        point_ids = df[point_id_name].tolist()
+        with self._lock:
+            known = {
+                row[0] for i in range(0, len(point_ids), 500) for row in self._db.execute(
+                    f'SELECT point_id FROM points WHERE point_id IN ({",".join("?" * len(point_ids[i:i + 500]))})',
+                    point_ids[i:i + 500]
+                )
+            }
+        if known:
+            df = df[~df[point_id_name].isin(known)]
+            point_ids = df[point_id_name].tolist()
+
+        # write the file completely before it is registered
+        file = self.parts.joinpath(f'{key}.pickle')
+        tmp_file = self.parts.joinpath(f'.{key}.tmp')
+        df.to_pickle(tmp_file)
+        os.replace(tmp_file, file)
+
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.executemany('INSERT INTO points VALUES (?, ?)', [(point_id, key) for point_id in point_ids])
+                self._db.execute(
+                    'INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, NULL, ?)',
+                    (key, 'done', file.name, len(point_ids), time.time())
+                )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def failed(self, key, error):
+        """Record a chunk that failed"""
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO chunks VALUES (?, ?, NULL, 0, ?, ?)',
+                (key, 'failed', str(error), time.time())
+            )
+
+    def point_ids(self):
+        """Ids of all processed points"""
+
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT point_id FROM points')]
+
+    def status(self):
+        """Number of chunks per status"""
+
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM chunks GROUP BY status').fetchall())
+
+    def assemble(self):
+        """All results registered so far, as one DataFrame (None if there are none)
+
+        Each chunk file is read once and concatenated in a single step.
+        """
+
+        with self._lock:
+            files = [row[0] for row in self._db.execute("SELECT file FROM chunks WHERE status = 'done' ORDER BY finished")]
+
+        dfs = [pd.read_pickle(self.parts.joinpath(file)) for file in files]
+        dfs = [df for df in dfs if len(df) > 0]
+        return pd.concat(dfs, ignore_index=True) if dfs else None
+
+    def clear(self):
+        """Delete the database and all chunk files"""
+
+        with self._lock:
+            self._db.close()
+
+        for file in self.parts.glob('*'):
+            file.unlink()
+        self.parts.rmdir()
+        for file in self.tmpdir.glob(f'{self.db_file.name}*'):
+            file.unlink()
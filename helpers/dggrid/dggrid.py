@@ -0,0 +1,154 @@
+import hashlib
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+from godale import Executor
+from dggrid4py import DGGRIDv7
+
+# the dggrid binary shipped within this package
+DGGRID_EXECUTABLE = Path(__file__).parent.joinpath('src/apps/dggrid/dggrid')
+
+# where generated cell sets are kept
+CACHE_DIR = Path.home().joinpath('.cache/sbae_point_analysis/dggrid')
+
+
+def grid_cells_for_extent(projection, resolution, clip_geom):
+    """Run DGGRID for a single extent
+
+    Every call gets its own temporary working directory, so that calls can run
+    in parallel without DGGRID instances overwriting each others files.
+
+    Parameters
+    ----------
+    projection : str
+        DGGRID projection, e.g. 'ISEA3H'
+    resolution : int
+        DGGRID resolution
+    clip_geom : shapely geometry
+        extent in EPSG:4326
+
+    Returns
+    -------
+    GeoDataFrame
+        cells with DGGRID cell id in the name column, in EPSG:4326
+    """
+
+    with tempfile.TemporaryDirectory(prefix='dggrid_') as working_dir:
+        dggrid_instance = DGGRIDv7(
+            executable=str(DGGRID_EXECUTABLE),
+            working_dir=working_dir,
+            capture_logs=False,
+            silent=True
+        )
+        grid = dggrid_instance.grid_cell_polygons_for_extent(projection, resolution, clip_geom=clip_geom)
+
+    grid['name'] = pd.to_numeric(grid['name'])
+    return grid
+
+
+def _grid_cells_worker(args):
+    return grid_cells_for_extent(*args)
+
+
+def split_extent(geom, tile_size):
+    """Split a geometry into parts of at most tile_size x tile_size degrees
+
+    Returns
+    -------
+    list of shapely geometries
+        non-empty intersections of the geometry with a regular grid of tiles
+    """
+
+    minx, miny, maxx, maxy = geom.bounds
+    shapely.prepare(geom)
+
+    parts = []
+    x = minx
+    while x < maxx:
+        y = miny
+        while y < maxy:
+            tile = shapely.box(x, y, x + tile_size, y + tile_size)
+            if geom.intersects(tile):
+                part = shapely.intersection(geom, tile)
+                if not part.is_empty:
+                    parts.append(part)
+            y += tile_size
+        x += tile_size
+
+    return parts
+
+
+def aoi_hash(geom):
+    """Hash of a geometry, independent of vertex order and orientation"""
+
+    return hashlib.sha256(shapely.to_wkb(shapely.normalize(geom))).hexdigest()[:16]
+
+
+def grid_cells(aoi_geom, projection, resolution, tile_size=1, workers=None, cache=True, cache_dir=None):
+    """Generate DGGRID cells for an AOI, in parallel and cached on disk
+
+    The AOI is split into sub-extents of tile_size x tile_size degrees which are
+    generated in parallel worker processes, each with its own DGGRID working
+    directory. Cells crossing sub-extents are generated more than once and are
+    de-duplicated by their cell id. The resulting cell set is cached on disk, keyed
+    by projection, resolution and a hash of the AOI, so it is only generated once.
+
+    Parameters
+    ----------
+    aoi_geom : shapely geometry
+        AOI in EPSG:4326
+    projection : str
+        DGGRID projection, e.g. 'ISEA3H'
+    resolution : int
+        DGGRID resolution
+    tile_size : float, default=1
+        size of the sub-extents in degrees
+    workers : int, optional
+        number of worker processes, defaults to the number of CPUs
+    cache : bool, default=True
+        whether to read from and write to the cache
+    cache_dir : str or Path, optional
+        defaults to ~/.cache/sbae_point_analysis/dggrid
+
+    Returns
+    -------
+    GeoDataFrame
+        cells with DGGRID cell id in the name column, in EPSG:4326
+    """
+
+    cache_dir = Path(cache_dir) if cache_dir else CACHE_DIR
+    cache_file = cache_dir.joinpath(f'{projection}_{resolution}_{aoi_hash(aoi_geom)}.parquet')
+    if cache and cache_file.exists():
+        print(f' Using cached grid cells from {cache_file}')
+        return gpd.read_parquet(cache_file)
+
+    parts = split_extent(aoi_geom, tile_size)
+    args_list = [(projection, resolution, part) for part in parts]
+
+    if len(args_list) == 1:
+        grids = [_grid_cells_worker(args_list[0])]
+    else:
+        print(f' Generating grid cells for {len(args_list)} sub-extents in parallel')
+        grids = []
+        executor = Executor(executor="concurrent_processes", max_workers=workers)
+        for task in executor.as_completed(
+            func=_grid_cells_worker,
+            iterable=args_list
+        ):
+            grids.append(task.result())
+
+    # stitch and remove cells generated by more than one sub-extent
+    grid = pd.concat(grids, ignore_index=True)
+    grid = grid.drop_duplicates(subset='name').sort_values('name').reset_index(drop=True)
+
+    if cache:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so an interrupted run leaves no broken cache
+        tmp_file = cache_file.with_suffix('.tmp')
+        grid.to_parquet(tmp_file)
+        tmp_file.replace(cache_file)
+
+    return grid
@@ -0,0 +1,100 @@
+import ee
+import pandas as pd
+
+from helpers.ee.http import download
+from helpers.ee.scheduler import RequestScheduler
+from helpers.ee.get_time_series import get_time_series
+from helpers.ee.landsat.landsat_collection import landsat_collection
+from helpers.ee.ccdc import run_ccdc
+from helpers.ee.landtrendr import run_landtrendr
+from helpers.ee.global_products import sample_global_products_cell
+
+
+class EarthEngineBackend:
+    """Earth Engine behind the extraction pipeline of get_change_data
+
+    Bundles all calls get_change_data makes to Earth Engine, so the pipeline
+    can run against another implementation with the same methods, e.g. the
+    OfflineBackend. Point collections are ee.FeatureCollections.
+
+    All requests go through a RequestScheduler, which keeps them within the
+    quota and handles throttling for all threads together.
+
+    Parameters
+    ----------
+    scheduler : RequestScheduler, optional
+        defaults to a scheduler without rate limit
+    """
+
+    name = 'earthengine'
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler or RequestScheduler()
+
+    def size(self, fc):
+        """Number of points in a collection"""
+
+        return self.scheduler.call(fc.size().getInfo)
+
+    def image_collection(self, fc, config_dict):
+        """Landsat collection covering the points, for the whole period"""
+
+        ts_params = config_dict['ts_params']
+        aoi = ee.FeatureCollection(fc.geometry().convexHull())
+        return landsat_collection(
+            ts_params['start_calibration'],
+            ts_params['end_monitor'],
+            aoi,
+            **config_dict['lsat_params']
+        )
+
+    def point_coordinates(self, fc, point_id_name):
+        """Point ids and coordinates of a collection, downloaded once
+        
+        Returns
+        -------
+        DataFrame
+            with point id, lon and lat columns
+        """
+
+        points = fc.map(lambda feature: feature.set({
+            'lon': feature.geometry().coordinates().get(0),
+            'lat': feature.geometry().coordinates().get(1)
+        }))
+
+        def _download():
+            url = points.getDownloadURL('csv', selectors=[point_id_name, 'lon', 'lat'])
+            with download(url) as r:
+                r.raw.decode_content = True
+                return pd.read_csv(r.raw, usecols=[point_id_name, 'lon', 'lat'])
+
+        return self.scheduler.call(_download)
+
+    def chunk_points(self, fc, chunk, point_id_name):
+        """Points of a chunk of plan_chunks, as a collection built from its ids and coordinates
+
+        The points are sent along with each request, so no filtering of fc (nor
+        uploading the points still missing) is needed on Earth Engine.
+        """
+
+        return ee.FeatureCollection([
+            ee.Feature(ee.Geometry.Point(lon, lat), {point_id_name: point_id})
+            for point_id, (lon, lat) in zip(chunk['point_ids'], chunk['coordinates'])
+        ])
+
+    def get_time_series(self, coll, points, config_dict, start=None, pathrows=None):
+        return self.scheduler.call(get_time_series, coll.select(config_dict['ts_params']['bands']), points, config_dict, start, pathrows)
+
+    def run_ccdc(self, df, points, config_dict):
+        return self.scheduler.call(run_ccdc, df, points, config_dict)
+
+    def run_landtrendr(self, df, points, config_dict):
+        return self.scheduler.call(run_landtrendr, df, points, config_dict, tries=5)
+
+    def sample_global_products(self, df, points, config_dict):
+        return self.scheduler.call(sample_global_products_cell, df, points, config_dict)
+
+    def cleanup(self):
+        """Nothing is kept on Earth Engine, only report the requests that were made"""
+
+        self.scheduler.report()
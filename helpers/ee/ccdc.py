@@ -1,11 +1,11 @@
 from datetime import datetime as dt
 
 import ee
-import requests
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from retry import retry
+
+from helpers.ee.http import download
 
 def get_segments(ccdcAst, mask_1d):
     """
@@ -39,7 +39,6 @@ def transform_date(date):
     dates_float = 0 if dates_float == '1970.003' else dates_float
     return dates_float
     
-@retry(tries=3, delay=1, backoff=2)
 def run_ccdc(df, points, config_dict):
     
     ccdc_params = config_dict['ccdc_params']
@@ -133,9 +132,7 @@ def run_ccdc(df, points, config_dict):
         url = sampled_points.getDownloadUrl('geojson')
 
         # Handle downloading the actual pixels.
-        r = requests.get(url, stream=True)
-        if r.status_code != 200:
-            raise r.raise_for_status()
+        r = download(url)
 
         # write the FC to a geodataframe
         gdf = gpd.GeoDataFrame.from_features(r.json()).fillna(0)
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+def quadtree_chunks(x, y, max_points, bounds=None):
+    """Split points quadtree-style into chunks of at most max_points points
+
+    Starting from a square around all points, every square holding more than
+    max_points points is split into 4 quadrants, so chunks are large where
+    points are sparse and small where they are dense. Quadrants are half-open
+    (lower bound included, upper bound excluded), so every point ends up in
+    exactly one chunk. Points sharing the same location that still exceed
+    max_points are split by count.
+
+    Parameters
+    ----------
+    x, y : array-like
+        point coordinates
+    max_points : int
+        maximum number of points per chunk
+    bounds : tuple of float, optional
+        (minx, miny, maxx, maxy) of the root square, defaults to the square
+        around the points
+
+    Returns
+    -------
+    list of tuples
+        (bounds, indices) per non-empty chunk, with the indices into x and y,
+        in Z-order so that consecutive chunks are close to each other
+    """
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    max_points = max(int(max_points), 1)
+    if len(x) == 0:
+        return []
+
+    if bounds is None:
+        minx, miny = x.min(), y.min()
+        # square root cell, slightly larger so the maximum coordinates are inside
+        size = max(x.max() - minx, y.max() - miny) * (1 + 1e-9) + 1e-9
+        bounds = (minx, miny, minx + size, miny + size)
+
+    chunks = []
+    stack = [(bounds, np.arange(len(x)))]
+    while stack:
+
+        (minx, miny, maxx, maxy), idx = stack.pop()
+        if len(idx) <= max_points:
+            chunks.append(((minx, miny, maxx, maxy), idx))
+            continue
+
+        midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+        if midx in (minx, maxx) or midy in (miny, maxy):
+            # cannot be split any further, i.e. many points at the same location
+            for start in range(0, len(idx), max_points):
+                chunks.append(((minx, miny, maxx, maxy), idx[start:start+max_points]))
+            continue
+
+        east, north = x[idx] >= midx, y[idx] >= midy
+        quadrants = [
+            ((minx, miny, midx, midy), idx[~east & ~north]),
+            ((midx, miny, maxx, midy), idx[east & ~north]),
+            ((minx, midy, midx, maxy), idx[~east & north]),
+            ((midx, midy, maxx, maxy), idx[east & north])
+        ]
+        # reversed, so they are popped in Z-order
+        stack.extend((quadrant, sub_idx) for quadrant, sub_idx in reversed(quadrants) if len(sub_idx))
+
+    return chunks
+
+
+def plan_chunks(points, point_id_name, max_points_per_chunk):
+    """Plan processing chunks for a set of points
+
+    The quadtree leaves are mostly well below max_points_per_chunk, so
+    consecutive leaves (which are neighbours in Z-order) are merged as long as
+    they stay within max_points_per_chunk, to keep the number of requests low.
+
+    Parameters
+    ----------
+    points : DataFrame
+        with point id, lon and lat columns, e.g. from backend.point_coordinates
+    point_id_name : str
+    max_points_per_chunk : int
+
+    Returns
+    -------
+    list of dicts
+        with the chunk bounds (minx, miny, maxx, maxy) in EPSG:4326, the list
+        of point ids and the list of (lon, lat) coordinates of each chunk
+    """
+
+    leaves = quadtree_chunks(points['lon'].to_numpy(), points['lat'].to_numpy(), max_points_per_chunk)
+    point_ids = points[point_id_name].to_numpy()
+    coordinates = points[['lon', 'lat']].to_numpy()
+
+    chunks = []
+    for bounds, idx in leaves:
+        if chunks and len(chunks[-1]['point_ids']) + len(idx) <= max_points_per_chunk:
+            # extend the previous chunk by this leaf
+            chunk = chunks[-1]
+            chunk['bounds'] = (
+                min(chunk['bounds'][0], bounds[0]), min(chunk['bounds'][1], bounds[1]),
+                max(chunk['bounds'][2], bounds[2]), max(chunk['bounds'][3], bounds[3])
+            )
+            chunk['point_ids'] += point_ids[idx].tolist()
+            chunk['coordinates'] += coordinates[idx].tolist()
+        else:
+            chunks.append({'bounds': bounds, 'point_ids': point_ids[idx].tolist(), 'coordinates': coordinates[idx].tolist()})
+
+    return chunks
+
+
+def subset_chunk(chunk, point_ids):
+    """Chunk of plan_chunks reduced to the given point ids, e.g. those still missing"""
+
+    keep = set(point_ids)
+    selected = [(point_id, xy) for point_id, xy in zip(chunk['point_ids'], chunk['coordinates']) if point_id in keep]
+    return {
+        'bounds': chunk['bounds'],
+        'point_ids': [point_id for point_id, _ in selected],
+        'coordinates': [xy for _, xy in selected]
+    }
@@ -3,12 +3,31 @@ import time
 import ee
 import pandas as pd
 import geopandas as gpd
+from pandas.api.types import union_categoricals
 import numpy as np
-import requests
-from retry import retry
 
-@retry(tries=3, delay=1, backoff=2)
-def get_time_series(imageCollection, points, config_dict):
+from helpers.ee.http import download
+from helpers.ts_analysis.ragged import RaggedTimeSeries, to_day_numbers
+
+def get_time_series(imageCollection, points, config_dict, start=None, pathrows=None):
+    """Download the time-series of points from an image collection
+    
+    Parameters
+    ----------
+    imageCollection : ee.ImageCollection
+    points : ee.FeatureCollection
+    config_dict : dict
+    start : str or Timestamp, optional
+        only images from this date on, e.g. to update stored time-series
+    pathrows : dict, optional
+        point id -> path/row to use instead of the one with most images, see
+        structure_ts_data
+        
+    Returns
+    -------
+    GeoDataFrame or None
+        as returned by structure_ts_data
+    """
     
     bands = config_dict['ts_params']['bands']
     ee_bands = ee.List(config_dict['ts_params']['bands'])
@@ -17,7 +36,15 @@ def get_time_series(imageCollection, points, config_dict):
     
     # mask lsat collection for grid cell
     cell = points.geometry().convexHull(100)
+    
+    # add coordinates as properties, so we do not need to download the geometries
+    points = points.map(lambda feature: feature.set({
+        'lon': feature.geometry().coordinates().get(0),
+        'lat': feature.geometry().coordinates().get(1)
+    }))
     masked_coll = imageCollection.filterBounds(cell)
+    if start is not None:
+        masked_coll = masked_coll.filterDate(pd.Timestamp(start).strftime('%Y-%m-%d'), config_dict['ts_params']['end_monitor'])
     reducer = ee.Reducer.first().setOutputs(bands) if len(bands) == 1 else ee.Reducer.first()
     
     # mapping function to extract NDVI time-series from each image
@@ -39,72 +66,230 @@ def get_time_series(imageCollection, points, config_dict):
 
     # apply mapping ufnciton over landsat collection and get the url of the returned FC
     cell_fc = masked_coll.map(mapOverImgColl).flatten().filter(ee.Filter.neq(bands[0], -9999));
-    url = cell_fc.getDownloadUrl('geojson')
     
-    # Handle downloading the actual pixels.
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise r.raise_for_status()
+    # only download the properties needed, as csv (no repeated geometries and keys as in geojson)
+    url = cell_fc.getDownloadURL('csv', selectors=[point_id_name, 'imageID', 'lon', 'lat'] + bands)
     
-    # write the FC to a geodataframe
-    try:
-        point_gdf = gpd.GeoDataFrame.from_features(r.json())
-    except: # JSONDecodeError:
-        return None
+    # Handle downloading the actual pixels.
+    with download(url) as r:
+        
+        # parse the stream into a geodataframe, the connection goes back to the pool afterwards
+        r.raw.decode_content = True
+        point_gdf = read_ts_csv(r.raw, point_id_name, bands)
         
     if len(point_gdf) > 0:
-        return structure_ts_data(point_gdf, point_id_name, bands)
+        return structure_ts_data(point_gdf, point_id_name, bands, pathrows)
     else:
         return None
     
 
-def structure_ts_data(df, point_id_name, bands):
+def read_ts_csv(stream, point_id_name, bands, chunksize=50000):
+    """Parse the csv download of get_time_series incrementally
     
-    df.index = pd.DatetimeIndex(pd.to_datetime(df.imageID.apply(lambda x: x.split('_')[-1]), format='%Y%m%d'))
+    The stream is read in chunks of rows, which are converted to NumPy arrays
+    right away (float32 for the bands, categorical image ids), so the raw text
+    is never held in memory as a whole.
     
-    # loop over point_ids and run cusum
-    d = {}
-    for i, point in enumerate(df[point_id_name].unique()):
+    Parameters
+    ----------
+    stream : file-like
+        e.g. the raw stream of a requests response
+    point_id_name : str
+    bands : list of str
+    chunksize : int, default=50000
+        number of rows parsed at once
         
-        # read only orws of points and sort by date
-        sub = df[df[point_id_name] == point].sort_index()
+    Returns
+    -------
+    GeoDataFrame
+        one row per point and image, with point id, imageID, bands and geometry
+    """
+    
+    columns = [point_id_name, 'imageID', 'lon', 'lat'] + bands
+    dtypes = {'imageID': 'category', 'lon': np.float64, 'lat': np.float64, **{band: np.float32 for band in bands}}
+    
+    ids, image_ids, values = [], [], {col: [] for col in ['lon', 'lat'] + bands}
+    try:
+        for chunk in pd.read_csv(stream, usecols=columns, dtype=dtypes, chunksize=chunksize):
+            ids.append(chunk[point_id_name].to_numpy())
+            image_ids.append(chunk['imageID'])
+            for col in values:
+                values[col].append(chunk[col].to_numpy())
+    except pd.errors.EmptyDataError:
+        pass
         
-        #### LANDSAT ONLY ###########
-        sub['pathrow'] = sub.imageID.apply(lambda x: x.split('_')[-2])
+    if not ids:
+        return gpd.GeoDataFrame(columns=columns + ['geometry'], geometry='geometry')
+    
+    df = pd.DataFrame({
+        point_id_name: np.concatenate(ids),
+        'imageID': union_categoricals(image_ids, ignore_order=True),
+        **{band: np.concatenate(values[band]) for band in bands}
+    })
+    
+    geometry = gpd.points_from_xy(np.concatenate(values['lon']), np.concatenate(values['lat']))
+    return gpd.GeoDataFrame(df, geometry=geometry)
+    
 
-        # if more than one path row combination covers the point, we select only the one with the most images
-        if len(sub.pathrow.unique()) > 1:
-            # set an initil length
-            length = -1
-            # loop through pathrw combinations
-            for pathrow in sub.pathrow.unique():
-                # check length
-                l = len(sub[sub.pathrow == pathrow])
-                # compare ot previous length, and if higher reset pathrow and length variable
-                if l > length:
-                    pr = pathrow
-                    length = l
-            # finally filter sub df for pathrow with most images
-            sub = sub[sub.pathrow == pr]
-        #### LANDSAT ONLY ###########
-        
-        # still duplicates may appear between l9 and l8 that would make bfast crash, so we drop
-        sub = sub[~sub.index.duplicated(keep='first')]
-        
-        # fill ts dictionary
-        ts_dict= {}
-        for band in bands:
-            ts_dict.update({band: sub[band].tolist()})
+def structure_ts_data(df, point_id_name, bands, pathrows=None, ragged=False):
+    """Turn the per point and image rows into one row per point
+    
+    Dates and path/row are parsed once per unique image id, rows are sorted once by
+    point and date, the path/row with most images is selected per point (ties go to
+    the path/row appearing first) and duplicate dates (e.g. from L8 and L9) are
+    dropped, keeping the first.
+    
+    Parameters
+    ----------
+    df : DataFrame
+        one row per point and image, with point id, imageID, bands and geometry
+    point_id_name : str
+    bands : list of str
+    pathrows : dict, optional
+        point id -> path/row (e.g. '195054') to select instead of the one with
+        most images, so that new images extend a stored time-series of the same
+        path/row. Points without images of their path/row are left out.
+    ragged : bool, default=False
+        return the time-series as RaggedTimeSeries instead of dates and ts columns
+        
+    Returns
+    -------
+    GeoDataFrame
+        one row per point with point_idx, point id, dates, ts (dict of lists per band),
+        images, pathrow and geometry
+    RaggedTimeSeries
+        only with ragged, then the GeoDataFrame has no dates and ts columns
+    """
+    
+    # parse dates and path/row only once per image
+    image_ids = df['imageID'].astype('category')
+    image_codes = image_ids.cat.codes.to_numpy()
+    id_parts = pd.Series(image_ids.cat.categories.astype(str)).str.rsplit('_', n=2, expand=True)
+    image_dates = pd.to_datetime(id_parts[2], format='%Y%m%d').to_numpy()
+    image_pathrows, pathrow_names = pd.factorize(id_parts[1])
+    
+    dates = image_dates[image_codes]
+    row_pathrows = image_pathrows[image_codes]
+    
+    # point codes in order of first appearance
+    points, point_ids = pd.factorize(df[point_id_name], sort=False)
+    
+    # sort once by point and date (stable, so ties keep their original order)
+    order = np.lexsort((dates, points))
+    points, dates, row_pathrows = points[order], dates[order], row_pathrows[order]
+    
+    #### LANDSAT ONLY ###########
+    # if more than one path row combination covers the point, we select only the one with the most images
+    nr_pathrows = row_pathrows.max() + 1 if len(row_pathrows) else 1
+    keys, first_seen, counts = np.unique(points * nr_pathrows + row_pathrows, return_index=True, return_counts=True)
+    key_points = keys // nr_pathrows
+    ranking = np.lexsort((first_seen, -counts, key_points))
+    best = keys[ranking][np.r_[True, np.diff(key_points[ranking]) != 0]]
+    best_pathrow = np.empty(len(point_ids), dtype=row_pathrows.dtype)
+    best_pathrow[best // nr_pathrows] = best % nr_pathrows
+    if pathrows is not None:
+        # stick to the given path/row, points not covered by it get no rows (-1)
+        given = pd.Series(point_ids).map(pathrows)
+        best_pathrow = np.where(given.notna(), pathrow_names.get_indexer(given), best_pathrow)
+    keep = row_pathrows == best_pathrow[points]
+    order, points, dates = order[keep], points[keep], dates[keep]
+    #### LANDSAT ONLY ###########
+    
+    # still duplicates may appear between l9 and l8 that would make bfast crash, so we drop
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (points[1:] != points[:-1]) | (dates[1:] != dates[:-1])
+    
+    # apply selection
+    rows = order[keep]
+    points, dates = points[keep], pd.DatetimeIndex(dates[keep], name='imageID')
+    values = {band: df[band].to_numpy()[rows] for band in bands}
+    geometries = df.geometry.values[rows]
+    bounds = np.searchsorted(points, np.arange(len(point_ids) + 1))
+    
+    if ragged:
+        
+        # flat arrays as they are, only the points with observations
+        nonempty = np.flatnonzero(bounds[1:] > bounds[:-1])
+        if len(nonempty) == 0:
+            return None
+        
+        ts = RaggedTimeSeries(
+            point_ids[nonempty], bounds[nonempty], bounds[nonempty + 1], to_day_numbers(dates), 
+            {band: values[band].astype(np.float32) for band in bands}
+        )
+        gdf = gpd.GeoDataFrame({
+            'point_idx': np.arange(len(nonempty)),
+            point_id_name: point_ids[nonempty],
+            'images': ts.lengths,
+            'pathrow': pathrow_names[best_pathrow[nonempty]],
+            'geometry': geometries[bounds[nonempty]]
+        }).set_geometry('geometry')
+        return gdf, ts
+    
+    d = {}
+    for i, point in enumerate(point_ids):
+        
+        start, end = bounds[i], bounds[i+1]
+        if start == end:
+            continue
         
         # write everything to a dict
-        d[i] = {
-            'point_idx': i,
+        d[len(d)] = {
+            'point_idx': len(d),
              point_id_name: point,
-            'dates': sub.index,
-            'ts': ts_dict, 
-            'images': len(sub),
-            'geometry': sub.geometry.head(1).values[0]
+            'dates': dates[start:end],
+            'ts': {band: values[band][start:end].tolist() for band in bands}, 
+            'images': end - start,
+            'pathrow': pathrow_names[best_pathrow[i]],
+            'geometry': geometries[start]
         }
     
+    if not d:
+        return None
+    
     # turn the dict into a geodataframe and return
-    return gpd.GeoDataFrame(pd.DataFrame.from_dict(d, orient='index')).set_geometry('geometry')
\ No newline at end of file
+    return gpd.GeoDataFrame(pd.DataFrame.from_dict(d, orient='index')).set_geometry('geometry')
+
+
+def append_ts_data(df, new, point_id_name, bands):
+    """Extend time-series with those of later images
+    
+    Parameters
+    ----------
+    df : DataFrame
+        stored time-series, as returned by structure_ts_data
+    new : DataFrame or None
+        time-series of the images acquired since, as returned by structure_ts_data
+    point_id_name : str
+    bands : list of str
+        
+    Returns
+    -------
+    DataFrame
+        copy of df, where only dates after the last stored one are appended
+    """
+    
+    df = df.copy()
+    if new is None:
+        return df
+    
+    new = new.set_index(point_id_name)
+    all_dates, all_ts = list(df['dates']), list(df['ts'])
+    for i, point_id in enumerate(df[point_id_name]):
+        
+        if point_id not in new.index:
+            continue
+        
+        dates, new_dates = all_dates[i], new.at[point_id, 'dates']
+        later = new_dates > dates.max() if len(dates) else np.ones(len(new_dates), dtype=bool)
+        if not later.any():
+            continue
+        
+        ts, new_ts = all_ts[i], new.at[point_id, 'ts']
+        all_dates[i] = pd.DatetimeIndex(np.concatenate([dates.to_numpy(), new_dates[later].to_numpy()]), name='imageID')
+        all_ts[i] = {band: list(ts[band]) + np.asarray(new_ts[band])[later].tolist() for band in bands}
+    
+    df['dates'] = pd.Series(all_dates, index=df.index, dtype=object)
+    df['ts'] = pd.Series(all_ts, index=df.index, dtype=object)
+    df['images'] = [len(dates) for dates in all_dates]
+    return df
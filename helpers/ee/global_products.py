@@ -1,12 +1,11 @@
 from pathlib import Path 
 
 import ee
-import requests
 import pandas as pd
 import geopandas as gpd
-from retry import retry
 
-@retry(tries=3, delay=1, backoff=2)
+from helpers.ee.http import download
+
 def sample_global_products_cell(df, points, config_dict):
     
     # get config dict for global products
@@ -151,12 +150,16 @@ def sample_global_products_cell(df, points, config_dict):
     url = sampled_points.getDownloadUrl('geojson')
     
     # Handle downloading the actual pixels.
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise r.raise_for_status()
+    r = download(url)
     
     # write the FC to a geodataframe
     gdf = gpd.GeoDataFrame.from_features(r.json())
+    return merge_global_products(df, gdf, point_id_name)
+
+
+def merge_global_products(df, gdf, point_id_name):
+    """Add CEO columns to the sampled products and merge them into df"""
+    
     gdf['LON'] = gdf['geometry'].x
     gdf['LAT'] = gdf['geometry'].y
     
@@ -0,0 +1,132 @@
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# seconds to wait for the connection, and between two bytes of the download
+TIMEOUT = (30, 600)
+
+# default number of connections kept alive per host
+DEFAULT_POOL_SIZE = 10
+
+_session = None
+_pool_size = None
+_lock = threading.Lock()
+_timing_hooks = []
+
+
+def configure(pool_size=DEFAULT_POOL_SIZE):
+    """Set up the process-wide session with a connection pool of pool_size
+
+    Connections are kept alive and reused across requests and threads, so the
+    TLS handshake with the download endpoint is only done once per connection.
+    Call with the number of worker threads, so that no thread has to wait for or
+    open a new connection. Re-configuring with the same size keeps the pool.
+
+    Parameters
+    ----------
+    pool_size : int, default=10
+        maximum number of connections kept per host
+
+    Returns
+    -------
+    requests.Session
+    """
+
+    global _session, _pool_size
+    with _lock:
+        if _session is None or pool_size != _pool_size:
+
+            session = requests.Session()
+            # compressed transfers, decoded transparently
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.hooks['response'].append(_run_timing_hooks)
+
+            if _session is not None:
+                _session.close()
+            _session, _pool_size = session, pool_size
+
+        return _session
+
+
+def get_session():
+    """The process-wide session, set up with the default pool size if needed"""
+
+    return _session or configure()
+
+
+def add_timing_hook(hook):
+    """Register hook(url, status_code, seconds), called after each response
+
+    seconds is the time from sending the request until the response headers
+    have been parsed. The body of streamed downloads is read afterwards.
+    """
+
+    with _lock:
+        _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+
+    with _lock:
+        _timing_hooks.remove(hook)
+
+
+def _run_timing_hooks(response, *args, **kwargs):
+    for hook in list(_timing_hooks):
+        hook(response.url, response.status_code, response.elapsed.total_seconds())
+
+
+def download(url, stream=True):
+    """GET a url with the shared session, raising on HTTP errors
+
+    Returns
+    -------
+    requests.Response
+        with stream=True, the body is read (and decompressed) when consumed
+    """
+
+    r = get_session().get(url, stream=stream, timeout=TIMEOUT)
+    r.raise_for_status()
+
+    return r
+
+
+class RequestTimer:
+    """Collect request timings through a timing hook
+
+    Use as context manager, e.g.
+
+        with RequestTimer() as timer:
+            get_change_data(fc, config_dict)
+        print(timer.summary())
+    """
+
+    def __init__(self):
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url, status_code, seconds):
+        with self._lock:
+            self.timings.append((time.time(), url, status_code, seconds))
+
+    def __enter__(self):
+        add_timing_hook(self)
+        return self
+
+    def __exit__(self, *args):
+        remove_timing_hook(self)
+
+    def summary(self):
+        """Number of requests, and total and mean seconds until the response"""
+
+        seconds = [timing[3] for timing in self.timings]
+        return {
+            'requests': len(seconds),
+            'total_seconds': sum(seconds),
+            'mean_seconds': sum(seconds) / len(seconds) if seconds else 0
+        }
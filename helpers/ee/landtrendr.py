@@ -2,10 +2,9 @@ import ee
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import requests
-from retry import retry
 
-@retry(tries=5, delay=1, backoff=2)
+from helpers.ee.http import download
+
 def run_landtrendr(df, points, config_dict):
     
     # get necessary params
@@ -116,9 +115,7 @@ def run_landtrendr(df, points, config_dict):
     url = sampled_points.getDownloadUrl('geojson')
 
     # Handle downloading the actual pixels.
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise r.raise_for_status()
+    r = download(url)
     
     # write the FC to a geodataframe
     gdf = gpd.GeoDataFrame.from_features(r.json()).fillna(0)
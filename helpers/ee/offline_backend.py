@@ -0,0 +1,307 @@
+import time
+import zlib
+import threading
+from collections import Counter
+
+import ee
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from helpers.ee.get_time_series import structure_ts_data
+from helpers.ee.ccdc import transform_date
+from helpers.ee.global_products import merge_global_products
+from helpers.ee.scheduler import RequestScheduler
+
+# acquisition periods of the Landsat sensors served by the stand-in
+SENSORS = {
+    'LT05': ('1984-03-01', '2011-11-18'),
+    'LE07': ('1999-05-28', '2021-10-30'),
+    'LC08': ('2013-04-11', '2100-01-01'),
+    'LC09': ('2021-10-31', '2100-01-01')
+}
+
+# size of the path/row tiles in degrees, and how far their footprints overlap
+TILE_SIZE = 1.6
+TILE_OVERLAP = 0.15
+
+
+class OfflineBackend:
+    """Local stand-in for the EarthEngineBackend
+
+    Serves synthetic Landsat-like time-series and global product values, so that
+    get_change_data can be run, profiled and regression-tested without an Earth
+    Engine account. Point collections are GeoDataFrames (EPSG:4326) with a point
+    id column.
+
+    Images are acquired every 16 days on a regular grid of path/row tiles with
+    overlapping footprints, so points close to tile borders are covered by more
+    than one path/row, and LC09 images share their dates with LC08 images. Each
+    point has a seasonal signal with noise, cloud gaps and, for a share of points,
+    an abrupt drop at a random date of the monitoring period. All values are
+    derived from the point id and the seed, so they do not depend on chunking or
+    on the order of the requests.
+
+    Parameters
+    ----------
+    latency : float or tuple of float, default=0
+        seconds each request takes, or a (min, max) range to draw from
+    throttle_rate : float, default=0
+        probability of a chunk request (time-series, CCDC, LandTrendr, global
+        products) being throttled ('Too many concurrent aggregations')
+    error_rate : float, default=0
+        probability of a chunk request failing with 'User memory limit exceeded'
+    change_rate : float, default=0.3
+        share of points with a change in the monitoring period
+    cloud_rate : float, default=0.3
+        share of observations masked as clouds
+    seed : int, default=42
+    scheduler : RequestScheduler, optional
+        all requests go through it as with the EarthEngineBackend, defaults to a
+        scheduler without rate limit
+    """
+
+    name = 'offline'
+
+    def __init__(self, latency=0, throttle_rate=0, error_rate=0, change_rate=0.3, cloud_rate=0.3, seed=42, scheduler=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.scheduler = scheduler or RequestScheduler()
+        self.change_rate = change_rate
+        self.cloud_rate = cloud_rate
+        self.seed = seed
+        self.calls = Counter()
+        self.failures = Counter()
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(seed)
+
+    def _request(self, kind, fail=True):
+        self.scheduler.call(self._simulate_request, kind, fail)
+
+    def _simulate_request(self, kind, fail):
+        # simulate the round trip of a request, thread-safe counting and random draws
+        with self._lock:
+            self.calls[kind] += 1
+            latency = self._rng.uniform(*self.latency) if isinstance(self.latency, (tuple, list)) else self.latency
+            draw = self._rng.random() if fail else 1
+            if draw < self.throttle_rate + self.error_rate:
+                self.failures[kind] += 1
+
+        time.sleep(latency)
+        if draw < self.throttle_rate:
+            raise ee.EEException(f'Too many concurrent aggregations. ({kind}, offline backend)')
+        if draw < self.throttle_rate + self.error_rate:
+            raise ee.EEException(f'User memory limit exceeded. ({kind}, offline backend)')
+
+    def _point_rng(self, point_id, stream):
+        # random generator only depending on seed, point and purpose
+        return np.random.default_rng([self.seed, zlib.crc32(str(point_id).encode()), stream])
+
+    def _uniform(self, point_id, stream, days):
+        # uniform draws per point, purpose and day (splitmix64), independent of the requested period
+        with np.errstate(over='ignore'):
+            key = ((self.seed * 0x9e3779b97f4a7c15 + zlib.crc32(str(point_id).encode())) * 64 + stream) % 2 ** 44
+            x = np.asarray(days, dtype=np.uint64) + np.uint64(key << 20)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+            x = x ^ (x >> np.uint64(31))
+        return (x >> np.uint64(11)).astype(np.float64) / 2 ** 53
+
+    def _change(self, point_id, config_dict):
+        # date and magnitude of the change of a point, None if it has no change
+        rng = self._point_rng(point_id, 0)
+        has_change, position, magnitude = rng.random(), rng.random(), rng.uniform(1500, 5000)
+        if has_change >= self.change_rate:
+            return None
+
+        start = pd.Timestamp(config_dict['ts_params']['start_monitor'])
+        end = pd.Timestamp(config_dict['ts_params']['end_monitor'])
+        return start + (end - start) * position, magnitude
+
+    def size(self, fc):
+        self._request('size', fail=False)
+        return len(fc)
+
+    def image_collection(self, fc, config_dict):
+        """Catalogue of the synthetic images covering the points
+
+        Returns
+        -------
+        DataFrame
+            one row per image with imageID, date, path/row and the tile bounds
+        """
+
+        self._request('image_collection', fail=False)
+        ts_params = config_dict['ts_params']
+        start, end = pd.Timestamp(ts_params['start_calibration']), pd.Timestamp(ts_params['end_monitor'])
+        minx, miny, maxx, maxy = fc.total_bounds
+
+        images = []
+        for tile_x in range(int(np.floor((minx - TILE_OVERLAP) / TILE_SIZE)), int(np.floor((maxx + TILE_OVERLAP) / TILE_SIZE)) + 1):
+            for tile_y in range(int(np.floor((miny - TILE_OVERLAP) / TILE_SIZE)), int(np.floor((maxy + TILE_OVERLAP) / TILE_SIZE)) + 1):
+
+                path, row = (180 - tile_x) % 233 + 1, 60 - tile_y
+                # every path has its own acquisition days
+                dates = pd.date_range(start + pd.Timedelta(days=path % 16), end, freq='16D')
+                for sensor, (first, last) in SENSORS.items():
+                    # L7 flies 8 days apart from L5 and L8
+                    sensor_dates = dates + pd.Timedelta(days=8) if sensor == 'LE07' else dates
+                    sensor_dates = sensor_dates[(sensor_dates >= first) & (sensor_dates <= min(pd.Timestamp(last), end))]
+                    images.append(pd.DataFrame({
+                        'imageID': [f'{sensor}_{path:03d}{row:03d}_{date:%Y%m%d}' for date in sensor_dates],
+                        'date': sensor_dates,
+                        'pathrow': f'{path:03d}{row:03d}',
+                        'minx': tile_x * TILE_SIZE - TILE_OVERLAP,
+                        'miny': tile_y * TILE_SIZE - TILE_OVERLAP,
+                        'maxx': (tile_x + 1) * TILE_SIZE + TILE_OVERLAP,
+                        'maxy': (tile_y + 1) * TILE_SIZE + TILE_OVERLAP
+                    }))
+
+        return pd.concat(images, ignore_index=True).sort_values(['date', 'imageID'], ignore_index=True)
+
+    def point_coordinates(self, fc, point_id_name):
+        self._request('point_coordinates', fail=False)
+        return pd.DataFrame({point_id_name: fc[point_id_name].to_numpy(), 'lon': fc.geometry.x, 'lat': fc.geometry.y})
+
+    def chunk_points(self, fc, chunk, point_id_name):
+        """Points of a chunk of plan_chunks, built from its ids and coordinates"""
+
+        return gpd.GeoDataFrame(
+            {point_id_name: chunk['point_ids']},
+            geometry=gpd.points_from_xy(*zip(*chunk['coordinates'])) if chunk['point_ids'] else [],
+            crs='EPSG:4326'
+        )
+
+    def get_time_series(self, coll, points, config_dict, start=None, pathrows=None):
+        """Synthetic time-series of the points, structured as by get_time_series"""
+
+        self._request('get_time_series')
+        ts_params = config_dict['ts_params']
+        bands, point_id_name = ts_params['bands'], ts_params['point_id']
+        if start is not None:
+            coll = coll[coll.date >= pd.Timestamp(start)]
+
+        dfs = []
+        for point_id, geometry in zip(points[point_id_name], points.geometry):
+
+            # images whose footprint covers the point
+            x, y = geometry.x, geometry.y
+            images = coll[(coll.minx <= x) & (coll.maxx > x) & (coll.miny <= y) & (coll.maxy > y)]
+
+            # clouds and noise only depend on point and date, so that any period gives the same values
+            days = (images.date - pd.Timestamp('1970-01-01')).dt.days.to_numpy()
+            clear = self._uniform(point_id, 1, days) >= self.cloud_rate
+            images, days = images[clear], days[clear]
+            if len(images) == 0:
+                continue
+
+            # seasonal signal with noise per band, and an abrupt drop in case of change
+            rng = self._point_rng(point_id, 1)
+            doy = images.date.dt.dayofyear.to_numpy()
+            change = self._change(point_id, config_dict)
+            drop = np.where(images.date >= change[0], change[1], 0) if change else 0
+            df = pd.DataFrame({point_id_name: point_id, 'imageID': images.imageID.to_numpy()})
+            for i, band in enumerate(bands):
+                base = 2000 + zlib.crc32(band.encode()) % 6000
+                season = 300 * np.sin(2 * np.pi * (doy + rng.uniform(0, 365)) / 365)
+                # Box-Muller on two draws per date
+                u1, u2 = self._uniform(point_id, 2 + 2 * i, days), self._uniform(point_id, 3 + 2 * i, days)
+                noise = 150 * np.sqrt(-2 * np.log(1 - u1)) * np.cos(2 * np.pi * u2)
+                df[band] = (base + season - drop + noise).astype(np.float32)
+
+            df['geometry'] = geometry
+            dfs.append(df)
+
+        if not dfs:
+            return None
+
+        point_gdf = gpd.GeoDataFrame(pd.concat(dfs, ignore_index=True), geometry='geometry')
+        return structure_ts_data(point_gdf, point_id_name, bands, pathrows)
+
+    def run_ccdc(self, df, points, config_dict):
+        """CCDC change date and magnitude of the synthetic change"""
+
+        self._request('run_ccdc')
+        point_id_name = config_dict['ts_params']['point_id']
+
+        results = []
+        for point_id in points[point_id_name]:
+            change = self._change(point_id, config_dict)
+            results.append({
+                point_id_name: point_id,
+                'ccdc_change_date': transform_date(change[0].timestamp() * 1000) if change else 0,
+                'ccdc_magnitude': -change[1] if change else 0
+            })
+
+        return pd.merge(df, pd.DataFrame(results), on=point_id_name)
+
+    def run_landtrendr(self, df, points, config_dict):
+        """LandTrendr segment of the synthetic change"""
+
+        self._request('run_landtrendr')
+        point_id_name = config_dict['ts_params']['point_id']
+
+        results = []
+        for point_id in points[point_id_name]:
+            change = self._change(point_id, config_dict)
+            results.append({
+                point_id_name: point_id,
+                'ltr_magnitude': change[1] if change else 0,
+                'ltr_dur': 1 if change else 0,
+                'ltr_yod': change[0].year if change else 0,
+                'ltr_rate': change[1] if change else 0,
+                'ltr_end_year': change[0].year if change else 0
+            })
+
+        return pd.merge(df, pd.DataFrame(results), on=point_id_name)
+
+    def sample_global_products(self, df, points, config_dict):
+        """Plausible values of the global products enabled in the config"""
+
+        self._request('sample_global_products')
+        config = config_dict['global_products']
+        point_id_name = config_dict['ts_params']['point_id']
+        start_year = int(config_dict['ts_params']['start_monitor'][0:4])
+        end_year = int(config_dict['ts_params']['end_monitor'][0:4])
+
+        rows = []
+        for point_id in points[point_id_name]:
+
+            rng = self._point_rng(point_id, 2)
+            change = self._change(point_id, config_dict)
+            loss_year = change[0].year - 2000 if change and 2000 < change[0].year <= 2020 else 0
+            row = {point_id_name: point_id}
+
+            if config['gfc']:
+                row.update(gfc_tc00=rng.integers(0, 101), gfc_loss=int(loss_year > 0), gfc_lossyear=loss_year, gfc_gain=int(rng.random() < 0.02))
+            if config['esa_lc20']:
+                row.update(esa_lc20=rng.choice([10, 20, 30, 40, 50, 60, 80, 90, 95]))
+            if config['tmf']:
+                row.update(tmf_sub=rng.integers(10, 90), tmf_main=rng.integers(1, 7), tmf_degyear=0, tmf_defyear=loss_year + 2000 if loss_year else 0)
+            if config['tmf_years']:
+                row.update({f'tmf_{year}': rng.integers(1, 7) for year in range(max(start_year, 1990), min(end_year, 2020) + 1)})
+            if config['esri_lc']:
+                row.update(esri_lc20=rng.integers(1, 11))
+            if config['lang_tree_height']:
+                row.update(lang_tree_height=rng.integers(0, 40))
+            if config['potapov_tree_height']:
+                row.update(potapov_tree_height=rng.integers(0, 40))
+            # dynamic world starts in mid 2015
+            if config['dynamic_world_tree_prob'] and end_year >= 2016:
+                low, high = np.sort(rng.integers(0, 101, 2))
+                row.update(dw_tree_prob_mean=(low + high) // 2, dw_tree_prob__min=low, dw_tree_prob__max=high, dw_tree_prob__stdDev=(high - low) // 4)
+            if config['dynamic_world_class_mode'] and end_year >= 2016:
+                row.update(dw_class_mode=rng.integers(0, 9))
+            if config['elevation']:
+                row.update(elevation=rng.uniform(0, 1000), slope=rng.uniform(0, 30), aspect=rng.uniform(0, 360))
+            rows.append(row)
+
+        gdf = gpd.GeoDataFrame(rows, geometry=points.geometry.values)
+        return merge_global_products(df, gdf, point_id_name)
+
+    def cleanup(self):
+        """Nothing is kept remotely, only report the requests that were made"""
+
+        self.scheduler.report()
+        print(f' Offline backend requests: {dict(self.calls)}, failed: {dict(self.failures)}')
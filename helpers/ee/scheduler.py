@@ -0,0 +1,191 @@
+import time
+import random
+import threading
+
+import requests
+
+# parts of error messages by which Earth Engine signals throttling
+THROTTLING_MESSAGES = [
+    'too many concurrent aggregations',
+    'too many requests',
+    'request rate or concurrency limit',
+    'quota exceeded',
+    'rate limit'
+]
+
+# errors that will not go away by asking again with the same chunk
+PERMANENT_MESSAGES = [
+    'memory limit exceeded',
+    'computation timed out',
+    'does not exist'
+]
+
+# HTTP status codes of throttled downloads
+THROTTLING_STATUS_CODES = [429, 503]
+
+
+def is_throttling(error):
+    """Whether an error means the request was throttled"""
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in THROTTLING_STATUS_CODES
+
+    message = str(error).lower()
+    return any(part in message for part in THROTTLING_MESSAGES)
+
+
+def is_permanent(error):
+    """Whether an error will occur again when retrying the same request"""
+
+    message = str(error).lower()
+    return any(part in message for part in PERMANENT_MESSAGES)
+
+
+class RequestScheduler:
+    """Central scheduler for the requests to Earth Engine
+
+    Every request takes a token from a bucket refilled at rate tokens per second,
+    holding at most burst tokens, so all threads together stay within the quota.
+    Throttling errors (HTTP 429, 'Too many concurrent aggregations', ...) pause
+    all threads for an exponentially growing, jittered delay and the request is
+    repeated, so throttling slows the run down instead of failing chunks. Each
+    successful request shortens the next pause again. Other errors are retried
+    per request with an exponential delay, as with the retry decorator, except
+    for errors that would occur again anyway (e.g. memory limit exceeded), which
+    are raised right away so the chunk is split into smaller ones.
+
+    Parameters
+    ----------
+    rate : float, optional
+        requests per second, no limit if None
+    burst : int, optional
+        size of the token bucket, defaults to rate (at least 1)
+    tries : int, default=3
+        attempts per request for errors other than throttling
+    delay : float, default=1
+        seconds before the first retry of a failed request
+    backoff : float, default=2
+        factor by which the retry delay grows
+    max_throttled : int, default=20
+        how often a request is repeated after being throttled
+    throttle_delay : float, default=1
+        initial global pause after throttling, in seconds
+    max_throttle_delay : float, default=120
+        maximum global pause, in seconds
+    jitter : float, default=0.5
+        pauses are drawn within +-jitter of their nominal length, so threads
+        do not come back all at the same time
+    """
+
+    def __init__(self, rate=None, burst=None, tries=3, delay=1, backoff=2, max_throttled=20,
+                 throttle_delay=1, max_throttle_delay=120, jitter=0.5, sleep=time.sleep, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_throttled = max_throttled
+        self.throttle_delay = throttle_delay
+        self.max_throttle_delay = max_throttle_delay
+        self.jitter = jitter
+        self.sleep = sleep
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last_refill = clock()
+        self._paused_until = 0
+        self._throttle_level = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'retried': 0, 'failed': 0, 'waited': 0.}
+
+    @classmethod
+    def from_config(cls, config_dict):
+        """Scheduler with the optional requests_per_second and request_burst of a config"""
+
+        return cls(rate=config_dict.get('requests_per_second'), burst=config_dict.get('request_burst'))
+
+    def acquire(self):
+        """Block until the global pause is over and a token is available"""
+
+        while True:
+            with self._lock:
+                now = self.clock()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+
+                    # refill the bucket
+                    self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                    self._last_refill = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    wait = (1 - self._tokens) / self.rate
+
+                self.stats['waited'] += wait
+
+            self.sleep(wait)
+
+    def _throttled(self):
+        with self._lock:
+            self.stats['throttled'] += 1
+            pause = min(self.throttle_delay * 2 ** self._throttle_level, self.max_throttle_delay)
+            pause *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._paused_until = max(self._paused_until, self.clock() + pause)
+            self._throttle_level += 1
+
+    def _succeeded(self):
+        with self._lock:
+            self._throttle_level = max(self._throttle_level - 1, 0)
+
+    def call(self, func, *args, tries=None, **kwargs):
+        """Run func(*args, **kwargs) as a scheduled request
+
+        Parameters
+        ----------
+        func : callable
+        tries : int, optional
+            overrides the attempts for errors other than throttling
+        """
+
+        tries = tries or self.tries
+        attempt, throttled = 1, 0
+        while True:
+
+            self.acquire()
+            with self._lock:
+                self.stats['requests'] += 1
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+
+                if is_throttling(e) and throttled < self.max_throttled:
+                    throttled += 1
+                    self._throttled()
+                    continue
+
+                if is_permanent(e) or attempt >= tries:
+                    with self._lock:
+                        self.stats['failed'] += 1
+                    raise
+
+                with self._lock:
+                    self.stats['retried'] += 1
+                self.sleep(self.delay * self.backoff ** (attempt - 1))
+                attempt += 1
+                continue
+
+            self._succeeded()
+            return result
+
+    def report(self):
+        """Print the number of requests, throttled, retried and failed ones"""
+
+        print(
+            f' Requests: {self.stats["requests"]}, throttled: {self.stats["throttled"]}, '
+            f'retried: {self.stats["retried"]}, failed: {self.stats["failed"]}, '
+            f'waited for rate limit or throttling: {self.stats["waited"]:.1f}s'
+        )
@@ -0,0 +1,132 @@
+import time
+
+import ee
+
+# task states after which a task will not change anymore
+FINISHED_STATES = ['COMPLETED', 'FAILED', 'CANCELLED']
+
+
+def _state(state):
+    # ee.batch.Task.State is a str enum, we only want the plain string
+    return getattr(state, 'value', state)
+
+
+class TaskManager:
+    """Submit and monitor Earth Engine batch tasks
+
+    All tasks are started right away, so they run concurrently on the EE side.
+    wait() then polls the states of all pending tasks at once with a single
+    task listing per round, with an exponentially growing interval, and reports
+    progress and failures per task.
+
+    Parameters
+    ----------
+    batch : module, optional
+        the ee.batch module, or a local stand-in providing Export.table.toAsset
+        and Task.list with the same interface. Defaults to ee.batch.
+    initial_delay : float, default=5
+        seconds to wait before the first poll
+    max_delay : float, default=60
+        maximum number of seconds between two polls
+    backoff : float, default=2
+        factor by which the polling interval grows
+    sleep : callable, default=time.sleep
+    """
+
+    def __init__(self, batch=None, initial_delay=5, max_delay=60, backoff=2, sleep=time.sleep):
+        self.batch = batch if batch is not None else ee.batch
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.sleep = sleep
+        self.tasks = {}
+        self.states = {}
+        self.errors = {}
+
+    def submit(self, task, name=None):
+        """Start a task and register it under name (defaults to the task id)"""
+
+        task.start()
+        name = name or task.id
+        self.tasks[name] = task
+        self.states[name] = 'READY'
+        return task
+
+    def export_table_to_asset(self, collection, description, asset_id):
+        """Start an export of a FeatureCollection to an asset"""
+
+        task = self.batch.Export.table.toAsset(
+            collection = collection,
+            description = description,
+            assetId = asset_id
+        )
+        return self.submit(task, description)
+
+    def pending(self):
+        return [name for name, state in self.states.items() if state not in FINISHED_STATES]
+
+    def poll(self):
+        """Update the states of all pending tasks
+
+        Returns
+        -------
+        list of str
+            names of the tasks that changed state
+        """
+
+        # one listing for all tasks instead of one request per task
+        listed = {task.id: _state(task.state) for task in self.batch.Task.list()}
+
+        changed = []
+        for name in self.pending():
+            task = self.tasks[name]
+            if task.id in listed:
+                state = listed[task.id]
+            else:
+                # tasks may take a moment to appear in the listing
+                state = _state(task.status()['state'])
+
+            if state in ['FAILED', 'CANCELLED']:
+                self.errors[name] = task.status().get('error_message', state)
+
+            if state != self.states[name]:
+                self.states[name] = state
+                changed.append(name)
+
+        return changed
+
+    def wait(self, raise_on_failure=True):
+        """Block until all submitted tasks are finished
+
+        Parameters
+        ----------
+        raise_on_failure : bool, default=True
+            raise a RuntimeError if any of the tasks failed or was cancelled
+
+        Returns
+        -------
+        dict
+            final state per task name
+        """
+
+        delay = self.initial_delay
+        total = len(self.tasks)
+        while self.pending():
+
+            self.sleep(delay)
+            for name in self.poll():
+                done = total - len(self.pending())
+                message = f' Task {name}: {self.states[name]} ({done}/{total} finished)'
+                if name in self.errors:
+                    message += f' - {self.errors[name]}'
+                print(message)
+
+            delay = min(delay * self.backoff, self.max_delay)
+
+        if raise_on_failure and self.errors:
+            raise RuntimeError(
+                f' ERROR: {len(self.errors)} of {total} Earth Engine tasks failed: ' +
+                ', '.join(f'{name} ({error})' for name, error in self.errors.items())
+            )
+
+        return dict(self.states)
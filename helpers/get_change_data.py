@@ -1,188 +1,95 @@
-import ee
+import os
 import json
 import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import geopandas as gpd
 from pathlib import Path
-from godale import Executor
 from datetime import timedelta
+from godale import Executor
 
-from helpers.ee.get_time_series import get_time_series
-from helpers.ee.util import processing_grid
-from helpers.ee.landsat.landsat_collection import landsat_collection
-from helpers.ee.ccdc import run_ccdc
-from helpers.ee.landtrendr import run_landtrendr
-from helpers.ee.global_products import sample_global_products_cell
+from helpers.ee.backend import EarthEngineBackend
+from helpers.ee.scheduler import RequestScheduler
+from helpers.ee.chunks import plan_chunks, subset_chunk
+from helpers.ee.get_time_series import append_ts_data
+from helpers.pipeline import run_pipeline
+from helpers.ee import http
+from helpers.parquet import write_results_parquet, read_results_parquet
+from helpers.ts_cache import TimeSeriesCache
+from helpers.checkpoints import CheckpointStore, chunk_key
 
 from helpers.ts_analysis.cusum import run_cusum_deforest, cusum_deforest
 from helpers.ts_analysis.bfast_wrapper import run_bfast_monitor
 from helpers.ts_analysis.bootstrap_slope import run_bs_slope
 from helpers.ts_analysis.timescan import run_timescan_metrics
 from helpers.ts_analysis.jrc_nrt import run_jrc_nrt
-from helpers.ts_analysis.helpers import subset_ts, remove_outliers, smooth_ts
+from helpers.ts_analysis.helpers import remove_outliers, smooth_ts
+from helpers.ts_analysis.ragged import RaggedTimeSeries
 
 
-def upload_tmp_asset(asset_root, fc, asset_name, create_folder=True):
+def _algorithms(config_dict):
     
-    # create temporary folder
-    try:
-        print(' Deleting temporary folder/assets')
-        child_assets = ee.data.listAssets({'parent': f'{asset_root}/tmp_sbae'})['assets']
-        for i, ass in enumerate(child_assets):
-            ee.data.deleteAsset(ass['id']) 
-
-        ee.data.deleteAsset(f'{asset_root}/tmp_sbae')
-    except:
-        pass
-
-    print(' Creating temporary folder')
-    # create tmp folder in case not there
-    ee.data.createAsset({'type': 'folder'}, f'{asset_root}/tmp_sbae')
-
-    # export 
-    print(' Exporting table of (missing) points as temporary Earth Engine asset.')
-    exportTask = ee.batch.Export.table.toAsset(
-                    collection = fc,
-                    description = asset_name,
-                    assetId = f'{asset_root}/tmp_sbae/{asset_name}'
-                )
-    exportTask.start()
-
-    finished = False
-    while finished == False:
-        
-        # check every 10 seconds
-        time.sleep(10)
-        state = exportTask.status()['state']
-
-        if state == 'COMPLETED':
-            finished = True
-        elif state not in ['COMPLETED', 'READY', 'RUNNING']:
-            raise RuntimeError(
-                ' ERROR: Upload of the temporary point asset to Earth Engine has failed. Please re-run the notebook.\n'
-                ' NOTE that already processed data is not lost.'
-            ) 
-        else:
-            finished = False
-
-    print(' Exporting table of (missing) points was successful.')    
-    return ee.FeatureCollection(f'{asset_root}/tmp_sbae/{asset_name}')
-
-
-def upload_missing_points(df, point_id_name, fc, asset_name):
+    # get algorithms from config file
+    return {
+        'bfast': config_dict['bfast_params']['run'],
+        'cusum': config_dict['cusum_params']['run'],
+        'ccdc': config_dict['ccdc_params']['run'],
+        'landtrendr': config_dict['landtrendr_params']['run'],
+        'ts_metrics': config_dict['ts_metrics_params']['run'],
+        'jrc_nrt': config_dict['jrc_nrt_params']['run'],
+        'bs_slope': config_dict['bs_slope_params']['run'],
+        'glb_prd': config_dict['global_products']['run']
+    }
+
+
+def fetch_chunk_data(sat_coll, cell_fc, config_file, backend=None, ts_cache=None, chunk=None):
+    """I/O part of the processing of a chunk
     
-    # get users asset root
-    asset_root = ee.data.getAssetRoots()[0]['id']
+    Downloads the time-series (with outliers removed and smoothed if set), runs
+    the server-side algorithms (CCDC, LandTrendr) and samples the global products.
+    With a ts_cache and the chunk (of plan_chunks), time-series are read from the
+    cache first and only the missing ones are downloaded, and added to the cache.
     
-    # in case points have been processed
-    if df is not None:
-        # create a list of point_ids already processed
-        processed_points = df[point_id_name].tolist()
-
-        # filter fc by processed points
-        iterative_fc = fc.filter(ee.Filter.inList(point_id_name, ee.List(processed_points)).Not())
-
-        # upload ot new fc
-        iterative_fc = upload_tmp_asset(asset_root, iterative_fc, asset_name)
-
-        # calculate size
-        left_to_process = iterative_fc.size().getInfo()
-        print(f' Found already processed files. Will only consider missing points.')
-        print(f' Nr of missing plots: {left_to_process}')
-        
-    # in case no points have been processed yet
-    else:
-        
-        try:
-            print(' Trying to delete temporary Earth Engine folder/assets from previous runs.')
-            child_assets = ee.data.listAssets({'parent': f'{asset_root}/tmp_sbae'})['assets']
-            for i, ass in enumerate(child_assets):
-                ee.data.deleteAsset(ass['id']) 
-            
-            ee.data.deleteAsset(f'{asset_root}/tmp_sbae')
-        except:
-            pass
-
-        print(' Creating temporary folder')
-        # create tmp folder in case not there
-        ee.data.createAsset({'type': 'folder'}, f'{asset_root}/tmp_sbae')
-        
-        iterative_fc = fc
-        left_to_process = fc.size().getInfo()
-        print(f' Nr of plots to process: {left_to_process}')
-        
-    return iterative_fc, left_to_process
-
-
-def aggregate_tmp_files(tmpdir):
+    Returns
+    -------
+    tuple
+        time-series DataFrame (or None) and global products GeoDataFrame (or None)
+    """
     
-    # initialize df for later testing
-    df = None
+    # the real Earth Engine, if not set otherwise
+    backend = backend or EarthEngineBackend()
     
-    # check if data has been already processed, and use those points
-    tmp_files = tmpdir.glob('tmp_results_*.pickle')
-    for file in tmp_files:
-
-        df = pd.concat([df, pd.read_pickle(file)], ignore_index=True) if df is not None else pd.read_pickle(file)
-        file.unlink()
-
-    # check if a tmp df file is there
-    tmp_pckl = tmpdir.joinpath('tmp_df.pickle')
-    if tmp_pckl.exists():
-        
-        # in case we have both, tmp-pickle and recent tmp results data
-        if df is not None:  
-            df = pd.concat([df, pd.read_pickle(tmp_pckl)], ignore_index=True)
-        # in case we only have a temp pickle
-        else:  
-            df = pd.read_pickle(tmp_pckl)
-    
-    if df is not None:
-        df.to_pickle(tmp_pckl)
-        
-    # remove noresults tmp files
-    tmp_files = tmpdir.glob('tmp_noresults*.txt')
-    for file in tmp_files:
-        file.unlink()
-
-    return df
-    
-
-def extract_to_df(sat_coll, cell_fc, config_file):
-    
-    # create config file
+    # create config file (read per chunk, as the ccdc and landtrendr routines modify it)
     with open(config_file) as f:
         config_dict = json.load(f)
     
-    # get algorithms from config file
-    bfast = config_dict['bfast_params']['run']
-    cusum = config_dict['cusum_params']['run']
-    ccdc = config_dict['ccdc_params']['run']
-    landtrendr = config_dict['landtrendr_params']['run']
-    ts_metrics = config_dict['ts_metrics_params']['run']
-    jrc_nrt = config_dict['jrc_nrt_params']['run']
-    bs_slope = config_dict['bs_slope_params']['run']
-    glb_prd = config_dict['global_products']['run']
+    algorithms = _algorithms(config_dict)
     
     # get parameters from configuration file
     ts_params = config_dict['ts_params']
     bands = ts_params['bands']
     ts_band = ts_params['ts_band']
-    max_cc = ts_params['max_cc']
     
     # get the timeseries data
     df = None 
-    if bfast or cusum or ts_metrics or bs_slope or ccdc or landtrendr or jrc_nrt:
+    if any(run for algorithm, run in algorithms.items() if algorithm != 'glb_prd'):
 
         # extract time-series
-        df = get_time_series(sat_coll.select(bands), cell_fc, config_dict)
+        if ts_cache is not None and chunk is not None:
+            df = get_cached_time_series(sat_coll, cell_fc, config_dict, backend, ts_cache, chunk)
+        else:
+            df = backend.get_time_series(sat_coll, cell_fc, config_dict)
+        
+        # the path/row is only needed to extend stored time-series later on
+        df = df.drop(columns='pathrow') if df is not None and 'pathrow' in df.columns else df
         
         # remove outliers and smooth if set
         df = remove_outliers(df, bands, ts_band) if ts_params['outlier_removal'] else df     
         df = smooth_ts(df, bands) if ts_params['smooth_ts'] else df
         
         # run ccdc
-        if ccdc:
+        if algorithms['ccdc']:
 
             # check taht we have all bands
             check_bpb = all(item in bands for item in config_dict['ccdc_params']['breakpointBands'])
@@ -196,39 +103,198 @@ def extract_to_df(sat_coll, cell_fc, config_file):
                     ' Warning: Skipping CCDC as not all breakpoint bands are available in the time-series data'
                 )
 
-            df = run_ccdc(df, cell_fc, config_dict)
+            df = backend.run_ccdc(df, cell_fc, config_dict)
             
         # run landtrendr
-        df = run_landtrendr(df, cell_fc, config_dict) if landtrendr else df
+        df = backend.run_landtrendr(df, cell_fc, config_dict) if algorithms['landtrendr'] else df
+    
+    # sample global products, merged in after the local analysis
+    products = backend.sample_global_products(None, cell_fc, config_dict) if algorithms['glb_prd'] else None
+    
+    return df, products
+
+
+def get_cached_time_series(sat_coll, cell_fc, config_dict, backend, ts_cache, chunk):
+    """Time-series of a chunk, from the cache where available and downloaded otherwise"""
+    
+    point_id_name = config_dict['ts_params']['point_id']
+    
+    # read what we have, and only download the rest
+    df = ts_cache.read(chunk['point_ids'])
+    cached = set(df[point_id_name].tolist()) if df is not None else set()
+    missing = [point_id for point_id in chunk['point_ids'] if point_id not in cached]
+    
+    if missing:
+        missing_fc = backend.chunk_points(cell_fc, subset_chunk(chunk, missing), point_id_name) if cached else cell_fc
+        fetched = backend.get_time_series(sat_coll, missing_fc, config_dict)
+        ts_cache.write(fetched)
+        parts = [part for part in [df, fetched] if part is not None]
+        df = pd.concat(parts, ignore_index=True) if parts else None
+    
+    if df is None:
+        return None
+    
+    # point_idx is the position within the chunk
+    df['point_idx'] = range(len(df))
+    return gpd.GeoDataFrame(df).set_geometry('geometry')
+
+
+def update_cached_time_series(sat_coll, fc, config_dict, backend, ts_cache, chunk):
+    """Extend the cached time-series of a chunk with the images acquired since they were downloaded
+    
+    Only images after the earliest last acquisition of the chunk are requested,
+    of the path/row of the stored time-series, and only dates after each point's
+    last acquisition are appended.
+    
+    Returns
+    -------
+    list
+        ids of the points that got new images
+    """
+    
+    point_id_name = config_dict['ts_params']['point_id']
+    stored = ts_cache.read(ts_cache.outdated(chunk['point_ids']), any_end=True)
+    if stored is None:
+        return []
+    
+    start = min(dates.max() for dates in stored['dates']) + pd.Timedelta(days=1)
+    pathrows = {point_id: pathrow for point_id, pathrow in zip(stored[point_id_name], stored['pathrow']) if pd.notna(pathrow)}
+    points = backend.chunk_points(fc, subset_chunk(chunk, stored[point_id_name].tolist()), point_id_name)
+    new = backend.get_time_series(sat_coll, points, config_dict, start=start, pathrows=pathrows)
+    
+    # store with the new end date, also the points without new images
+    updated = append_ts_data(stored, new, point_id_name, config_dict['ts_params']['bands'])
+    ts_cache.write(updated)
+    
+    return updated[point_id_name][updated['images'] > stored['images']].tolist()
+
+
+def update_ts_cache(fc, point_coords, config_dict, backend, ts_cache, workers):
+    """Bring all outdated time-series of the cache up to the configured end_monitor
+    
+    Returns
+    -------
+    set
+        ids of the points that got new images
+    """
+    
+    point_id_name = config_dict['ts_params']['point_id']
+    outdated = point_coords[point_coords[point_id_name].isin(ts_cache.outdated(point_coords[point_id_name].tolist()))]
+    if len(outdated) == 0:
+        return set()
+    
+    chunks = plan_chunks(outdated, point_id_name, config_dict['max_points_per_chunk'])
+    lsat = backend.image_collection(fc, config_dict)
+    print(f' Updating the stored time-series of {len(outdated)} points with new images, in {len(chunks)} chunks.')
+    
+    def update(chunk):
+        try:
+            return update_cached_time_series(lsat, fc, config_dict, backend, ts_cache, chunk)
+        except Exception as e:
+            print(f' Updating chunk failed ({e}). The respective points will be downloaded in full.')
+            return []
+    
+    updated = set()
+    executor = Executor(executor="concurrent_threads", max_workers=workers)
+    for task in executor.as_completed(func=update, iterable=chunks):
+        updated.update(task.result())
+    
+    print(f' {len(updated)} of {len(outdated)} points have new images.')
+    return updated
+
+
+def read_previous_results(path):
+    
+    # results as written by get_change_data
+    path = Path(path)
+    return read_results_parquet(path) if path.suffix == '.parquet' else pd.read_pickle(path)
+
+
+def analyse_chunk_data(df, products, config_file):
+    """CPU part of the processing of a chunk
+    
+    Runs the local algorithms on the time-series of fetch_chunk_data and merges
+    in the global products.
+    
+    Returns
+    -------
+    DataFrame or None
+    """
+    
+    # create config file
+    with open(config_file) as f:
+        config_dict = json.load(f)
+    
+    algorithms = _algorithms(config_dict)
+    bands = config_dict['ts_params']['bands']
+    point_id_name = config_dict['ts_params']['point_id']
+    
+    if any(run for algorithm, run in algorithms.items() if algorithm != 'glb_prd'):
+        
+        # the time-series in flat arrays, shared by all algorithms
+        ts = RaggedTimeSeries.from_frame(df, bands, point_id_name)
         
         # run bfast
-        df = run_bfast_monitor(df, config_dict) if bfast else df
+        df = run_bfast_monitor(df, config_dict, ts) if algorithms['bfast'] else df
         
         # run jrc package
-        df = run_jrc_nrt(df, config_dict) if jrc_nrt else df
+        df = run_jrc_nrt(df, config_dict, ts) if algorithms['jrc_nrt'] else df
         
         ### THINGS WE RUN WITHOUT HISTORIC PERIOD #####
-        # we cut ts data to monitoring period only
-        df[['dates_mon', 'ts_mon', 'mon_images']] = df.apply(
-            lambda row: subset_ts(row, config_dict['ts_params']['start_monitor'], bands), axis=1, result_type='expand'
-        )
+        # we cut ts data to monitoring period only (without copying)
+        ts_mon = ts.period(start=config_dict['ts_params']['start_monitor'])
+        df['mon_images'] = df[point_id_name].map(pd.Series(ts_mon.lengths, index=ts_mon.point_ids))
         
         # run cusum
-        df = run_cusum_deforest(df, config_dict) if cusum else df
+        df = run_cusum_deforest(df, config_dict, ts_mon) if algorithms['cusum'] else df
         
         # run timescan metrics
-        df = run_timescan_metrics(df, config_dict) if ts_metrics else df
+        df = run_timescan_metrics(df, config_dict, ts_mon) if algorithms['ts_metrics'] else df
         
         # run bs_slope
-        df = run_bs_slope(df, config_dict) if bs_slope else df
-        
-    df = sample_global_products_cell(df, cell_fc, config_dict) if glb_prd else df
+        df = run_bs_slope(df, config_dict, ts_mon) if algorithms['bs_slope'] else df
+    
+    if products is not None:
+        df = pd.merge(products.drop(['geometry'], axis=1), df, on=point_id_name) if df is not None else products
         
     return df
+
+
+def extract_to_df(sat_coll, cell_fc, config_file, backend=None):
+    
+    # both stages in a row
+    df, products = fetch_chunk_data(sat_coll, cell_fc, config_file, backend)
+    return analyse_chunk_data(df, products, config_file)
     
         
-def get_change_data(fc, config_dict):
+def get_change_data(fc, config_dict, backend=None):
+    """Extract time-series and run the change algorithms for all points
+    
+    Parameters
+    ----------
+    fc : ee.FeatureCollection
+        points to process, or a GeoDataFrame of points for the OfflineBackend
+    config_dict : dict
+        processing configuration. Optional keys io_workers (default: workers),
+        cpu_workers (default: nr of CPUs), queue_size (default: 2 * cpu_workers)
+        and cpu_executor ('threads' or 'processes') set the concurrency of the
+        download and of the analysis stage, within which cusum, bfast,
+        bs_slope and ts_metrics run their blocks of points in processes with
+        executor 'processes' in their params (time-series in shared memory)
+        and in threads otherwise. requests_per_second and request_burst
+        limit the rate of the Earth Engine requests. Downloaded
+        time-series are cached in ts_cache_dir (default: work_dir/ts_cache),
+        unless ts_cache is False. With incremental set, cached time-series of
+        an earlier end_monitor are extended with the images acquired since,
+        and the rows of previous_results (a results file of that earlier run)
+        are kept for the points without new images instead of processing them
+        again
+    backend : EarthEngineBackend or OfflineBackend, optional
+        serves all Earth Engine requests, defaults to an EarthEngineBackend
+    """
     
+    # all requests go through one scheduler, within the rate set in the config
+    backend = backend or EarthEngineBackend(scheduler=RequestScheduler.from_config(config_dict))
     print(' Setting up the processing pipeline. This may take a moment')
     outdir = config_dict['work_dir']
     if outdir is None:
@@ -254,128 +320,180 @@ def get_change_data(fc, config_dict):
     start_mon = ts_params['start_monitor']
     end_mon = ts_params['end_monitor']
     
+    # one pooled connection per worker thread for the downloads
+    http.configure(pool_size=config_dict.get('io_workers', config_dict['workers']))
+    
     # get processing params
     max_points_per_chunk = config_dict['max_points_per_chunk']
-    grid_sizes = config_dict['grid_size_levels']
+    # number of attempts, each with smaller chunks than the one before
+    rounds = config_dict.get('chunk_rounds', len(config_dict['grid_size_levels']))
     point_id_name = config_dict['ts_params']['point_id']
-    nr_total_points = fc.size().getInfo()
     
-    # if we find any file in the temp directory we check
-    df = aggregate_tmp_files(tmpdir)   
+    # concurrency of the download and the analysis stage
+    io_workers = config_dict.get('io_workers', config_dict['workers'])
+    cpu_workers = config_dict.get('cpu_workers', os.cpu_count())
+    cpu_pool = ProcessPoolExecutor(
+        max_workers=cpu_workers, mp_context=mp.get_context('spawn')
+    ) if config_dict.get('cpu_executor', 'threads') == 'processes' else None
+    
+    # downloaded time-series are kept across runs, unless disabled
+    ts_cache = TimeSeriesCache(
+        config_dict.get('ts_cache_dir') or outdir.joinpath('ts_cache'), config_dict
+    ) if config_dict.get('ts_cache', True) else None
+    if ts_cache is not None:
+        print(f' Using the time-series cache in {ts_cache.path} ({len(ts_cache)} points cached).')
+    
+    # pull ids and coordinates of all points once, chunks are planned locally
+    point_coords = backend.point_coordinates(fc, point_id_name)
+    
+    # chunks that have been processed already (by an interrupted run)
+    checkpoints = CheckpointStore(tmpdir)
+    # results of interrupted runs from before the checkpoint store
+    for file in tmpdir.glob('tmp_*.pickle'):
+        checkpoints.add(file.stem, pd.read_pickle(file), point_id_name)
+        file.unlink()
+    # and their markers of chunks without results, which are processed again
+    for file in tmpdir.glob('tmp_noresults*.txt'):
+        file.unlink()
+    processed = checkpoints.point_ids()
+    
+    # incremental update, only fetch new images and only re-process points that got some
+    if config_dict.get('incremental', False):
+        
+        if ts_cache is None:
+            raise ValueError('The incremental mode needs the time-series cache, set ts_cache to True.')
+        
+        updated = update_ts_cache(fc, point_coords, config_dict, backend, ts_cache, io_workers)
+        if config_dict.get('previous_results'):
+            
+            # keep the results of points that are up to date, but did not get new images
+            previous = read_previous_results(config_dict['previous_results'])
+            previous_ids = previous[point_id_name]
+            unchanged = previous[
+                ~previous_ids.isin(updated) & 
+                previous_ids.isin(ts_cache.cached(previous_ids.tolist())) & 
+                ~previous_ids.isin(processed)
+            ]
+            print(f' Keeping the previous results of {len(unchanged)} points without new images.')
+            if len(unchanged) > 0 and not checkpoints.done('unchanged'):
+                checkpoints.add('unchanged', unchanged, point_id_name)
+                processed = checkpoints.point_ids()
+    
+    # the points still to process are only tracked locally, each chunk request carries its points
+    left_to_process = int((~point_coords[point_id_name].isin(processed)).sum())
+    if processed:
+        print(f' Found already processed files. Will only consider missing points.')
+        print(f' Nr of missing plots: {left_to_process}')
+    else:
+        print(f' Nr of plots to process: {left_to_process}')
     
-    # we upload, in case points have been processed, otherwise we start with the original feature collection (see routine for details)
-    iterative_fc, left_to_process = upload_missing_points(df, point_id_name, fc, 'tmp_initial_fc')
+    # create image collection (not being changed) over the convex hull of the points
+    lsat = backend.image_collection(fc, config_dict)
 
-    # here we start to loop over the different grid sizes
-    for grid_size in grid_sizes:
+    # here we start to loop over the rounds
+    for level in range(rounds):
         
         if left_to_process > 0:
+            
+            # halve the chunks with every round
+            chunk_size = max(max_points_per_chunk // 2**level, 1)
     
             # create namespace for tmp and outfiles
-            param_string = f'{sat}_{ts_band}_{start_hist}_{start_mon}_{end_mon}_{grid_size}'
-
-            # create aoi based on convex_hull of input feature collection
-            aoi = ee.FeatureCollection(iterative_fc.geometry().convexHull())
+            param_string = f'{sat}_{ts_band}_{start_hist}_{start_mon}_{end_mon}_{chunk_size}'
 
-            # create image collection (not being changed)
-            lsat = landsat_collection(
-                start_hist, 
-                end_mon, 
-                aoi, 
-                **config_dict['lsat_params']
-            )
-            
-            # create a grid
-            grid_fc = processing_grid(aoi, grid_size)
-            grid = ee.FeatureCollection(grid_fc).aggregate_array('.geo').getInfo() 
+            # split the missing points quadtree-style into chunks of at most chunk_size points
+            missing = point_coords[~point_coords[point_id_name].isin(processed)]
+            chunks = plan_chunks(missing, point_id_name, chunk_size)
             
             print(f' --------------------------------------------------------------------------------------------')
-            print(f' Splitting the aoi in chunks for parallel processing (Level {grid_sizes.index(grid_size)+1}).')
-            print(f' Parallelizing on chunks of {grid_size}x{grid_size} degrees, totalling in {len(grid)} chunks.')
+            print(f' Splitting the points in chunks for parallel processing (Round {level+1}).')
+            print(f' Parallelizing on chunks of at most {chunk_size} points, totalling in {len(chunks)} chunks.')
             print(f' {left_to_process} points left to process.')
             print(f' --------------------------------------------------------------------------------------------')
             
-            # create args_list for each grid cell
-            args_list = [(*l, ) for l in list(enumerate(grid))]
-        
-            # parallizing function (for each grid cell)
-            def cell_computation(args):
-                
-                # get start time for timer
-                start_time = time.time()
+            # I/O stage (for each chunk)
+            def fetch(args):
                 
                 # extract arguments
-                idx, cell = args
+                idx, chunk = args
                 
-                # create namespace for tmp and outfiles
-                tmp_file = tmpdir.joinpath(f'tmp_results_{idx}_{param_string}.pickle')
-                tmp_empty_file = tmpdir.joinpath(f'tmp_noresults_{idx}_{param_string}.txt')
-
                 # check if already been calculated
-                if tmp_file.exists() or tmp_empty_file.exists():
-                    print(f' Chunk {idx+1} at chunksize of {grid_size} degrees already has been extracted. Going on with next chunk.')    
-                    return
-
-                # get geometry of grid cell and filter points for that
-                cell_fc = iterative_fc.filterBounds(cell)
-                nr_of_points = cell_fc.size().getInfo()
-
-                if nr_of_points > 0 and nr_of_points < max_points_per_chunk:
+                if checkpoints.done(chunk_key(chunk, param_string)):
+                    print(f' Chunk {idx+1} at chunksize of {chunk_size} points already has been extracted. Going on with next chunk.')    
+                    return None
 
-                    print(f' Processing chunk {idx+1}')
-                    df = extract_to_df(lsat, cell_fc, config_file)
-
-                    # write to tmp pickle file
-                    if df is not None:
-                        df.to_pickle(tmp_file)
-
-                    # stop timer and print runtime
-                    elapsed = time.time() - start_time
-                    print(f' Chunk {idx+1} with {nr_of_points} points done in: {timedelta(seconds=elapsed)}')    
-
-                elif nr_of_points == 0:
-                    with open(tmp_empty_file, 'w') as f:
-                        f.write('0 points')
-                    print(f' Chunk {idx+1} does not contain any points. Going on with next chunk.')    
+                # get the points of the chunk
+                cell_fc = backend.chunk_points(fc, chunk, point_id_name)
+                print(f' Processing chunk {idx+1}')
+                try:
+                    return time.time(), fetch_chunk_data(lsat, cell_fc, config_file, backend, ts_cache, chunk)
+                except Exception as e:
+                    checkpoints.failed(chunk_key(chunk, param_string), e)
+                    raise
+            
+            # CPU stage (for each chunk)
+            def analyse(args, payload):
                 
-                elif nr_of_points > max_points_per_chunk :
-                    with open(tmp_empty_file, 'w') as f:
-                         f.write('too many points')  
-                    print(f' More than {max_points_per_chunk} points in chunk {idx+1}. Considering respective points at smaller chunk size level.')
+                if payload is None:
+                    return
+                
+                idx, chunk = args
+                start_time, (df, products) = payload
+                try:
+                    if cpu_pool:
+                        df = cpu_pool.submit(analyse_chunk_data, df, products, config_file).result()
+                    else:
+                        df = analyse_chunk_data(df, products, config_file)
+                except Exception as e:
+                    checkpoints.failed(chunk_key(chunk, param_string), e)
+                    raise
+
+                # register the results of the chunk
+                if df is not None:
+                    checkpoints.add(chunk_key(chunk, param_string), df, point_id_name)
+
+                # stop timer and print runtime
+                elapsed = time.time() - start_time
+                print(f' Chunk {idx+1} with {len(chunk["point_ids"])} points done in: {timedelta(seconds=elapsed)}')    
            
             # ---------------debug line--------------------------
-            #for args in args_list:
-            #    cell_computation(args)
-
-            #cell_computation([1, grid[1], config_file])
+            #for args in enumerate(chunks):
+            #    analyse(args, fetch(args))
             # ---------------debug line end--------------------------
 
-            executor = Executor(executor="concurrent_threads", max_workers=config_dict["workers"])
-            for i, task in enumerate(executor.as_completed(
-                func=cell_computation,
-                iterable=args_list
-            )):
-                try:
-                    task.result()
-                except:
-                    print(" Gridcell task failed. Trying to process the respective points at a lower chunk size.")
-                    pass
+            # downloads and local analysis overlap, each with its own number of workers
+            run_pipeline(
+                list(enumerate(chunks)), 
+                fetch, 
+                analyse, 
+                io_workers=io_workers, 
+                cpu_workers=cpu_workers, 
+                queue_size=config_dict.get('queue_size'),
+                nr_of_points=lambda args: len(args[1]['point_ids'])
+            )
         
-        if any(tmpdir.iterdir()):
-            df = aggregate_tmp_files(tmpdir)
-
-        # if we still haven't catched all points
-        if df is not None:
-            
-            if len(df) < nr_total_points:
-            
-                gr_size_str = str(grid_size).replace('.', '_')
-                asset_name = f'tmp_fc_{gr_size_str}'
-                iterative_fc, left_to_process = upload_missing_points(df, point_id_name, fc, asset_name)
+        # if we still haven't catched all points, go on with smaller chunks
+        processed = checkpoints.point_ids()
+        left_to_process = int((~point_coords[point_id_name].isin(processed)).sum())
+        if left_to_process == 0:
+            break
+        
+        print(f' Nr of missing plots: {left_to_process}')
 
-            else:
-                left_to_process = 0
-                break
+    if cpu_pool:
+        cpu_pool.shutdown()
+    
+    # all results at once
+    status = checkpoints.status()
+    print(f' Assembling the results of {status.get("done", 0)} chunks ({status.get("failed", 0)} failed attempts).')
+    df = checkpoints.assemble()
+
+    # nothing to write, the checkpoints are kept to resume the run
+    if df is None:
+        raise RuntimeError(
+            f'No results to assemble, the errors of the failed chunks are recorded in the checkpoint store in '
+            f'{tmpdir}. Run again to resume.'
+        )
 
     # remove the monitoring dates and ts values
     if 'dates_mon' in df.columns:
@@ -390,46 +508,38 @@ def get_change_data(fc, config_dict):
 
     # create namespace for out files
     param_string_final = f'{sat}_{ts_band}_{start_hist}_{start_mon}_{end_mon}'
-    out_gpkg = outdir.joinpath(f'results_{param_string_final}.gpkg')
-    out_pckl = outdir.joinpath(f'results_{param_string_final}.pickle')
-
-    # write to pickle with all ts and dates
-    df.to_pickle(out_pckl)
-
-    # write to geo file
-    if 'dates' in df.columns:
-        gdf = gpd.GeoDataFrame(
-                    df.drop(['dates', 'ts'], axis=1), 
-                    crs="EPSG:4326", 
-                    geometry=df['geometry']
-              )
+    
+    if config_dict.get('output_format', 'pickle') == 'parquet':
+        
+        # write attributes, time-series and geometry to a single GeoParquet file
+        out_parquet = outdir.joinpath(f'results_{param_string_final}.parquet')
+        write_results_parquet(df, out_parquet, bands=ts_params['bands'], point_id_name=point_id_name)
+    
     else:
-        gdf = gpd.GeoDataFrame(df, crs="EPSG:4326", geometry=df['geometry'])
+        out_gpkg = outdir.joinpath(f'results_{param_string_final}.gpkg')
+        out_pckl = outdir.joinpath(f'results_{param_string_final}.pickle')
+
+        # write to pickle with all ts and dates
+        df.to_pickle(out_pckl)
+
+        # write to geo file
+        if 'dates' in df.columns:
+            gdf = gpd.GeoDataFrame(
+                        df.drop(['dates', 'ts'], axis=1), 
+                        crs="EPSG:4326", 
+                        geometry=df['geometry']
+                  )
+        else:
+            gdf = gpd.GeoDataFrame(df, crs="EPSG:4326", geometry=df['geometry'])
 
-    ## write to output and return df# write to output and return df
-    gdf.to_file(out_gpkg, driver='GPKG')
+        ## write to output and return df# write to output and return df
+        gdf.to_file(out_gpkg, driver='GPKG')
 
     print(" Deleting temporary files")
-    # regather tmp files
-    tmp_files = tmpdir.glob('tmp_*results*.*')
-    # remove tmp files
-    for file in tmp_files:
-        file.unlink()
-    
-    # remove any temporary dataframe pickle object
-    tmp_pckl = tmpdir.joinpath('tmp_df.pickle')
-    if tmp_pckl.exists():
-        tmp_pckl.unlink()
-    
+    checkpoints.clear()
     tmpdir.rmdir()
     
-    print(' Deleting temporary EE assets...')
-    # get users asset root
-    asset_root = ee.data.getAssetRoots()[0]['id']
-    child_assets = ee.data.listAssets({'parent': f'{asset_root}/tmp_sbae'})['assets']
-    for i, ass in enumerate(child_assets):
-        ee.data.deleteAsset(ass['id']) 
-    
-    ee.data.deleteAsset(f'{asset_root}/tmp_sbae')
+    # remove temporary EE assets
+    backend.cleanup()
     
     print(" Processing has been finished successfully. Check for final_results files in your output directory.")
@@ -0,0 +1,176 @@
+import json
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+# GeoParquet names of the shapely geometry type ids
+GEOMETRY_TYPES = {
+    0: 'Point', 1: 'LineString', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint',
+    5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection'
+}
+
+
+def ts_to_arrow(df, bands, dates_col='dates', ts_col='ts'):
+    """Turn the per-point dates and time-series into Arrow list columns
+
+    Parameters
+    ----------
+    df : DataFrame
+        with a column of DatetimeIndex (dates_col) and a column of dicts of
+        lists per band (ts_col)
+    bands : list of str
+        bands to take from the ts dicts
+
+    Returns
+    -------
+    dict
+        column name -> pyarrow ListArray, i.e. the dates as list<date32> and
+        one list<float32> column per band, named ts_<band>
+    """
+
+    # offsets into the flat value arrays
+    lengths = np.array([len(dates) for dates in df[dates_col]], dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+
+    columns = {}
+    dates = np.concatenate(
+        [np.asarray(dates, dtype='datetime64[ns]') for dates in df[dates_col]]
+    ).astype('datetime64[D]') if len(df) else np.array([], dtype='datetime64[D]')
+    columns[dates_col] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(dates, type=pa.date32()))
+
+    for band in bands:
+        values = np.fromiter(
+            chain.from_iterable(ts[band] for ts in df[ts_col]), dtype=np.float32, count=offsets[-1]
+        )
+        columns[f'{ts_col}_{band}'] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(values, type=pa.float32()))
+
+    return columns
+
+
+def ts_from_arrow(table, bands, dates_col='dates', ts_col='ts'):
+    """Inverse of ts_to_arrow, returns the dates and ts columns as lists of DatetimeIndex and dicts"""
+
+    dates_list = table.column(dates_col).combine_chunks()
+    offsets = dates_list.offsets.to_numpy()
+    flat_dates = pd.DatetimeIndex(dates_list.flatten().to_numpy(zero_copy_only=False).astype('datetime64[ns]'))
+    flat_values = {
+        band: table.column(f'{ts_col}_{band}').combine_chunks().flatten().to_numpy(zero_copy_only=False)
+        for band in bands
+    }
+
+    dates, ts = [], []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        dates.append(flat_dates[start:end])
+        ts.append({band: flat_values[band][start:end].tolist() for band in bands})
+
+    return dates, ts
+
+
+def write_results_parquet(df, path, bands=None, point_id_name='point_id', crs='EPSG:4326', partition_cols=None, row_group_size=50000):
+    """Write a results DataFrame as GeoParquet
+
+    Attribute columns are written as typed Parquet columns, the time-series of
+    each point as Arrow list columns (dates and ts_<band>) and the geometry as
+    WKB with GeoParquet metadata. Rows are sorted by point id, so that row group
+    statistics allow readers to skip row groups when filtering on it.
+
+    Parameters
+    ----------
+    df : DataFrame
+        results, as returned by get_change_data
+    path : str or Path
+        output file, or output folder if partition_cols is set
+    bands : list of str, optional
+        bands of the ts column to write, defaults to all bands found
+    point_id_name : str, default='point_id'
+    crs : str, default='EPSG:4326'
+        CRS of the geometries
+    partition_cols : list of str, optional
+        write a hive-partitioned dataset split by these columns
+    row_group_size : int, default=50000
+    """
+
+    df = df.sort_values(point_id_name).reset_index(drop=True) if point_id_name in df.columns else df
+    ts_cols = [col for col in ['dates', 'ts', 'dates_mon', 'ts_mon'] if col in df.columns]
+    attributes = df.drop(ts_cols + ['geometry'], axis=1, errors='ignore')
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+
+    # time-series as list columns
+    if 'dates' in df.columns and 'ts' in df.columns:
+        bands = bands or (list(df['ts'].iloc[0].keys()) if len(df) else [])
+        for name, column in ts_to_arrow(df, bands).items():
+            table = table.append_column(name, column)
+
+    # geometry as GeoParquet
+    metadata = dict(table.schema.metadata or {})
+    if 'geometry' in df.columns:
+        geometries = np.asarray(df['geometry'].values, dtype=object)
+        table = table.append_column('geometry', pa.array(shapely.to_wkb(geometries), type=pa.binary()))
+        metadata[b'geo'] = json.dumps({
+            'version': '1.0.0',
+            'primary_column': 'geometry',
+            'columns': {
+                'geometry': {
+                    'encoding': 'WKB',
+                    'geometry_types': [GEOMETRY_TYPES[i] for i in np.unique(shapely.get_type_id(geometries))],
+                    'crs': CRS(crs).to_json_dict(),
+                    'bbox': list(shapely.total_bounds(geometries))
+                }
+            }
+        }).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    if partition_cols:
+        pq.write_to_dataset(table, path, partition_cols=partition_cols, row_group_size=row_group_size)
+    else:
+        pq.write_table(table, path, row_group_size=row_group_size)
+
+
+def read_results_parquet(path, columns=None, filters=None, ts=True):
+    """Read results written by write_results_parquet
+
+    Parameters
+    ----------
+    path : str or Path
+        file or partitioned dataset folder
+    columns : list of str, optional
+        only read these columns, e.g. ['point_id', 'bfast_magnitude']
+    filters : list of tuples, optional
+        pyarrow filters, e.g. [('point_id', '<', 1000)], used to skip
+        row groups and partitions
+    ts : bool, default=True
+        turn the dates and ts_<band> list columns back into the dates and ts
+        columns as produced by get_change_data
+
+    Returns
+    -------
+    DataFrame or GeoDataFrame (if the geometry column is read)
+    """
+
+    table = pq.read_table(path, columns=columns, filters=filters)
+    # time-series are the list columns (not to confuse with e.g. ts_mean)
+    list_cols = [field.name for field in table.schema if pa.types.is_list(field.type)]
+    bands = [name[3:] for name in list_cols if name.startswith('ts_')]
+
+    df = table.drop_columns(list_cols + (['geometry'] if 'geometry' in table.column_names else [])).to_pandas()
+
+    if list_cols:
+        if ts and 'dates' in table.column_names:
+            df['dates'], df['ts'] = ts_from_arrow(table, bands)
+        else:
+            for name in list_cols:
+                df[name] = table.column(name).to_pylist()
+
+    if 'geometry' in table.column_names:
+        geo = json.loads(table.schema.metadata[b'geo'])
+        crs = geo['columns']['geometry'].get('crs')
+        geometry = shapely.from_wkb(table.column('geometry').to_numpy(zero_copy_only=False))
+        df = gpd.GeoDataFrame(df, geometry=geometry, crs=json.dumps(crs) if crs else None)
+
+    return df
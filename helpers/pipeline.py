@@ -0,0 +1,131 @@
+import time
+import queue
+import threading
+
+from godale import Executor
+
+
+class StageStats:
+    """Thread-safe counters of a pipeline stage
+
+    busy is the time spent on the work itself, waiting the time the stage was
+    held up by the other stage: for the I/O stage the time blocked on a full
+    queue (back-pressure from the CPU stage), for the CPU stage the time spent
+    waiting on an empty queue (starved by the I/O stage).
+    """
+
+    def __init__(self, name, waiting_label):
+        self.name = name
+        self.waiting_label = waiting_label
+        self.chunks = 0
+        self.failed = 0
+        self.points = 0
+        self.busy = 0.
+        self.waiting = 0.
+        self._lock = threading.Lock()
+
+    def record(self, points, busy, waiting, failed=False):
+        with self._lock:
+            self.chunks += 1
+            self.failed += failed
+            self.points += 0 if failed else points
+            self.busy += busy
+            self.waiting += waiting
+
+    def report(self, elapsed, workers):
+        """Print the throughput of the stage over elapsed seconds"""
+
+        utilisation = self.busy / (elapsed * workers) if elapsed else 0
+        print(
+            f' {self.name} stage: {self.chunks} chunks ({self.failed} failed), {self.points} points, '
+            f'{self.points / elapsed if elapsed else 0:.1f} points/s, {utilisation:.0%} busy, '
+            f'{self.waiting:.1f}s {self.waiting_label}'
+        )
+
+
+def run_pipeline(items, fetch, analyse, io_workers, cpu_workers, queue_size=None, nr_of_points=len):
+    """Run fetch and analyse on items as two stages, overlapping I/O and CPU work
+
+    A pool of io_workers threads runs fetch on the items and puts the results on
+    a bounded queue, from which cpu_workers threads take them and run analyse.
+    When the queue is full, the I/O threads wait (back-pressure), so no more
+    than queue_size fetched items are held in memory. Failed items are reported
+    and skipped.
+
+    Parameters
+    ----------
+    items : list
+    fetch : callable
+        fetch(item), the I/O bound part, returns a payload
+    analyse : callable
+        analyse(item, payload), the CPU bound part
+    io_workers : int
+    cpu_workers : int
+    queue_size : int, optional
+        defaults to 2 * cpu_workers
+    nr_of_points : callable, default=len
+        number of points of an item, for the throughput
+
+    Returns
+    -------
+    tuple of StageStats
+        of the I/O and of the CPU stage
+    """
+
+    fetched = queue.Queue(maxsize=queue_size or 2 * cpu_workers)
+    io_stats = StageStats('I/O', 'blocked on a full queue')
+    cpu_stats = StageStats('CPU', 'waiting for input')
+
+    def producer(item):
+        start = time.time()
+        try:
+            payload = fetch(item)
+        except Exception as e:
+            io_stats.record(nr_of_points(item), time.time() - start, 0, failed=True)
+            print(f' Fetching chunk failed ({e}). Trying to process the respective points at a lower chunk size.')
+            return
+
+        done = time.time()
+        # blocks while the cpu stage is behind
+        fetched.put((item, payload))
+        io_stats.record(nr_of_points(item), done - start, time.time() - done)
+
+    def consumer():
+        while True:
+            start = time.time()
+            entry = fetched.get()
+            if entry is None:
+                return
+
+            got = time.time()
+            try:
+                analyse(*entry)
+                failed = False
+            except Exception as e:
+                failed = True
+                print(f' Analysing chunk failed ({e}). Trying to process the respective points at a lower chunk size.')
+
+            cpu_stats.record(nr_of_points(entry[0]), time.time() - got, got - start, failed=failed)
+
+    start = time.time()
+    consumers = [threading.Thread(target=consumer, daemon=True) for _ in range(cpu_workers)]
+    for thread in consumers:
+        thread.start()
+
+    executor = Executor(executor="concurrent_threads", max_workers=io_workers)
+    for task in executor.as_completed(
+        func=producer,
+        iterable=items
+    ):
+        task.result()
+
+    # one stop signal per consumer, after all fetched items
+    for thread in consumers:
+        fetched.put(None)
+    for thread in consumers:
+        thread.join()
+
+    elapsed = time.time() - start
+    io_stats.report(elapsed, io_workers)
+    cpu_stats.report(elapsed, cpu_workers)
+    return io_stats, cpu_stats
@@ -1,48 +1,236 @@
 from pathlib import Path
 import ee
 import geemap
-import time
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import box, Point
+import shapely
 import numpy as np
 from matplotlib import pyplot as plt
 
+from helpers.dggrid import dggrid
+from helpers.ee.tasks import TaskManager
 
-from dggrid4py import DGGRIDv7
 
-dggrid_instance = DGGRIDv7(
-    executable='helpers/dggrid/src/apps/dggrid/dggrid', 
-    working_dir='/tmp/', 
-    capture_logs=False, 
-    silent=True
-)
+def read_aoi(aoi):
+    """Turn the AOI into a GeoDataFrame with a CRS
 
+    Accepts a GeoDataFrame or an Earth Engine FeatureCollection. If the AOI
+    comes without CRS, the user is asked for it.
+    """
 
-def random_point(geometry):
-    
-    bounds = geometry.bounds
-    while True:
-    
-        x = (bounds[2] - bounds[0]) * np.random.random_sample(1) + bounds[0]
-        y = (bounds[3] - bounds[1]) * np.random.random_sample(1) + bounds[1]
-        if Point(x, y).within(geometry):
-            break
-            
-    return Point(x, y)
-    
-    
-def squared_grid(aoi, spacing, crs='ESRI:54017', sampling_strategy='systematic'):
-
+    # in case we have a EE FC
     if isinstance(aoi, ee.FeatureCollection):
         aoi = geemap.ee_to_geopandas(aoi).set_crs('epsg:4326', inplace=True)
-    
-    # reproject
+
     if not aoi.crs:
         crs_original = input('Your AOI does not have a coordinate reference system (CRS). Please provide the CRS of the AOI (e.g. epsg:4326): ')
         aoi.set_crs(crs_original, inplace=True)
-        
-    aoi = aoi.dissolve().to_crs(crs)
+
+    return aoi
+
+
+def random_points(geometries, points_per_cell=1, seed=None):
+    """Draw random points within each of the given polygons
+
+    Candidates are drawn in blocks for all polygons at once within their bounding
+    boxes and tested with a vectorized point-in-polygon test. Only polygons that
+    did not yet get enough points are considered in the following rounds.
+
+    Parameters
+    ----------
+    geometries : array of shapely polygons
+        e.g. the cells of a sampling grid (GeoSeries.values)
+    points_per_cell : int, default=1
+        number of points to draw per polygon (for intensified designs)
+    seed : int or sequence of int, optional
+        seed of the random number generator, for reproducible samples
+
+    Returns
+    -------
+    x, y : ndarray of shape (n_polygons, points_per_cell)
+        coordinates of the random points
+    """
+
+    rng = np.random.default_rng(seed)
+    geometries = np.asarray(geometries, dtype=object)
+    shapely.prepare(geometries)
+
+    # the share of the bounding box covered by the polygon is the expected acceptance rate
+    bounds = shapely.bounds(geometries)
+    bbox_area = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    acceptance = np.divide(shapely.area(geometries), bbox_area, out=np.zeros(len(geometries)), where=bbox_area > 0)
+    if np.any(acceptance == 0):
+        raise ValueError('Cannot draw random points within empty or degenerated geometries.')
+
+    x = np.empty((len(geometries), points_per_cell))
+    y = np.empty((len(geometries), points_per_cell))
+    filled = np.zeros(len(geometries), dtype=int)
+    todo = np.arange(len(geometries))
+    while len(todo) > 0:
+
+        # draw enough candidates to fill most cells in one go
+        draws = np.ceil((points_per_cell - filled[todo]) / acceptance[todo] * 1.25).astype(int) + 1
+        idx = np.repeat(todo, draws)
+        cand_x = rng.uniform(bounds[idx, 0], bounds[idx, 2])
+        cand_y = rng.uniform(bounds[idx, 1], bounds[idx, 3])
+
+        # keep the ones that fall within their polygon
+        inside = shapely.contains_xy(geometries[idx], cand_x, cand_y)
+        idx, cand_x, cand_y = idx[inside], cand_x[inside], cand_y[inside]
+
+        # position of each accepted candidate within its polygon (idx is sorted)
+        slot = np.arange(len(idx)) - np.searchsorted(idx, idx) + filled[idx]
+        keep = slot < points_per_cell
+        x[idx[keep], slot[keep]] = cand_x[keep]
+        y[idx[keep], slot[keep]] = cand_y[keep]
+
+        # update counters and redraw only for unfilled polygons
+        filled = np.minimum(filled + np.bincount(idx, minlength=len(geometries)), points_per_cell)
+        todo = todo[filled[todo] < points_per_cell]
+
+    return x, y
+
+
+def cells_to_points(gdf, aoi_geom, sampling_strategy='systematic', points_per_cell=1, seed=None, cell_ids=None):
+    """Create the sampling points for a GeoDataFrame of grid cells
+
+    Parameters
+    ----------
+    gdf : GeoDataFrame
+        grid cells
+    aoi_geom : shapely geometry
+        area of interest in the CRS of the grid, points outside are removed
+    sampling_strategy : str, default='systematic'
+        'systematic' takes the centroid, 'random' a random point within each cell
+    points_per_cell : int, default=1
+        number of random points per cell (random sampling only). If more than one,
+        the points get their own point_id and a cell_id referring to the grid cell.
+    seed : int or sequence of int, optional
+        seed for random sampling
+    cell_ids : array of int, optional
+        stable ids of the cells, used as point_id. Defaults to a running number.
+
+    Returns
+    -------
+    grid_gdf, point_gdf : GeoDataFrame
+    """
+
+    print("Creating sampling points...")
+    if sampling_strategy == 'systematic':
+        # take centroid
+        points_per_cell = 1
+        points = gdf.geometry.centroid.values
+
+    elif sampling_strategy == 'random':
+        # create rand points in each grid
+        x, y = random_points(gdf.geometry.values, points_per_cell, seed)
+        points = gpd.points_from_xy(x.ravel(), y.ravel(), crs=gdf.crs)
+
+    else:
+        raise ValueError(f"Unknown sampling strategy {sampling_strategy}. Choose either 'systematic' or 'random'.")
+
+    # add point id
+    print("Adding a unique point ID...")
+    gdf['point_id'] = cell_ids if cell_ids is not None else [i for i in range(len(gdf.index))]
+
+    # divide to grid and point df
+    grid_gdf = gdf.copy()
+    point_gdf = gdf.iloc[np.repeat(np.arange(len(gdf)), points_per_cell)].copy()
+    point_gdf['geometry'] = points
+    if points_per_cell > 1:
+        point_gdf['cell_id'] = point_gdf['point_id']
+        point_gdf['point_id'] = point_gdf['cell_id'] * points_per_cell + np.tile(np.arange(points_per_cell), len(gdf))
+        point_gdf = point_gdf.reset_index(drop=True)
+
+    print('Remove points outside AOI...')
+    shapely.prepare(aoi_geom)
+    point_gdf = point_gdf[shapely.contains_xy(aoi_geom, point_gdf.geometry.x, point_gdf.geometry.y)]
+
+    print(f'Sampling grid consists of {len(point_gdf)} points.')
+    return grid_gdf, point_gdf
+
+
+def intersecting_cells(aoi_geom, originx, originy, spacing, columns, rows, block_size=64):
+    """Find the cells of a regular grid that intersect the AOI
+
+    Instead of testing every single cell, blocks of block_size x block_size cells
+    are tested against the (prepared) AOI first. Blocks completely inside the AOI
+    are taken as a whole, blocks outside are dropped and only blocks crossing the
+    AOI boundary are split further, until single cells are tested.
+
+    Parameters
+    ----------
+    aoi_geom : shapely geometry
+        area of interest, in the same CRS as the grid
+    originx, originy : float
+        lower left corner of the grid
+    spacing : float
+        cell size in CRS units
+    columns, rows : int
+        number of columns and rows of the grid
+    block_size : int, default=64
+        initial block size in cells, should be a power of 2
+
+    Returns
+    -------
+    cols, rows : ndarray
+        column and row index of each intersecting cell, ordered by column and row
+    """
+
+    shapely.prepare(aoi_geom)
+
+    # initial blocks
+    size = block_size
+    c, r = np.meshgrid(np.arange(0, columns, size), np.arange(0, rows, size), indexing='ij')
+    c, r = c.ravel(), r.ravel()
+
+    cols_found, rows_found = [], []
+    while len(c) > 0:
+
+        # test blocks in bulk against the aoi
+        blocks = shapely.box(
+            originx + c * spacing,
+            originy + r * spacing,
+            originx + np.minimum(c + size, columns) * spacing,
+            originy + np.minimum(r + size, rows) * spacing
+        )
+        hit = shapely.intersects(aoi_geom, blocks)
+
+        if size == 1:
+            cols_found.append(c[hit])
+            rows_found.append(r[hit])
+            break
+
+        # blocks entirely within the aoi are expanded to all their cells
+        full = hit.copy()
+        full[hit] = shapely.contains(aoi_geom, blocks[hit])
+        dc, dr = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+        cc = c[full, None] + dc.ravel()
+        rr = r[full, None] + dr.ravel()
+        valid = (cc < columns) & (rr < rows)
+        cols_found.append(cc[valid])
+        rows_found.append(rr[valid])
+
+        # blocks crossing the aoi boundary are split into 4 sub-blocks
+        partial = hit & ~full
+        size = size // 2
+        c = np.concatenate([c[partial], c[partial] + size, c[partial], c[partial] + size])
+        r = np.concatenate([r[partial], r[partial], r[partial] + size, r[partial] + size])
+        valid = (c < columns) & (r < rows)
+        c, r = c[valid], r[valid]
+
+    cols_found = np.concatenate(cols_found) if cols_found else np.array([], dtype=int)
+    rows_found = np.concatenate(rows_found) if rows_found else np.array([], dtype=int)
+
+    # sort by column, then row
+    order = np.lexsort((rows_found, cols_found))
+    return cols_found[order], rows_found[order]
+
+
+def squared_grid(aoi, spacing, crs='ESRI:54017', sampling_strategy='systematic', points_per_cell=1, seed=None):
+
+    # reproject
+    aoi = read_aoi(aoi).dissolve().to_crs(crs)
     aoi_geom = aoi.iloc[0]['geometry']
     
     # get bounds
@@ -53,106 +241,163 @@ def squared_grid(aoi, spacing, crs='ESRI:54017', sampling_strategy='systematic')
     originy = bounds.miny.values[0]
 
     # get widht and height of aoi bounds
-    width = bounds.maxx - bounds.minx 
-    height = bounds.maxy - bounds.miny
+    width = bounds.maxx.values[0] - bounds.minx.values[0]
+    height = bounds.maxy.values[0] - bounds.miny.values[0]
 
     # calculate how many cols and row are those
-    columns = int(np.floor(float(width) / spacing))
-    rows = int(np.floor(float(height) / spacing))
+    columns = int(np.floor(width / spacing))
+    rows = int(np.floor(height / spacing))
     
     # create grid cells
     print("Creating grid cells")
-    i, l = 1, []
-    for column in range(0, columns + 1):
-        x = originx + (column * spacing)
-        for row in range(0, rows + 1):
-            y = originy + (row * spacing)
-            cell = box(x, y, x+spacing, y+spacing)
-            if cell.intersects(aoi_geom):
-                l.append(cell)
-                i += 1
+    cell_cols, cell_rows = intersecting_cells(aoi_geom, originx, originy, spacing, columns + 1, rows + 1)
+    x = originx + cell_cols * spacing
+    y = originy + cell_rows * spacing
     
     # and turn into geodataframe
     print("Turning grid cells into GeoDataFrame...")
-    df = pd.DataFrame(l, columns=['geometry'])
-    gdf = gpd.GeoDataFrame(df, geometry='geometry', crs=crs) 
-    
-    # add points
-    print("Creating sampling points...")
-    if sampling_strategy == 'systematic':
-        # take centroid
-        gdf['sample_points'] = gdf.geometry.centroid
-        
-    elif sampling_strategy == 'random': 
-        # create rand points in each grid
-        gdf['sample_points'] = gdf.geometry.apply(lambda shp: random_point(shp))
-        
+    gdf = gpd.GeoDataFrame(geometry=shapely.box(x, y, x + spacing, y + spacing), crs=crs)
     
-    # add point id
-    print("Adding a unique point ID...")
-    gdf['point_id'] = [i for i in range(len(gdf.index))]
-    
-    # divide to grid and point df
-    grid_gdf = gdf.drop(['sample_points'], axis=1)
-    gdf['geometry'] = gdf['sample_points']
-    point_gdf = gdf.drop(['sample_points'], axis=1)
-    
-    print('Remove points outside AOI...')
-    point_gdf = point_gdf[point_gdf.geometry.within(aoi_geom)]
-    
-    print(f'Sampling grid consists of {len(point_gdf)} points.')
-    return grid_gdf, point_gdf
+    # add points and divide to grid and point df
+    return cells_to_points(gdf, aoi_geom, sampling_strategy, points_per_cell, seed)
 
 
-def hexagonal_grid(aoi, resolution, sampling_strategy='systematic', outcrs='ESRI:54017', projection='ISEA3H'):
-    
-    # in case we have a EE FC
-    if isinstance(aoi, ee.FeatureCollection):
-        aoi = geemap.ee_to_geopandas(aoi).set_crs('epsg:4326', inplace=True)
+def hexagonal_grid(aoi, resolution, sampling_strategy='systematic', outcrs='ESRI:54017', projection='ISEA3H', points_per_cell=1, seed=None, workers=None, cache=True):
     
-    
-    if not aoi.crs:
-        crs_original = input('Your AOI does not have a coordinate refernce system (CRS). Please provide the CRS of the AOI (e.g. epsg:4326): ')
-        aoi.set_crs(crs_original, inplace=True)
-            
     # force lat/lon for dggrid
-    aoi = aoi.to_crs('EPSG:4326')
+    aoi = read_aoi(aoi).to_crs('EPSG:4326')
     print("Creating hexagonal grid...")
-    grid = dggrid_instance.grid_cell_polygons_for_extent(
+    grid = dggrid.grid_cells(
+        aoi.dissolve().geometry.values[0],
         projection, 
         resolution, 
-        clip_geom=aoi.dissolve().geometry.values[0]
+        workers=workers,
+        cache=cache
     )
     
     aoi = aoi.dissolve().to_crs(outcrs)
     aoi_geom = aoi.iloc[0]['geometry']
     gdf = grid.to_crs(outcrs)
 
-    if sampling_strategy == 'systematic':
-        # take centroid
-        gdf['sample_points'] = gdf.geometry.centroid
-        
-    elif sampling_strategy == 'random': 
-        # create rand points in each grid
-        gdf['sample_points'] = gdf.geometry.apply(lambda shp: random_point(shp))
-        
-        
-    # add point id
-    print("Adding a unique point ID...")
-    gdf['point_id'] = [i for i in range(len(gdf.index))]
-    
-    # divide to grid and point df
-    grid_gdf = gdf.drop(['sample_points'], axis=1)
-    gdf['geometry'] = gdf['sample_points']
-    point_gdf = gdf.drop(['sample_points'], axis=1)
-    
-    print('Remove points outside AOI...')
-    point_gdf = point_gdf[point_gdf.geometry.within(aoi_geom)]
-    
-    print(f'Sampling grid consists of {len(point_gdf)} points.')
+    # add points and divide to grid and point df
+    grid_gdf, point_gdf = cells_to_points(gdf, aoi_geom, sampling_strategy, points_per_cell, seed)
     return grid_gdf.to_crs(outcrs), point_gdf.to_crs(outcrs)
 
 
+def squared_grid_tiles(aoi, spacing, crs='ESRI:54017', sampling_strategy='systematic', points_per_cell=1, seed=None, tile_size=1000):
+    """Generate a squared grid tile by tile
+
+    Same grid as squared_grid, but the AOI is walked in tiles of tile_size x tile_size
+    cells and the cells and points are yielded per tile, so memory stays bounded
+    for very dense grids. The point_id is derived from the column and row of the cell
+    within the whole grid (column * rows + row), so it is globally unique and does
+    not depend on the tile size. For random sampling, each tile gets its own
+    random stream derived from the seed and the tile position.
+
+    Yields
+    ------
+    grid_gdf, point_gdf : GeoDataFrame
+        cells and points of one tile
+    """
+
+    aoi = read_aoi(aoi).dissolve().to_crs(crs)
+    aoi_geom = aoi.iloc[0]['geometry']
+    shapely.prepare(aoi_geom)
+
+    # get origin and size of the grid
+    originx, originy, maxx, maxy = aoi.total_bounds
+    columns = int(np.floor((maxx - originx) / spacing)) + 1
+    rows = int(np.floor((maxy - originy) / spacing)) + 1
+
+    for tile_col in range(0, columns, tile_size):
+        for tile_row in range(0, rows, tile_size):
+
+            # skip tiles outside the aoi
+            tile_columns = min(tile_size, columns - tile_col)
+            tile_rows = min(tile_size, rows - tile_row)
+            tile_x, tile_y = originx + tile_col * spacing, originy + tile_row * spacing
+            tile = shapely.box(tile_x, tile_y, tile_x + tile_columns * spacing, tile_y + tile_rows * spacing)
+            if not aoi_geom.intersects(tile):
+                continue
+
+            cell_cols, cell_rows = intersecting_cells(aoi_geom, tile_x, tile_y, spacing, tile_columns, tile_rows)
+            if len(cell_cols) == 0:
+                continue
+
+            x = tile_x + cell_cols * spacing
+            y = tile_y + cell_rows * spacing
+            gdf = gpd.GeoDataFrame(geometry=shapely.box(x, y, x + spacing, y + spacing), crs=crs)
+
+            cell_ids = (tile_col + cell_cols) * rows + tile_row + cell_rows
+            tile_seed = None if seed is None else [seed, tile_col, tile_row]
+            yield cells_to_points(gdf, aoi_geom, sampling_strategy, points_per_cell, tile_seed, cell_ids)
+
+
+def cell_anchor_points(cells, aoi_geom):
+    """A point of each cell within the aoi, which does not depend on the tile
+
+    The centroid of the cells within the aoi, and a point on the surface of
+    the part within the aoi for the cells on its border, so that the anchor
+    lies in a tile that generated the cell. Cells outside the aoi get an
+    empty point.
+    """
+
+    anchors = shapely.centroid(cells)
+    border = ~shapely.contains(aoi_geom, cells)
+    anchors[border] = shapely.point_on_surface(shapely.intersection(cells[border], aoi_geom))
+    return anchors
+
+
+def hexagonal_grid_tiles(aoi, resolution, sampling_strategy='systematic', outcrs='ESRI:54017', projection='ISEA3H', points_per_cell=1, seed=None, tile_size=1):
+    """Generate a hexagonal grid tile by tile
+
+    Same grid as hexagonal_grid, but DGGRID is run on tiles of tile_size x tile_size
+    degrees of the AOI, and the cells and points are yielded per tile. Cells crossing
+    tile borders are only emitted by the tile whose half-open box contains their
+    anchor point (see cell_anchor_points), so nothing is kept across tiles. The
+    point_id is the DGGRID cell id, which is globally unique and stable.
+
+    Yields
+    ------
+    grid_gdf, point_gdf : GeoDataFrame
+        cells and points of one tile, in outcrs
+    """
+
+    # force lat/lon for dggrid
+    aoi = read_aoi(aoi).to_crs('EPSG:4326').dissolve()
+    aoi_ll = aoi.geometry.values[0]
+    aoi_geom = aoi.to_crs(outcrs).geometry.values[0]
+    shapely.prepare(aoi_ll)
+    shapely.prepare(aoi_geom)
+
+    minx, miny, maxx, maxy = aoi.total_bounds
+    tiles_x = int(np.ceil((maxx - minx) / tile_size))
+    tiles_y = int(np.ceil((maxy - miny) / tile_size))
+
+    for i in range(tiles_x):
+        for j in range(tiles_y):
+
+            # clip aoi to the tile
+            tile = shapely.box(minx + i * tile_size, miny + j * tile_size, minx + (i + 1) * tile_size, miny + (j + 1) * tile_size)
+            tile_aoi = shapely.intersection(aoi_ll, tile)
+            if tile_aoi.is_empty:
+                continue
+
+            grid = dggrid.grid_cells_for_extent(projection, resolution, tile_aoi)
+
+            # keep the cells of this tile, the outer tiles being open towards the outside
+            anchors = cell_anchor_points(np.asarray(grid.geometry), aoi_ll)
+            tile_i = np.clip(np.floor((shapely.get_x(anchors) - minx) / tile_size), 0, tiles_x - 1)
+            tile_j = np.clip(np.floor((shapely.get_y(anchors) - miny) / tile_size), 0, tiles_y - 1)
+            grid = grid[(tile_i == i) & (tile_j == j)]
+            if len(grid) == 0:
+                continue
+
+            gdf = grid.to_crs(outcrs).reset_index(drop=True)
+            tile_seed = None if seed is None else [seed, i, j]
+            yield cells_to_points(gdf, aoi_geom, sampling_strategy, points_per_cell, tile_seed, gdf['name'].values)
+
+
 def split_dataframe(df, chunk_size = 25000): 
         chunks = list()
         num_chunks = len(df) // chunk_size + 1
@@ -165,16 +410,11 @@ def upload_to_ee(gdf, asset_name):
     
     # get users asset root
     asset_root = ee.data.getAssetRoots()[0]['id']
+    manager = TaskManager()
     
     # if it is already a feature collection
     if isinstance(gdf, ee.FeatureCollection):
-        exportTask = ee.batch.Export.table.toAsset(
-                collection = gdf,
-                description = f'sbae_samples',
-                assetId = f'{asset_root}/{asset_name}'
-            )
-
-        exportTask.start()
+        manager.export_table_to_asset(gdf, 'sbae_samples', f'{asset_root}/{asset_name}')
         return
 
     if len(gdf) > 25000:
@@ -186,63 +426,29 @@ def upload_to_ee(gdf, asset_name):
         except:
             pass
 
-        # upload chunks of data to avoi max upload
+        # upload chunks of data to avoid max upload, all exports run concurrently
         chunks = split_dataframe(gdf)
-        tasks = []
-
+        asset_ids = []
         for i, chunk in enumerate(chunks):
+            
+            if len(chunk) == 0:
+                continue
 
             point_fc = geemap.geopandas_to_ee(chunk.to_crs("EPSG:4326"))
-            exportTask = ee.batch.Export.table.toAsset(
-                collection = point_fc,
-                description = f'sbae_part_{i}',
-                assetId = f'{asset_root}/tmp_sbae/points_{i}'
-            )
+            asset_ids.append(f'{asset_root}/tmp_sbae/points_{i}')
+            manager.export_table_to_asset(point_fc, f'sbae_part_{i}', asset_ids[-1])
 
-            exportTask.start()
-            tasks.append(exportTask)
+        # wait for all chunks
+        manager.wait()
 
-        # cha on status
-        
-        finished=False
-        while finished == False:
-            time.sleep(30)
-            for task in tasks:
-                state = task.status()['state']
-                if state == 'COMPLETED':
-                    finished = True
-                else:
-                    finished = False
-                    break
-
-        # merge assets
+        # merge assets in one go
         print('aggregate to final')
-        child_assets = ee.data.listAssets({'parent': f'{asset_root}/tmp_sbae'})['assets']
-        for i, ass in enumerate(child_assets):
-            if i == 0:
-                point_fc = ee.FeatureCollection(ass['id'])
-            else:
-                point_fc = point_fc.merge(ee.FeatureCollection(ass['id']))
+        point_fc = ee.FeatureCollection([ee.FeatureCollection(asset_id) for asset_id in asset_ids]).flatten()
 
         print('export final')
         # export to final
-        exportTask = ee.batch.Export.table.toAsset(
-                collection = point_fc,
-                description = f'sbae_aggregated_table',
-                assetId = f'{asset_root}/{asset_name}'
-            )
-
-        exportTask.start()
-
-        finished=False
-        while finished == False:
-            time.sleep(30)
-            state = exportTask.status()['state']
-
-            if state == 'COMPLETED':
-                finished = True
-            else:
-                finished = False
+        manager.export_table_to_asset(point_fc, 'sbae_aggregated_table', f'{asset_root}/{asset_name}')
+        manager.wait()
 
         print('delete temporary assets')
         child_assets = ee.data.listAssets({'parent': f'{asset_root}/tmp_sbae'})['assets']
@@ -259,26 +465,11 @@ def upload_to_ee(gdf, asset_name):
         
         print(' Exporting to asset')
         # export to final
-        exportTask = ee.batch.Export.table.toAsset(
-                collection = point_fc,
-                description = f'sbae_aggregated_table',
-                assetId = f'{asset_root}/{asset_name}'
-            )
-
-        exportTask.start()
-
-        finished=False
-        while finished == False:
-            time.sleep(30)
-            state = exportTask.status()['state']
-
-            if state == 'COMPLETED':
-                finished = True
-            else:
-                finished = False
+        manager.export_table_to_asset(point_fc, 'sbae_aggregated_table', f'{asset_root}/{asset_name}')
+        manager.wait()
 
                 
-def save_locally(gdf, ceo_csv=True, gpkg=True, outdir=None):
+def save_locally(gdf, ceo_csv=True, gpkg=True, outdir=None, parquet=False):
     
     # if it is already a feature collection
     if isinstance(gdf, ee.FeatureCollection):
@@ -308,8 +499,62 @@ def save_locally(gdf, ceo_csv=True, gpkg=True, outdir=None):
         
     if gpkg:
         gdf.to_file(outdir.joinpath('01_sbae_points.gpkg'), driver='GPKG')
+        
+    if parquet:
+        gdf.to_parquet(outdir.joinpath('01_sbae_points.parquet'), index=False)
           
 
+def save_tiles_locally(tiles, ceo_csv=True, parquet=True, grid_cells=False, outdir=None):
+    """Write the output of squared_grid_tiles or hexagonal_grid_tiles tile by tile
+
+    Points (and optionally grid cells) are appended to a partitioned GeoParquet
+    dataset, i.e. a folder with one file per tile, and to the CEO csv, so that
+    only one tile is held in memory at a time.
+    """
+
+    if not outdir:
+        outdir = Path.home().joinpath('module_results/sbae_point_analysis')
+
+    if not isinstance(outdir, Path):
+        outdir = Path(outdir)
+
+    point_dir = outdir.joinpath('01_sbae_points.parquet')
+    grid_dir = outdir.joinpath('01_sbae_grid.parquet')
+    csv_file = outdir.joinpath('01_sbae_points.csv')
+
+    # start from scratch
+    for folder in [point_dir, grid_dir]:
+        if folder.exists():
+            for file in folder.glob('part-*.parquet'):
+                file.unlink()
+    if csv_file.exists():
+        csv_file.unlink()
+
+    print(f' Saving outputs to {outdir}')
+    nr_points = 0
+    for i, (grid_gdf, point_gdf) in enumerate(tiles):
+
+        if parquet:
+            point_dir.mkdir(parents=True, exist_ok=True)
+            point_gdf.to_parquet(point_dir.joinpath(f'part-{i:05d}.parquet'), index=False)
+
+        if grid_cells:
+            grid_dir.mkdir(parents=True, exist_ok=True)
+            grid_gdf.to_parquet(grid_dir.joinpath(f'part-{i:05d}.parquet'), index=False)
+
+        if ceo_csv:
+            coords = point_gdf.geometry.to_crs('EPSG:4326')
+            pd.DataFrame({
+                'PLOTID': point_gdf['point_id'].values,
+                'LAT': coords.y.values,
+                'LON': coords.x.values
+            }).to_csv(csv_file, mode='a', header=not csv_file.exists(), index=False)
+
+        nr_points += len(point_gdf)
+
+    print(f' Saved {nr_points} points.')
+
+
 def plot_samples(aoi, sample_points, grid_cells=None):
     
     fig, ax = plt.subplots(1, 1, figsize=(25, 25))
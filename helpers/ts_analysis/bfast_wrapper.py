@@ -1,28 +1,191 @@
+from datetime import datetime as dt
+
 import numpy as np
 import pandas as pd
-from datetime import datetime as dt
 
 from bfast import BFASTMonitor
-from godale import Executor
+from bfast.monitor.utils import compute_lam
+
+from helpers.ts_analysis.ragged import EPOCH, RaggedTimeSeries, decimal_years, to_day_numbers
+from helpers.ts_analysis.shared import block_executor, shared_time_series
 
 # default bFast parameters
 defaults = {
-    'start_monitor': dt.strptime('2000-01-01', '%Y-%m-%d'), 
+    'start_monitor': dt.strptime('2000-01-01', '%Y-%m-%d'),
     'freq': 365,
-    'k': 3, 
-    'hfrac':0.25, 
-    'trend': False, 
-    'level':0.05, 
+    'k': 3,
+    'hfrac':0.25,
+    'trend': False,
+    'level':0.05,
     'backend':'python'
 }
 
-def bfast_monitor(args): 
+
+def design_matrix(mapped_indices, freq, k, trend):
+    """Seasonal (and trend) regressors of BFAST Monitor, as columns"""
+
+    temp = 2 * np.pi * mapped_indices / float(freq)
+    columns = [np.ones(len(mapped_indices))] + ([mapped_indices.astype(np.float64)] if trend else [])
+    for j in range(1, k + 1):
+        columns += [np.sin(j * temp), np.cos(j * temp)]
+    return np.column_stack(columns)
+
+
+def mosum_breaks(y_error, ns, h, k, bounds):
+    """
+    MOSUM process of the monitoring period and its first boundary crossing
+
+    Parameters
+    ----------
+    y_error : ndarray
+        (time, points) residuals of the history model, without missing values
+    ns : int
+        number of observations in the history period
+    h : int
+        bandwidth of the moving sums
+    k : int
+        number of harmonic terms
+    bounds : ndarray
+        (time - ns,) boundary of the monitoring period
+
+    Returns
+    -------
+        breaks : ndarray
+            index of the first break within the monitoring period, -1 without
+        means : ndarray
+            mean of the MOSUM process
+        magnitudes : ndarray
+            median residual of the monitoring period
+    """
+
+    err_cs = np.cumsum(y_error[ns - h:], axis=0)
+    mosum = err_cs[h:] - err_cs[:-h]
+
+    sigma = np.sqrt(np.sum(y_error[:ns] ** 2, axis=0) / (ns - (2 + 2 * k)))
+    mosum = mosum / (sigma * np.sqrt(ns))
+
+    crossed = np.abs(mosum) > bounds[:, None]
+    breaks = np.where(crossed.any(axis=0), crossed.argmax(axis=0), -1)
+    return breaks, mosum.mean(axis=0), np.median(y_error[ns:], axis=0)
+
+
+def bfast_monitor_batch(data, days, start_monitor, bfast_params):
+    """
+    BFAST Monitor of many time-series with the same dates
+
+    Numpy implementation of the python backend of the bfast package
+    (BFASTMonitorPython.fit_single), with the history models of all points
+    fitted by a single least squares solve and the MOSUM processes computed as
+    (time, points) arrays. Points with missing values, which change the
+    history period, are fitted one by one. As in the bfast package, values of
+    0 are treated as missing.
+
+    Parameters
+    ----------
+    data : ndarray
+        (time, points) values
+    days : ndarray
+        day numbers of the dates, as in RaggedTimeSeries
+    start_monitor : datetime
+    bfast_params : dict
+        freq, k, hfrac, trend, level and the optional period (default 10)
+
+    Returns
+    -------
+        breaks : ndarray
+            index of the first break in the monitoring period, -1 without and
+            -2 with too few observations
+        means : ndarray
+        magnitudes : ndarray
+    """
+
+    freq, k, hfrac, trend, level = (bfast_params[key] for key in ['freq', 'k', 'hfrac', 'trend', 'level'])
+    data = np.where(data == 0, np.nan, data).astype(np.float64)
+    N, nr_points = data.shape
+
+    # end of the history period and days since the 1st of January of the first year
+    n = int(np.searchsorted(days, to_day_numbers(start_monitor), side='left'))
+    mapped_indices = days - to_day_numbers(f'{pd.Timestamp(days[0], unit="D").year}-01-01')
+    X = design_matrix(mapped_indices, freq, k, trend)
+
+    # not enough observations in the history or monitoring period, whatever is missing
+    breaks, means, magnitudes = np.full(nr_points, -2), np.zeros(nr_points), np.zeros(nr_points)
+    if n <= 5 or N - n <= 5:
+        return breaks, means, magnitudes
+
+    # boundary of the monitoring period
+    lam = compute_lam(N, hfrac, level, bfast_params.get('period', 10))
+    a = mapped_indices[n:] / float(mapped_indices[n - 1])
+    bounds = lam * np.sqrt(np.where(a > np.e, np.log(np.maximum(a, np.e)), 1))
+
+    # points without missing values, all at once
+    complete = ~np.isnan(data).any(axis=0)
+    h = int(float(n) * hfrac)
+    if complete.any():
+        Y = data[:, complete]
+        coef = np.linalg.lstsq(X[:n], Y[:n], rcond=None)[0]
+        breaks[complete], means[complete], magnitudes[complete] = mosum_breaks(Y - X @ coef, n, h, k, bounds)
+
+    # points with missing values
+    for i in np.flatnonzero(~complete):
+        valid = ~np.isnan(data[:, i])
+        ns, Ns = int(valid[:n].sum()), int(valid.sum())
+        if ns <= 5 or Ns - ns <= 5:
+            continue
+
+        X_nn, y_nn = X[valid], data[valid, i]
+        coef = np.linalg.lstsq(X_nn[:ns], y_nn[:ns], rcond=None)[0]
+        y_error = (y_nn - X_nn @ coef)[:, None]
+
+        # MOSUM of the valid observations, at their dates within the monitoring period
+        val_inds = np.flatnonzero(valid)[ns:] - n
+        (brk,), (means[i],), (magnitudes[i],) = mosum_breaks(y_error, ns, int(float(ns) * hfrac), k, bounds[val_inds])
+        breaks[i] = val_inds[brk] if brk >= 0 else -1
+
+    return breaks, means, magnitudes
+
+
+def bfast_group(data, days, start_monitor, bfast_params):
+    """
+    Change dates, magnitudes and means of a (time, points) group of time-series with the same dates
+
+    The numpy implementation is used for the python backend, the array-oriented
+    fit of the bfast package for the others (e.g. opencl).
+    """
+
+    nr_points = data.shape[1]
+    mon_days = days[days > to_day_numbers(start_monitor)]
+
+    # check if we have dates in the monitoring period
+    if not len(mon_days):
+        # no image in historical period
+        return np.full(nr_points, -2.), np.zeros(nr_points), np.zeros(nr_points)
+
+    if bfast_params.get('backend', 'python') == 'python':
+        breaks, means, magnitudes = bfast_monitor_batch(data, days, start_monitor, bfast_params)
+    else:
+        params = {
+            key: value for key, value in bfast_params.items()
+            if key not in ['run', 'start_monitor', 'executor', 'max_workers']
+        }
+        model = BFASTMonitor(start_monitor=start_monitor, **params)
+        model.fit(data[:, None, :], pd.DatetimeIndex(EPOCH + days.astype('timedelta64[D]')))
+        breaks, means, magnitudes = model.breaks[0], model.means[0], model.magnitudes[0]
+
+    # in case not enough images or no breaks, the break index stands for the date
+    found = breaks >= 0
+    dates = breaks.astype(np.float64)
+    dates[found] = decimal_years(mon_days[breaks[found] - 1])
+    return dates, np.where(found, magnitudes, 0), np.where(found, means, 0)
+
+
+def bfast_monitor(args):
     """
     Wrapper for BFAST's python implementation
-    
+
     Parameters
     ----------
-    
+
     dates : int
         list of dates for the time-series
     data : float
@@ -31,10 +194,10 @@ def bfast_monitor(args):
         start of the monitoring period
     bfast_params : dict
         dictionary of bfast parameters
-        
+
     Returns
     -----------
-    
+
     bfast_date : float32
         Change Date in fractional year date format
     bfast_magnitude : float32
@@ -42,74 +205,78 @@ def bfast_monitor(args):
     bfast_means : float32
         Change confidence of detected break
     """
-    
+
     # unpack args
     data, dates, point_id, bfast_params = args
 
-    # initialize model
-    params = bfast_params.copy()
-    params.update(start_monitor=dt.strptime(bfast_params['start_monitor'], '%Y-%m-%d'))
-    
-    params.pop('run', None)
-    model = BFASTMonitor(**params)
-    
-    # check if we have dates in the monitoring period
     start_monitor = dt.strptime(bfast_params['start_monitor'], '%Y-%m-%d')
-    mon_dates = [date for date in dates if date > params['start_monitor']]
-    if mon_dates: 
-        # fit gistorical period
-        model.fit(data, dates)
-        
-        # get breaks in the monitoring period
-        if model.breaks < 0:
-            # in case not enough images or no breaks
-            bfast_date = model.breaks
-            # get magnitude and means
-            bfast_magnitude = 0
-            bfast_means = 0
-        else:
-            # get index of break
-            bfast_date = mon_dates[model.breaks-1]
-            # transform dates to fractional years
-            bfast_date = bfast_date.year + np.round(bfast_date.dayofyear/365, 3)
-
-            # get magnitude and means
-            bfast_magnitude = model.magnitudes
-            bfast_means = model.means
-    else:
-        # no image in historical period
-        bfast_date = -2
-        # get magnitude and means
-        bfast_magnitude = 0
-        bfast_means = 0
+    days = to_day_numbers(dates)
+    result = bfast_group(np.asarray(data, dtype=np.float64)[:, None], days, start_monitor, bfast_params)
+    return (*(metric[0] for metric in result), point_id)
+
+
+def bfast_group_task(args):
+    """bfast_group of a group of points of run_bfast_monitor, with the same dates"""
+
+    ts, ts_band, start_monitor, bfast_params, group_id = args
 
-    return bfast_date, bfast_magnitude, bfast_means, point_id
+    # (time, points) values of the group
+    index = ts.starts + np.arange(ts.lengths[0])[:, None]
+    return (*bfast_group(ts.values[ts_band][index], ts.point_days(0), start_monitor, bfast_params), group_id)
 
 
-def run_bfast_monitor(df, config_dict):
+def run_bfast_monitor(df, config_dict, ts=None):
     """
-    Parallel implementation of the bfast_monitor function
+    Batched implementation of the bfast_monitor function
+
+    Points with the same dates (e.g. of the same path/row) are grouped and
+    each group is fitted as one (time, points) array, in parallel threads, or
+    in processes with executor set to 'processes' in the bfast_params
+    (max_workers, default 16). The points of failed groups are left out of
+    the returned DataFrame.
+
+    ts is a RaggedTimeSeries of the whole period, taken from the dates and ts
+    columns of df if not given
     """
-    
+
     bfast_params = config_dict['bfast_params']
     ts_band = config_dict['ts_params']['ts_band']
     point_id_name = config_dict['ts_params']['point_id']
-    
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        args_list.append([row.ts[ts_band], row.dates, row[point_id_name], bfast_params])
-        #d[i] = bfast_monitor(args_list[i])
-    
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=bfast_monitor,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("bfast task failed")
-            
-    bfast_df = pd.DataFrame.from_dict(d, orient='index')
-    bfast_df.columns = ['bfast_change_date', 'bfast_magnitude', 'bfast_means', point_id_name]
-    return pd.merge(df, bfast_df, on=point_id_name)    
\ No newline at end of file
+    ts = ts if ts is not None else RaggedTimeSeries.from_frame(df, [ts_band], point_id_name)
+    start_monitor = dt.strptime(bfast_params['start_monitor'], '%Y-%m-%d')
+
+    # group the points by their dates
+    groups = {}
+    for i in range(len(ts)):
+        groups.setdefault(ts.point_days(i).tobytes(), []).append(i)
+    groups = list(groups.values())
+
+    bfast_date, bfast_magnitude, bfast_means = np.zeros(len(ts)), np.zeros(len(ts)), np.zeros(len(ts))
+    done = np.zeros(len(ts), dtype=bool)
+    with shared_time_series(ts, bfast_params) as group_ts:
+        args_list = [
+            [group_ts.take(rows), ts_band, start_monitor, bfast_params, group_id]
+            for group_id, rows in enumerate(groups)
+        ]
+
+        executor = block_executor(bfast_params)
+        for task in executor.as_completed(
+            func=bfast_group_task,
+            iterable=args_list
+        ):
+            try:
+                dates, magnitudes, means, group_id = task.result()
+            except ValueError:
+                print("bfast task failed")
+                continue
+
+            rows = groups[group_id]
+            bfast_date[rows], bfast_magnitude[rows], bfast_means[rows] = dates, magnitudes, means
+            done[rows] = True
+
+    # points of failed groups are left out, so that they are processed again
+    bfast_df = pd.DataFrame({
+        'bfast_change_date': bfast_date, 'bfast_magnitude': bfast_magnitude, 'bfast_means': bfast_means,
+        point_id_name: ts.point_ids
+    })[done]
+    return pd.merge(df, bfast_df, on=point_id_name)
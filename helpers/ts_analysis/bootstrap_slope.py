@@ -1,69 +1,225 @@
 import numpy as np
 import pandas as pd
-from godale import Executor
 
-def slope(x, y):
-    A = np.vstack([x, np.ones(len(x))]).T
-    m, c = np.linalg.lstsq(A, y, rcond=None)[0]
-    return m
+from helpers.ts_analysis.ragged import RaggedTimeSeries, decimal_years
+from helpers.ts_analysis.shared import block_executor, shared_time_series
+
+# the fraction of the time-series included in each bootstrap sample
+SAMPLE_FRACTION = .66
+
+
+def subsample_masks(keys, length):
+    """
+    0/1 masks of random subsamples without replacement of a time-series of length
+
+    Each row selects the int(length * SAMPLE_FRACTION) positions with the
+    smallest random keys among the first length ones.
+    """
+
+    k = int(length * SAMPLE_FRACTION)
+    keys = keys[:, :length]
+    if k == 0:
+        return np.zeros(keys.shape)
+
+    threshold = np.partition(keys, k - 1, axis=1)[:, k - 1:k]
+    return np.less_equal(keys, threshold, out=np.empty(keys.shape))
+
+
+def ols_slopes(masks, x, y):
+    """
+    Slopes of the linear regressions of y on x over the subsamples of masks
+
+    The sums of the normal equations are matrix products of the (bootstraps,
+    time) masks with the (points, time) values, so all bootstraps of all
+    points of the same length are solved at once.
+
+    Parameters
+    ----------
+    masks : ndarray
+        (bootstraps, time) 0/1 subsamples
+    x, y : ndarray
+        (points, time), centred per point for numerical stability
+
+    Returns
+    -------
+    ndarray
+        (bootstraps, points) slopes, 0 where they are undefined (subsamples
+        without observations or with a single date)
+    """
+
+    k = masks.sum(axis=1, keepdims=True)
+    sx, sy = masks @ x.T, masks @ y.T
+    sxx, sxy = masks @ (x * x).T, masks @ (x * y).T
+
+    numerator, denominator = k * sxy - sx * sy, k * sxx - sx ** 2
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def single_observation_slopes(masks, x, y):
+    """
+    Slopes of subsamples of a single observation, as np.linalg.lstsq
+
+    A line through one point is underdetermined, lstsq returns the
+    minimum-norm solution, of slope x * y / (x^2 + 1) for the date and value
+    (not centred). This is the case of series of 2 and 3 observations.
+
+    Parameters
+    ----------
+    masks : ndarray
+        (bootstraps, time) 0/1 subsamples of one observation each
+    x, y : ndarray
+        (points, time)
+
+    Returns
+    -------
+    ndarray
+        (bootstraps, points) slopes
+    """
+
+    return masks @ (x * y / (x * x + 1)).T
+
+
+def bootstrap_slopes(ts, years, ts_band, nr_bootstraps, rng=None, block_size=2**22):
+    """
+    Bootstrap of the slope of the linear regression of the values on the dates
+
+    Every bootstrap fits the slope to a random subsample of SAMPLE_FRACTION
+    of the observations of each point. The random keys are drawn in blocks of
+    at most block_size values and shared by all points, so points of the same
+    length share their subsamples and their slopes are solved together by
+    ols_slopes. Series of 2 and 3 observations, with subsamples of a single
+    one, get the minimum-norm slopes of lstsq (see single_observation_slopes)
+    and series of 1 observation a slope of 0, as the former implementation.
+
+    Parameters
+    ----------
+    ts : RaggedTimeSeries
+    years : ndarray
+        fractional years of ts.days
+    ts_band : str
+    nr_bootstraps : int
+    rng : numpy.random.Generator, optional
+    block_size : int, default=2**22
+
+    Returns
+    -------
+    ndarray
+        (points, 4) mean, standard deviation, max and min of the slopes, 0 for
+        points without observations
+    """
+
+    rng = rng if rng is not None else np.random.default_rng()
+    lengths = ts.lengths
+    stats = np.zeros((len(ts), 4))
+    if not lengths.any():
+        return stats
+
+    # dates and values of the points per length, centred for the closed form
+    groups = {}
+    for length in np.unique(lengths[lengths > 0]):
+        rows = np.flatnonzero(lengths == length)
+        index = ts.starts[rows, None] + np.arange(length)
+        x, y = years[index], ts.values[ts_band][index].astype(np.float64)
+        if int(length * SAMPLE_FRACTION) == 1:
+            groups[length] = single_observation_slopes, rows, x, y, []
+        else:
+            groups[length] = ols_slopes, rows, x - x.mean(axis=1, keepdims=True), y - y.mean(axis=1, keepdims=True), []
+
+    width = int(lengths.max())
+    per_block = max(1, block_size // width)
+    i = 0
+    while i < nr_bootstraps:
+        n = min(per_block, nr_bootstraps - i)
+        keys = rng.random((n, width))
+        for length, (fit, rows, x, y, slopes) in groups.items():
+            slopes.append(fit(subsample_masks(keys, length), x, y))
+        i += n
+
+    # calculate stats
+    for fit, rows, x, y, slopes in groups.values():
+        slopes = np.concatenate(slopes)
+        stats[rows] = np.column_stack([slopes.mean(axis=0), slopes.std(axis=0), slopes.max(axis=0), slopes.min(axis=0)])
+
+    return stats
+
 
 def bootstrap_slope(args):
     # This function takes x and y and calculates the bootstrap on the slope of the linear regression between both,
     # whereas values are sorted
-    
+
     # unpack args and transform data and dates into numpy arrays
     y, x, nr_bootstraps, point_id = args
-    if x:
-        x, y = np.array(x), np.array(y)
+    if len(x):
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        ts = RaggedTimeSeries.from_offsets([point_id], [0, len(y)], None, {'y': y})
+        return (*bootstrap_slopes(ts, x, 'y', nr_bootstraps)[0], point_id)
+    else:
+        return 0, 0, 0, 0, point_id
 
-        boot_means = []
-        for _ in range(nr_bootstraps):
 
-            # the fraction of sample we want to include (randon)
-            #size = np.abs(np.random.normal(0.5, 0.1))
-            size = .66
-            
-            # select the random samples
-            rand_idx = sorted(np.random.choice(np.arange(y.size), int(y.size * size), replace=False))
+def bs_slope_block(args):
+    """bootstrap_slopes of a block of points of a RaggedTimeSeries"""
 
-            # calculate the slope on the randomly selected samples
-            s = slope(x[rand_idx], y[rand_idx])
+    ts, ts_band, nr_bootstraps, seed, block_size, block_id = args
 
-            # add to list of bootstrap samples
-            boot_means.append(s)
+    # fractional years of the dates of the block only
+    ts = ts.compact()
+    years = decimal_years(ts.days)
+    return bootstrap_slopes(ts, years, ts_band, nr_bootstraps, np.random.default_rng(seed), block_size), block_id
 
-        # calculate stats adn return
-        boot_means_np = np.array(boot_means)
-        return np.mean(boot_means_np), np.std(boot_means_np), np.max(boot_means_np), np.min(boot_means_np), point_id
-    else:
-        return 0, 0, 0, 0, point_id
 
-
-def run_bs_slope(df, config_dict):
+def run_bs_slope(df, config_dict, ts=None):
     """
-    Parallel implementation of the bootstrap slope function
+    Batched implementation of the bootstrap slope function
+
+    The points are sorted by their number of observations and processed in
+    blocks of points_per_block (bs_slope_params, default 256) in parallel
+    threads, or in processes with executor set to 'processes' (max_workers,
+    default 16). The optional seed of the bs_slope_params makes the bootstrap
+    reproducible. The points of failed blocks are left out of the returned
+    DataFrame.
+
+    ts is a RaggedTimeSeries of the monitoring period, taken from the dates_mon
+    and ts_mon columns of df if not given
     """
-    
+
     bs_slope_params = config_dict['bs_slope_params']
     ts_band = config_dict['ts_params']['ts_band']
     point_id_name = config_dict['ts_params']['point_id']
     nr_of_bootstraps = bs_slope_params['nr_of_bootstraps']
-    
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        dates_float = [(date.year + np.round(date.dayofyear/365, 3)) for date in row.dates_mon] 
-        args_list.append([row.ts_mon[ts_band], dates_float, nr_of_bootstraps, row[point_id_name]])
-        
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=bootstrap_slope,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("bootstrap task failed")
-            
-    slope_df = pd.DataFrame.from_dict(d, orient='index')
-    slope_df.columns = ['bs_slope_mean', 'bs_slope_sd', 'bs_slope_max', 'bs_slope_min', point_id_name]
-    return pd.merge(df, slope_df, on=point_id_name)    
\ No newline at end of file
+    points_per_block = bs_slope_params.get('points_per_block', 256)
+    block_size = bs_slope_params.get('block_size', 2**22)
+    ts = ts if ts is not None else RaggedTimeSeries.from_frame(df, [ts_band], point_id_name, 'dates_mon', 'ts_mon')
+
+    # blocks of points with similar lengths, which share their subsamples
+    order = np.argsort(ts.lengths, kind='stable')
+    blocks = [order[i:i + points_per_block] for i in range(0, len(order), points_per_block)]
+    seeds = np.random.SeedSequence(bs_slope_params.get('seed')).spawn(len(blocks))
+
+    stats = np.zeros((len(ts), 4))
+    done = np.zeros(len(ts), dtype=bool)
+    with shared_time_series(ts, bs_slope_params) as block_ts:
+        args_list = [
+            [block_ts.take(block), ts_band, nr_of_bootstraps, seed, block_size, i]
+            for i, (block, seed) in enumerate(zip(blocks, seeds))
+        ]
+
+        executor = block_executor(bs_slope_params)
+        for task in executor.as_completed(
+            func=bs_slope_block,
+            iterable=args_list
+        ):
+            try:
+                block_stats, block_id = task.result()
+            except ValueError:
+                print("bootstrap task failed")
+                continue
+
+            stats[blocks[block_id]] = block_stats
+            done[blocks[block_id]] = True
+
+    # points of failed blocks are left out, so that they are processed again
+    slope_df = pd.DataFrame(stats, columns=['bs_slope_mean', 'bs_slope_sd', 'bs_slope_max', 'bs_slope_min'])
+    slope_df[point_id_name] = ts.point_ids
+    slope_df = slope_df[done]
+    return pd.merge(df, slope_df, on=point_id_name)
@@ -1,63 +1,202 @@
 import numpy as np
 import pandas as pd
-import tensorflow as tf 
-from godale import Executor
+
+from helpers.ts_analysis.ragged import RaggedTimeSeries, decimal_years
+from helpers.ts_analysis.shared import block_executor, shared_time_series
+
+
+def divide_no_nan(a, b):
+    """a / b, with 0 where b is 0"""
+
+    return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape, dtype=np.float32), where=b != 0)
+
 
 def cusum_calculation(residuals):
-    
+    """
+    Range and position of the maximum of the cumulative sums along the last axis
+
+    Parameters
+    ----------
+    residuals : ndarray
+        (..., points, time) residuals, padded with zeros at the end
+
+    Returns
+    -------
+        s_diff : ndarray
+            s_max - s_min per time-series
+        argmax : ndarray
+            position of s_max per time-series
+    """
+
     # do cumsum calculation
-    cumsum = tf.math.cumsum(residuals, axis=0)
-    s_max = tf.math.reduce_max(cumsum, axis=0)
-    s_min = tf.math.reduce_min(cumsum, axis=0)
-    s_diff = tf.subtract(s_max, s_min)
-   
-    # get podition of max value
-    argmax = tf.math.argmax(cumsum, axis=0)
-                
+    cumsum = np.cumsum(residuals, axis=-1)
+    s_diff = cumsum.max(axis=-1) - cumsum.min(axis=-1)
+
+    # get position of max value
+    argmax = cumsum.argmax(axis=-1)
+
     return s_diff, argmax
 
 
-def bootstrap(stack, s_diff, nr_bootstraps):
-    
-    # intialize iteration variables
-    i, comparison_array, change_sum = 0, tf.zeros(s_diff.shape), tf.zeros(s_diff.shape)
-    while i < nr_bootstraps:
-        
-        # shuffle first axis 
-        shuffled_index = tf.random.shuffle(range(stack.shape[0]))
-        
-        # run cumsum on re-shuffled stack
-        s_diff_bs, _ = cusum_calculation(tf.gather(stack, shuffled_index, axis=0))
-        
+def cusum_residuals(stack, mask):
+    """
+    Residuals from the mean of a (points, time) matrix
+
+    Values that are missing, masked or 0 get a residual of 0, as the nans of
+    the original implementation
+    """
+
+    valid = mask & np.isfinite(stack)
+    stack = np.where(valid, stack, 0).astype(np.float32)
+
+    # calculate mean (accumulated in double precision, so the padding does not matter)
+    mean = divide_no_nan(stack.sum(axis=1, dtype=np.float64), valid.sum(axis=1))
+
+    # calculate residuals and treat original nans (and padding) as zeros
+    residuals = stack - mean[:, None]
+    residuals[stack == 0] = 0
+    return residuals
+
+
+def bootstrap(residuals, s_diff, nr_bootstraps, rng=None, block_size=2**22, tolerance=None, min_bootstraps=100, z=1.96):
+    """
+    Bootstrap confidence of the cusum change of many time-series at once
+
+    Each bootstrap permutes the columns of the (points, time) matrix, with the
+    same permutation for all points. For each point this is a random
+    permutation of its observations, with the zero padding spread in between,
+    where it does not change the range of the cumulative sums (which end at 0
+    for residuals from the mean). The permutations are drawn in blocks of at
+    most block_size values, which bounds the memory.
+
+    With a tolerance, the bootstrap of a point stops early, once at least
+    min_bootstraps have been drawn and the z-interval of its confidence is
+    narrower than +-tolerance. The variance of the confidence (the product of
+    the share of smaller random changes and of the significance) is estimated
+    from the draws so far with the delta method. Clear changes and stable
+    points settle after a few dozen draws.
+
+    Parameters
+    ----------
+    residuals : ndarray
+        (points, time) as from cusum_residuals
+    s_diff : ndarray
+        (points,) observed s_max - s_min
+    nr_bootstraps : int
+        number of bootstraps, the maximum with a tolerance
+    rng : numpy.random.Generator, optional
+    block_size : int, default=2**22
+        maximum number of values permuted at once
+    tolerance : float, optional
+        half-width of the confidence interval at which to stop
+    min_bootstraps : int, default=100
+    z : float, default=1.96
+        quantile of the confidence interval
+
+    Returns
+    -------
+        confidence : ndarray
+        nr_used : ndarray
+            number of bootstraps per point
+    """
+
+    rng = rng if rng is not None else np.random.default_rng()
+    nr_points, width = residuals.shape
+
+    # intialize iteration variables (sums of the indicator, of s_diff_bs, its square and their product)
+    i, active = 0, np.ones(nr_points, dtype=bool)
+    nr_used = np.zeros(nr_points, dtype=np.int64)
+    comparison_array, change_sum = np.zeros(nr_points), np.zeros(nr_points)
+    change_squares, comparison_change = np.zeros(nr_points), np.zeros(nr_points)
+    while i < nr_bootstraps and active.any():
+        rows = np.flatnonzero(active)
+        n = min(max(1, block_size // (len(rows) * width or 1)), nr_bootstraps - i)
+        if tolerance is not None:
+            n = min(n, min_bootstraps)
+
+        # shuffle the time axis, n times at once
+        shuffled_index = np.argsort(rng.random((n, width), dtype=np.float32), axis=-1)
+
+        # run cumsum on re-shuffled stacks of the active points, (points, n)
+        s_diff_bs, _ = cusum_calculation(residuals[rows][:, shuffled_index])
+        s_diff_bs = s_diff_bs.astype(np.float64)
+
         # compare if s_diff_bs is greater and sum up
-        comparison_array += tf.cast(tf.greater(s_diff, s_diff_bs), 'float32') 
-        
-        # sum up random change magnitude s_diff_bs 
-        change_sum += s_diff_bs
-        
+        greater = s_diff[rows, None] > s_diff_bs
+        comparison_array[rows] += greater.sum(axis=1)
+
+        # sum up random change magnitude s_diff_bs
+        change_sum[rows] += s_diff_bs.sum(axis=1)
+        change_squares[rows] += (s_diff_bs ** 2).sum(axis=1)
+        comparison_change[rows] += (s_diff_bs * greater).sum(axis=1)
+
         # set counter
-        i+=1
-    
+        nr_used[rows] += n
+        i += n
+
+        if tolerance is not None and i >= min_bootstraps:
+            active[rows[confidence_halfwidth(
+                comparison_array[rows], change_sum[rows], change_squares[rows], comparison_change[rows],
+                s_diff[rows], i, z
+            ) <= tolerance]] = False
+
     # calculate final confidence and significance
-    confidences = tf.math.divide_no_nan(comparison_array, nr_bootstraps)
-    signficance = tf.math.subtract(1, tf.math.divide_no_nan(tf.math.divide_no_nan(change_sum, nr_bootstraps), s_diff))
-    
+    confidences = comparison_array / nr_used
+    signficance = 1 - divide_no_nan(change_sum / nr_used, s_diff)
+
     # calculate final confidence level
-    change_point_confidence = tf.math.multiply(confidences, signficance)
-    
-    return change_point_confidence
+    return (confidences * signficance).astype(np.float32), nr_used
+
+
+def confidence_halfwidth(comparison_sum, change_sum, change_squares, comparison_change, s_diff, n, z):
+    """z-interval half-width of the bootstrap confidence after n draws, by the delta method"""
+
+    p, m = comparison_sum / n, change_sum / n
+    var_p = p * (1 - p)
+    var_m = np.maximum(change_squares / n - m ** 2, 0)
+    cov = comparison_change / n - p * m
+
+    # gradient of p * (1 - m / s_diff)
+    grad_p = 1 - divide_no_nan(m, s_diff)
+    grad_m = -divide_no_nan(p, s_diff)
+    var = grad_p ** 2 * var_p + grad_m ** 2 * var_m + 2 * grad_p * grad_m * cov
+    return z * np.sqrt(np.maximum(var, 0) / n)
+
+
+def cusum_matrix(stack, mask, nr_bootstraps, rng=None, block_size=2**22, tolerance=None, min_bootstraps=100):
+    """
+    Page's Cumulative Sum Test of a (points, time) matrix
+
+    Returns
+    -------
+        argmax : ndarray
+            position of the change within the observations of each point
+        confidence : ndarray
+        magnitude : ndarray
+        nr_used : ndarray
+            number of bootstraps per point
+    """
+
+    residuals = cusum_residuals(stack, mask)
+
+    # get original cumsum calculation
+    s_diff, argmax = cusum_calculation(residuals)
+
+    # get confidence from bootstrap procedure
+    confidence, nr_used = bootstrap(residuals, s_diff, nr_bootstraps, rng, block_size, tolerance, min_bootstraps)
+    return argmax, confidence, s_diff, nr_used
 
 
 def cusum_deforest(args):
     """
     Calculates Page's Cumulative Sum Test according to NASA SERVIR Handbook's implementation
-    
+
     Parameters
     ----------
     stack : pandas series
             dates as index and values of the time-series
     nr_bootstraps : int, default=1000
-                
+
     Returns
     -------
         date : float32
@@ -67,62 +206,98 @@ def cusum_deforest(args):
         magnitude : float32
             Change magnitude based on the s_max parameter
     """
-    
+
     # unpack args
     data, dates, point_id, nr_bootstraps = args
-    
-    if data:
-        stack_tf = tf.convert_to_tensor(np.nan_to_num(data), dtype='float32')
-        mask = tf.convert_to_tensor(np.isfinite(data).astype('float32'), dtype='float32')
 
-        # calculate mean
-        mean_tf = tf.math.divide_no_nan(tf.math.reduce_sum(stack_tf, axis=0), tf.math.reduce_sum(mask, axis=0))
+    if len(data):
+        stack = np.asarray(data, dtype=np.float32)[None]
+        argmax, confidence, magnitude, _ = cusum_matrix(stack, np.ones(stack.shape, dtype=bool), nr_bootstraps)
+        date, confidence, magnitude = np.asarray(dates)[argmax[0]], confidence[0], magnitude[0]
+    else:
+        date, confidence, magnitude = 0, 0, 0
+    return date, confidence, magnitude, point_id
 
-        # calculate residuals (broadcasting here)
-        residuals = tf.math.subtract(stack_tf, mean_tf)
 
-        # mask original nans of stack and treat them as zeros
-        residuals = tf.where(tf.math.equal(stack_tf, 0), tf.zeros_like(stack_tf), residuals)
+def cusum_block(args):
+    """cusum_matrix of a block of points of a RaggedTimeSeries"""
 
-        # get original cumsum caluclation and dates
-        s_diff, argmax = cusum_calculation(residuals)
+    ts, ts_band, nr_bootstraps, seed, block_size, tolerance, min_bootstraps, block_id = args
+    stack, mask = ts.dense(ts_band, fill=0)
+    return (
+        *cusum_matrix(stack, mask, nr_bootstraps, np.random.default_rng(seed), block_size, tolerance, min_bootstraps),
+        block_id
+    )
 
-        # get dates into change array
-        date = np.array(dates)[argmax.numpy()]
-        magnitude = s_diff.numpy()
 
-        # get confidence from bootstrap procedure
-        confidence = bootstrap(residuals, s_diff, nr_bootstraps).numpy()
-    else:
-        date, confidence, magnitude = 0, 0, 0
-    return date, confidence, magnitude, point_id
+def run_cusum_deforest(df, config_dict, ts=None):
+    """
+    Batched implementation of the cusum_deforest function
 
+    The points are sorted by their number of observations and processed in
+    blocks of points_per_block (cusum_params, default 256), each as one padded
+    matrix, in parallel threads, or in processes with executor set to
+    'processes' (max_workers, default 16). The optional seed of the
+    cusum_params makes the bootstrap reproducible.
 
-def run_cusum_deforest(df, config_dict):
-    """
-    Parallel implementation of the cusum_deforest function
+    With a tolerance in the cusum_params (e.g. 0.01), the bootstrap of each
+    point stops as soon as its confidence is known to within +-tolerance, after
+    at least min_bootstraps (default 100) and at most nr_of_bootstraps draws.
+    The number of bootstraps used per point is returned as cusum_bootstraps.
+    The points of failed blocks are left out of the returned DataFrame.
+
+    ts is a RaggedTimeSeries of the monitoring period, taken from the dates_mon
+    and ts_mon columns of df if not given
     """
-    
+
     cusum_params = config_dict['cusum_params']
     ts_band = config_dict['ts_params']['ts_band']
     nr_of_bootstraps = cusum_params['nr_of_bootstraps']
     point_id_name = config_dict['ts_params']['point_id']
-    
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        dates_float = [date.year + np.round(date.dayofyear/365, 3) for date in row.dates_mon]
-        args_list.append([row.ts_mon[ts_band], dates_float, row[point_id_name], nr_of_bootstraps])
-        
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=cusum_deforest,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("cusum task failed")
-            
-    cusum_df = pd.DataFrame.from_dict(d, orient='index')
-    cusum_df.columns = ['cusum_change_date', 'cusum_confidence', 'cusum_magnitude', point_id_name]
-    return pd.merge(df, cusum_df, on=point_id_name)    
\ No newline at end of file
+    points_per_block = cusum_params.get('points_per_block', 256)
+    block_size = cusum_params.get('block_size', 2**22)
+    tolerance, min_bootstraps = cusum_params.get('tolerance'), cusum_params.get('min_bootstraps', 100)
+    ts = ts if ts is not None else RaggedTimeSeries.from_frame(df, [ts_band], point_id_name, 'dates_mon', 'ts_mon')
+
+    # fractional years of all dates at once
+    years = decimal_years(ts.days)
+
+    # blocks of points with similar lengths, to keep the padding small
+    order = np.argsort(ts.lengths, kind='stable')
+    order = order[ts.lengths[order] > 0]
+    blocks = [order[i:i + points_per_block] for i in range(0, len(order), points_per_block)]
+    seeds = np.random.SeedSequence(cusum_params.get('seed')).spawn(len(blocks))
+
+    # points without observations
+    date, confidence, magnitude = np.zeros(len(ts)), np.zeros(len(ts), dtype=np.float32), np.zeros(len(ts), dtype=np.float32)
+    nr_used = np.zeros(len(ts), dtype=np.int64)
+    done = ts.lengths == 0
+
+    with shared_time_series(ts, cusum_params) as block_ts:
+        args_list = [
+            [block_ts.take(block), ts_band, nr_of_bootstraps, seed, block_size, tolerance, min_bootstraps, i]
+            for i, (block, seed) in enumerate(zip(blocks, seeds))
+        ]
+
+        executor = block_executor(cusum_params)
+        for task in executor.as_completed(
+            func=cusum_block,
+            iterable=args_list
+        ):
+            try:
+                argmax, block_confidence, block_magnitude, block_nr_used, block_id = task.result()
+            except ValueError:
+                print("cusum task failed")
+                continue
+
+            block = blocks[block_id]
+            date[block] = years[ts.starts[block] + argmax]
+            confidence[block], magnitude[block], nr_used[block] = block_confidence, block_magnitude, block_nr_used
+            done[block] = True
+
+    # points of failed blocks are left out, so that they are processed again
+    cusum_df = pd.DataFrame({
+        'cusum_change_date': date, 'cusum_confidence': confidence, 'cusum_magnitude': magnitude,
+        'cusum_bootstraps': nr_used, point_id_name: ts.point_ids
+    })[done]
+    return pd.merge(df, cusum_df, on=point_id_name)
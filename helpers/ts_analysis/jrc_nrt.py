@@ -9,13 +9,35 @@ import pandas as pd
 import xarray as xr
 import numpy as np
 
+from helpers.ts_analysis.ragged import EPOCH, RaggedTimeSeries
+
 from nrt.monitor.ewma import EWMA
 from nrt.monitor.ccdc import CCDC
 from nrt.monitor.cusum import CuSum
 from nrt.monitor.mosum import MoSum
 
 
-def get_magnitudes(da, config_dict):
+def point_cube(ts, band):
+    """
+    (time, y, x) DataArray of a band of a RaggedTimeSeries, with the points along x
+
+    The time axis is the union of the dates of all points, each point being
+    one pixel of a single row, so the cube grows linearly with the number of
+    points. Dates without an observation of a point are NaN.
+    """
+
+    ts = ts.compact()
+    dates = np.unique(ts.days)
+    cube = np.full((len(dates), 1, len(ts)), np.nan, dtype=np.float32)
+    cube[np.searchsorted(dates, ts.days), 0, np.repeat(np.arange(len(ts)), ts.lengths)] = ts.values[band]
+    return xr.DataArray(cube, dims=['time', 'y', 'x'], coords={
+        'time': (EPOCH + dates.astype('timedelta64[D]')).astype('datetime64[ns]'),
+        'y': np.zeros(1, dtype=np.float32),
+        'x': np.arange(len(ts), dtype=np.float32)
+    })
+
+
+def get_magnitudes(da, point_ids, config_dict):
     
     # extract point id column name
     ts_params = config_dict['ts_params']
@@ -24,14 +46,10 @@ def get_magnitudes(da, config_dict):
     end_mon = ts_params['end_monitor']
     point_id_name = ts_params['point_id']
     
-    # get point ids to process and mask in DataArray
-    points = da[point_id_name].reduce(np.nanmin, axis=0).values
-    mask = np.isfinite(points)
-        
     try:
         # slice for calibration and monitoring
-        history = da.data.sel(time=slice(start_hist, start_mon))
-        monitoring = da.data.sel(time=slice(start_mon, end_mon))
+        history = da.sel(time=slice(start_hist, start_mon))
+        monitoring = da.sel(time=slice(start_mon, end_mon))
 
         # Instantiate monitoring class and fit stable history
         EwmaMonitor = EWMA(trend=False)
@@ -58,76 +76,57 @@ def get_magnitudes(da, config_dict):
             MoSumMonitor.monitor(array=array, date=date)
 
         df = pd.DataFrame({
-            point_id_name: points[mask],
-            'ewma_jrc_date':        EwmaMonitor.detection_date[mask],
-            'ewma_jrc_change':      np.where(EwmaMonitor.detection_date[mask] > 0, 1, 0),
-            'ewma_jrc_magnitude':   EwmaMonitor.process[mask],
-            'mosum_jrc_date':       MoSumMonitor.detection_date[mask],
-            'mosum_jrc_change':     np.where(MoSumMonitor.detection_date[mask] > 0, 1, 0),
-            'mosum_jrc_magnitude':  MoSumMonitor.process[mask],
-            'cusum_jrc_date':       CuSumMonitor.detection_date[mask],
-            'cusum_jrc_change':     np.where(CuSumMonitor.detection_date[mask] > 0, 1, 0),
-            'cusum_jrc_magnitude':  CuSumMonitor.process[mask]
+            point_id_name: point_ids,
+            'ewma_jrc_date':        EwmaMonitor.detection_date[0],
+            'ewma_jrc_change':      np.where(EwmaMonitor.detection_date[0] > 0, 1, 0),
+            'ewma_jrc_magnitude':   EwmaMonitor.process[0],
+            'mosum_jrc_date':       MoSumMonitor.detection_date[0],
+            'mosum_jrc_change':     np.where(MoSumMonitor.detection_date[0] > 0, 1, 0),
+            'mosum_jrc_magnitude':  MoSumMonitor.process[0],
+            'cusum_jrc_date':       CuSumMonitor.detection_date[0],
+            'cusum_jrc_change':     np.where(CuSumMonitor.detection_date[0] > 0, 1, 0),
+            'cusum_jrc_magnitude':  CuSumMonitor.process[0]
         })
     
     except:
         df = pd.DataFrame({
-            point_id_name: points[mask],
-            'ewma_jrc_date':        np.zeros(len(points[mask])),
-            'ewma_jrc_change':      np.zeros(len(points[mask])),
-            'ewma_jrc_magnitude':   np.zeros(len(points[mask])),
-            'mosum_jrc_date':       np.zeros(len(points[mask])),
-            'mosum_jrc_change':     np.zeros(len(points[mask])),
-            'mosum_jrc_magnitude':  np.zeros(len(points[mask])),
-            'cusum_jrc_date':       np.zeros(len(points[mask])),
-            'cusum_jrc_change':     np.zeros(len(points[mask])),
-            'cusum_jrc_magnitude':  np.zeros(len(points[mask])),
+            point_id_name: point_ids,
+            'ewma_jrc_date':        np.zeros(len(point_ids)),
+            'ewma_jrc_change':      np.zeros(len(point_ids)),
+            'ewma_jrc_magnitude':   np.zeros(len(point_ids)),
+            'mosum_jrc_date':       np.zeros(len(point_ids)),
+            'mosum_jrc_change':     np.zeros(len(point_ids)),
+            'mosum_jrc_magnitude':  np.zeros(len(point_ids)),
+            'cusum_jrc_date':       np.zeros(len(point_ids)),
+            'cusum_jrc_change':     np.zeros(len(point_ids)),
+            'cusum_jrc_magnitude':  np.zeros(len(point_ids)),
         })
     
     # get magnitude values
     return df
 
 
-def run_jrc_nrt(df, config_dict):
+def run_jrc_nrt(df, config_dict, ts=None):
+    """
+    Runs the EWMA, CuSum and MoSum monitors of the nrt package
+    
+    The monitors run on a (time, 1, point) cube of the ndfi of the points
+    with observations, see point_cube.
+    
+    ts is a RaggedTimeSeries of the whole period, taken from the dates and ts
+    columns of df if not given
+    """
     
     # extract point id column name
     point_id_name = config_dict['ts_params']['point_id']
+    ragged = ts if ts is not None else RaggedTimeSeries.from_frame(df, ['ndfi'], point_id_name)
     
-    # create an empty dataframe
-    new_df = pd.DataFrame(columns=['time', 'x', 'y', 'data', point_id_name]).set_index(['time', 'x', 'y'])
-    
-    # restructure dataframe for ingestion into xarray
-    for i, row in df.iterrows():
-
-        # get coords, ts and ids
-        x = row.geometry.x
-        y = row.geometry.y
-        ts = row.ts['ndfi']
-        point_ids = [float(row[point_id_name]) for i in range(len(ts))]
-
-        # aggregate to arrays for multiindexing
-        arrays = [
-            row.dates,
-            [x for i in range(len(ts))],
-            [y for i in range(len(ts))]        
-        ]
-
-        # append to empty dataframe
-        new_df = pd.concat([
-                new_df, 
-                pd.DataFrame({'data':ts, point_id_name: point_ids}, index=arrays).rename_axis(['time', 'x', 'y'])
-        ])
-
-
-    # create data array
-    da = xr.Dataset.from_dataframe(new_df)
-    da['time'] = da['time'].astype('datetime64[ns]')
-    da['x'] = da['x'].astype('float32')
-    da['y'] = da['y'].astype('float32')
-    da['data'] = da.data.astype('float32')
+    # only points with observations, each as a pixel of a single row
+    ragged = ragged.take(np.flatnonzero(ragged.lengths > 0))
+    da = point_cube(ragged, 'ndfi')
     
     # get change magnitudes
-    change_df = get_magnitudes(da, config_dict)
+    change_df = get_magnitudes(da, ragged.point_ids, config_dict)
     
     # merge 
     return pd.merge(df, change_df, how='inner', on=point_id_name)
@@ -0,0 +1,226 @@
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from helpers.ts_analysis.shared import SharedArrays, attach_arrays
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def to_day_numbers(dates):
+    """Days since 1970-01-01 (int32) of dates or date strings"""
+
+    return (np.asarray(dates, dtype='datetime64[D]') - EPOCH).astype(np.int32)
+
+
+def decimal_years(days):
+    """Fractional years of day numbers, as year + round(day of year / 365, 3)"""
+
+    dates = pd.DatetimeIndex(EPOCH + np.asarray(days, dtype='timedelta64[D]'))
+    return dates.year.to_numpy() + np.round(dates.dayofyear.to_numpy() / 365, 3)
+
+
+class RaggedTimeSeries:
+    """Time-series of many points in flat arrays
+
+    The dates of all points are kept in one int32 array of day numbers (days
+    since 1970-01-01) and the values in one array per band, point after point
+    and sorted by date within each point. starts and ends give the slice of
+    each point within the flat arrays (as the offsets of a CSR matrix), so
+    selecting a period only creates new starts and ends, and the time-series of
+    a point are views into the flat arrays.
+
+    Parameters
+    ----------
+    point_ids : array-like
+    starts, ends : array-like of int
+        slice of each point within days and values
+    days : ndarray of int32
+    values : dict
+        band -> flat ndarray of values
+    shared : tuple, optional
+        handle of a SharedArrays holding days and values, see share
+    """
+
+    def __init__(self, point_ids, starts, ends, days, values, shared=None):
+        self.point_ids = np.asarray(point_ids)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.days = days
+        self.values = values
+        self.shared = shared
+
+    def __reduce__(self):
+        # containers backed by shared memory are pickled without their flat arrays
+        if self.shared is None:
+            return RaggedTimeSeries, (self.point_ids, self.starts, self.ends, self.days, self.values)
+        return _attach_shared, (self.shared, self.point_ids, self.starts, self.ends)
+
+    @classmethod
+    def from_offsets(cls, point_ids, offsets, days, values):
+        """Container of consecutive points, offsets having one entry more than point_ids"""
+
+        offsets = np.asarray(offsets, dtype=np.int64)
+        return cls(point_ids, offsets[:-1], offsets[1:], days, values)
+
+    @classmethod
+    def from_frame(cls, df, bands, point_id_name, dates_col='dates', ts_col='ts', dtype=np.float32):
+        """Container of the dates and ts (dicts of lists per band) columns of a DataFrame
+
+        Parameters
+        ----------
+        df : DataFrame
+            with point id, dates (DatetimeIndex) and ts columns, as returned by
+            get_time_series
+        bands : list of str
+            bands to take from the ts dicts
+        point_id_name : str
+        dates_col, ts_col : str
+            e.g. 'dates_mon' and 'ts_mon' for the monitoring period
+        dtype : numpy dtype, default=float32
+            of the values, e.g. int16 for unscaled reflectances
+        """
+
+        lengths = np.fromiter((len(dates) for dates in df[dates_col]), dtype=np.int64, count=len(df))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        days = to_day_numbers(np.concatenate(
+            [np.asarray(dates, dtype='datetime64[D]') for dates in df[dates_col]]
+        )) if len(df) else np.array([], dtype=np.int32)
+        values = {
+            band: np.fromiter(chain.from_iterable(ts[band] for ts in df[ts_col]), dtype=dtype, count=offsets[-1])
+            for band in bands
+        }
+        return cls.from_offsets(df[point_id_name].to_numpy(), offsets, days, values)
+
+    def __len__(self):
+        return len(self.point_ids)
+
+    @property
+    def bands(self):
+        return list(self.values)
+
+    @property
+    def lengths(self):
+        """Number of observations per point"""
+
+        return self.ends - self.starts
+
+    @property
+    def nbytes(self):
+        """Memory used by the flat arrays and offsets, in bytes"""
+
+        return self.days.nbytes + sum(v.nbytes for v in self.values.values()) + self.starts.nbytes + self.ends.nbytes
+
+    def point_days(self, i):
+        """Day numbers of the i-th point (view)"""
+
+        return self.days[self.starts[i]:self.ends[i]]
+
+    def point_values(self, i, band):
+        """Values of a band of the i-th point (view)"""
+
+        return self.values[band][self.starts[i]:self.ends[i]]
+
+    def point_dates(self, i):
+        """Dates of the i-th point as DatetimeIndex, as in the dates column of get_time_series"""
+
+        return pd.DatetimeIndex(EPOCH + self.point_days(i).astype('timedelta64[D]'), name='imageID')
+
+    def period(self, start=None, end=None):
+        """Observations after start (exclusive) and up to end (inclusive), without copying
+
+        Parameters
+        ----------
+        start, end : str or datetime, optional
+            e.g. '2000-01-01'; start is exclusive as in subset_ts
+
+        Returns
+        -------
+        RaggedTimeSeries
+            sharing the flat arrays with this one
+        """
+
+        starts, ends = self.starts.copy(), self.ends.copy()
+        start_day = int(to_day_numbers(start)) if start is not None else None
+        end_day = int(to_day_numbers(end)) if end is not None else None
+        for i in range(len(self)):
+            days = self.days[self.starts[i]:self.ends[i]]
+            if start_day is not None:
+                starts[i] = self.starts[i] + np.searchsorted(days, start_day, side='right')
+            if end_day is not None:
+                ends[i] = max(self.starts[i] + np.searchsorted(days, end_day, side='right'), starts[i])
+
+        return RaggedTimeSeries(self.point_ids, starts, ends, self.days, self.values, self.shared)
+
+    def select(self, point_ids):
+        """Container of the given points (in that order), sharing the flat arrays"""
+
+        return self.take(pd.Index(self.point_ids).get_indexer(point_ids))
+
+    def take(self, positions):
+        """Container of the points at the given positions, sharing the flat arrays"""
+
+        return RaggedTimeSeries(
+            self.point_ids[positions], self.starts[positions], self.ends[positions], self.days, self.values, self.shared
+        )
+
+    def share(self):
+        """
+        Flat arrays in shared memory, for worker processes
+
+        Returns
+        -------
+        buffer : SharedArrays
+            to be closed by the caller once the workers are done
+        ts : RaggedTimeSeries
+            of the same points and arrays, which is pickled as the handle of
+            the buffer and its offsets only, so that worker processes get
+            views of the flat arrays without copying them (the same applies to
+            the containers of its take and period)
+        """
+
+        arrays = {('values', band): values for band, values in self.values.items()}
+        if self.days is not None:
+            arrays['days'] = self.days
+
+        buffer = SharedArrays(arrays)
+        return buffer, RaggedTimeSeries(self.point_ids, self.starts, self.ends, self.days, self.values, buffer.handle)
+
+    def _flat_index(self):
+        # positions of all observations within the flat arrays, point after point
+        lengths = self.lengths
+        return np.repeat(self.starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(lengths.sum())
+
+    def dense(self, band, fill=np.nan, dtype=np.float32):
+        """Values of a band as a (points, max length) matrix padded with fill, and the mask of the observations"""
+
+        lengths = self.lengths
+        width = int(lengths.max()) if len(self) else 0
+        mask = np.arange(width) < lengths[:, None]
+        matrix = np.full((len(self), width), fill, dtype=dtype)
+        matrix[mask] = self.values[band][self._flat_index()]
+        return matrix, mask
+
+    def compact(self):
+        """Copy holding only the observations within starts and ends, consecutively"""
+
+        index = self._flat_index()
+        offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        return RaggedTimeSeries.from_offsets(
+            self.point_ids.copy(), offsets, self.days[index], {band: values[index] for band, values in self.values.items()}
+        )
+
+    def to_frame_columns(self):
+        """dates and ts columns as in get_time_series (lists of DatetimeIndex and of dicts of lists)"""
+
+        dates = [self.point_dates(i) for i in range(len(self))]
+        ts = [{band: self.point_values(i, band).tolist() for band in self.values} for i in range(len(self))]
+        return dates, ts
+
+
+def _attach_shared(handle, point_ids, starts, ends):
+    # unpickling of a RaggedTimeSeries backed by shared memory
+    arrays = attach_arrays(handle)
+    values = {key[1]: array for key, array in arrays.items() if key != 'days'}
+    return RaggedTimeSeries(point_ids, starts, ends, arrays.get('days'), values, handle)
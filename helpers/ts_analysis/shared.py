@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+from godale import Executor
+
+# offsets of the arrays within the shared memory are multiples of this
+ALIGNMENT = 64
+
+# shared memory attached by this (worker) process, by name
+_attached = {}
+
+
+class SharedArrays:
+    """Flat arrays in one block of shared memory
+
+    The arrays are copied once into the block, which other processes attach
+    to by its handle (the name of the block and the offset, dtype and shape of
+    each array), getting views without any copy. The block is released on
+    close, e.g. at the end of a with statement.
+
+    Parameters
+    ----------
+    arrays : dict
+        name -> ndarray
+    """
+
+    def __init__(self, arrays):
+        layout, size = {}, 0
+        for name, array in arrays.items():
+            layout[name] = size, array.dtype.str, array.shape
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.handle = self.shm.name, layout
+        for name, array in arrays.items():
+            offset, dtype, shape = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)[...] = array
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_arrays(handle):
+    """Views of the arrays of a SharedArrays, by its handle"""
+
+    name, layout = handle
+    if name not in _attached:
+        # the views of the former chunk stay valid as long as they are used
+        _attached.clear()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+
+    arrays = {}
+    for key, (offset, dtype, shape) in layout.items():
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf, offset=offset)
+        # shared by all workers
+        arrays[key].flags.writeable = False
+    return arrays
+
+
+def block_executor(params):
+    """
+    Executor of the blocks of a runner, as given by its params
+
+    Threads by default, and processes with executor set to 'processes', for
+    which the time-series are passed through shared memory (see
+    RaggedTimeSeries.share). max_workers defaults to 16.
+    """
+
+    executor = params.get('executor', 'threads')
+    if executor not in ['threads', 'processes']:
+        raise ValueError(f'Unknown executor {executor}, use threads or processes.')
+
+    return Executor(executor=f'concurrent_{executor}', max_workers=params.get('max_workers', 16))
+
+
+@contextmanager
+def shared_time_series(ts, params):
+    """
+    Time-series to pass to the block_executor of params
+
+    For the executor 'processes', a RaggedTimeSeries backed by shared memory
+    (see RaggedTimeSeries.share), which is released on exit, and ts itself
+    for threads.
+    """
+
+    if params.get('executor', 'threads') != 'processes':
+        yield ts
+        return
+
+    buffer, shared_ts = ts.share()
+    with buffer:
+        yield shared_ts
@@ -1,48 +1,222 @@
 import numpy as np
-from scipy import stats
 import pandas as pd
-from godale import Executor
-    
-def calc_timescan_metrics(args):
-    
-    ts, point_id, outlier_removal, z_threshhold = args
-    if ts:
-        if outlier_removal:
-            z_score = np.abs(stats.zscore(np.array(ts)))
-            ts_out = np.ma.MaskedArray(ts, mask=z_score > z_threshhold)
+
+from helpers.ts_analysis.ragged import RaggedTimeSeries
+from helpers.ts_analysis.shared import block_executor, shared_time_series
+
+
+def segment_reduce(ufunc, values, offsets, empty):
+    """ufunc.reduceat of the segments of values between offsets, with empty for empty segments"""
+
+    lengths = np.diff(offsets)
+    result = np.full(len(lengths), empty, dtype=np.float64)
+    nonempty = lengths > 0
+    if nonempty.any():
+        result[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+    return result
+
+
+def segment_percentiles(values, valid, offsets, counts, percentiles):
+    """
+    Percentiles of the valid values of each segment, with linear interpolation as np.percentile
+
+    The values are sorted within their segments (invalid ones last) once, so
+    any number of percentiles costs a single in-place sort per segment.
+    """
+
+    if not percentiles:
+        return {}
+
+    # in-place sorts of the segments are faster than any global sort by segment and value
+    sorted_values = np.where(valid, values, np.inf)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        sorted_values[start:end].sort()
+
+    result = {}
+    last = np.maximum(offsets[:-1] + counts - 1, 0)
+    for q in percentiles:
+        position = (counts - 1).clip(0) * q / 100
+        lower, fraction = np.floor(position).astype(np.int64), position % 1
+        low = sorted_values[np.minimum(offsets[:-1] + lower, len(values) - 1)] if len(values) else np.zeros(len(counts))
+        high = sorted_values[np.minimum(offsets[:-1] + lower + 1, last)] if len(values) else np.zeros(len(counts))
+        result[q] = np.where(counts > 0, low + (high - low) * fraction, np.nan)
+    return result
+
+
+def parse_extra_metrics(extra_metrics):
+    """Percentiles needed for the extra metrics ('count', 'median', 'iqr' or 'p<percentile>', e.g. 'p90')"""
+
+    percentiles = set()
+    for metric in extra_metrics:
+        if metric == 'median':
+            percentiles.add(50.)
+        elif metric == 'iqr':
+            percentiles.update([25., 75.])
+        elif metric.startswith('p') and metric[1:].replace('.', '', 1).isdigit() and float(metric[1:]) <= 100:
+            percentiles.add(float(metric[1:]))
+        elif metric != 'count':
+            raise ValueError(f'Unknown timescan metric {metric}, use count, median, iqr or p<percentile>.')
+    return sorted(percentiles)
+
+
+def timescan_metrics(ts, band, outlier_removal=False, z_threshhold=3, extra_metrics=()):
+    """
+    Timescan metrics of all time-series of a RaggedTimeSeries at once
+
+    The metrics are segment reductions (np.ufunc.reduceat) over the flat
+    values of the points. With outlier_removal, values with an absolute
+    z-score above z_threshhold are left out, except for points with missing
+    values or a constant time-series, for which the z-scores are undefined.
+    Missing values are ignored, as with np.nanmean.
+
+    Parameters
+    ----------
+    ts : RaggedTimeSeries
+    band : str
+    outlier_removal : bool, default=False
+    z_threshhold : float, default=3
+    extra_metrics : list of str, optional
+        'count' (of the values used), 'median', 'iqr' and percentiles as
+        'p<percentile>', e.g. ['count', 'iqr', 'p10', 'p90']
+
+    Returns
+    -------
+    dict
+        metric -> ndarray with a value per point, mean, sd, min and max being
+        0 for points without observations
+    """
+
+    percentiles = parse_extra_metrics(extra_metrics)
+
+    # the observations of the points one after the other
+    ts = ts.compact()
+    values = ts.values[band].astype(np.float64)
+    offsets = np.concatenate([[0], np.cumsum(ts.lengths)])
+    lengths = np.diff(offsets)
+
+    def segment_mean(x, count):
+        return segment_reduce(np.add, x, offsets, 0) / np.where(count > 0, count, np.nan)
+
+    finite = np.isfinite(values)
+    valid = finite
+    if outlier_removal:
+        mean = np.repeat(segment_mean(values, lengths), lengths)
+        sd = np.repeat(np.sqrt(segment_mean((values - mean) ** 2, lengths)), lengths)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = np.abs(values - mean) / sd
+
+        # nan z-scores (missing values, constant series) mask nothing, as stats.zscore
+        valid = finite & ~(z_score > z_threshhold)
+
+    counts = segment_reduce(np.add, valid.astype(np.float64), offsets, 0)
+    with np.errstate(invalid='ignore'):
+        mean = segment_mean(np.where(valid, values, 0), counts)
+        sd = np.sqrt(segment_mean(np.where(valid, values - np.repeat(mean, lengths), 0) ** 2, counts))
+    metrics = {
+        'mean': mean,
+        'sd': sd,
+        'min': segment_reduce(np.minimum, np.where(valid, values, np.inf), offsets, 0),
+        'max': segment_reduce(np.maximum, np.where(valid, values, -np.inf), offsets, 0)
+    }
+
+    # all nan series, as np.nanmin
+    for metric in metrics.values():
+        metric[(lengths > 0) & (counts == 0)] = np.nan
+        metric[lengths == 0] = 0
+
+    values_percentiles = segment_percentiles(values, valid, offsets, counts.astype(np.int64), percentiles)
+    for metric in extra_metrics:
+        if metric == 'count':
+            metrics[metric] = counts.astype(np.int64)
+        elif metric == 'median':
+            metrics[metric] = values_percentiles[50.]
+        elif metric == 'iqr':
+            metrics[metric] = values_percentiles[75.] - values_percentiles[25.]
         else:
-            ts_out = ts
+            metrics[metric] = values_percentiles[float(metric[1:])]
+
+    return metrics
 
-        return np.nanmean(ts_out), np.nanstd(ts_out), np.nanmin(ts_out), np.nanmax(ts_out), point_id
+
+def calc_timescan_metrics(args):
+
+    ts, point_id, outlier_removal, z_threshhold = args
+    if len(ts):
+        values = np.asarray(ts, dtype=np.float64)
+        metrics = timescan_metrics(
+            RaggedTimeSeries.from_offsets([point_id], [0, len(values)], np.zeros(len(values), dtype=np.int32), {'ts': values}),
+            'ts', outlier_removal, z_threshhold
+        )
+        return metrics['mean'][0], metrics['sd'][0], metrics['min'][0], metrics['max'][0], point_id
     else:
         return 0, 0, 0, 0, point_id
-    
-    
-def run_timescan_metrics(df, config_dict):
+
+
+def timescan_block(args):
+    """timescan_metrics of a block of points of a RaggedTimeSeries"""
+
+    ts, ts_band, outlier_removal, z_threshhold, extra_metrics, block_id = args
+    return timescan_metrics(ts, ts_band, outlier_removal, z_threshhold, extra_metrics), block_id
+
+
+def run_timescan_metrics(df, config_dict, ts=None):
     """
-    Parallel implementation of the bootstrap slope function
+    Vectorized implementation of the timescan metrics function
+
+    Besides ts_mean, ts_sd, ts_min and ts_max, the extra_metrics of the
+    ts_metrics_params (e.g. ["count", "iqr", "p10", "p90"]) are added as
+    ts_<metric> columns.
+
+    All points are processed at once, unless executor is set to 'processes'
+    in the ts_metrics_params, which splits them in blocks of points_per_block
+    (default 4096) for parallel processes (max_workers, default 16). The
+    points of failed blocks are left out of the returned DataFrame.
+
+    ts is a RaggedTimeSeries of the monitoring period, taken from the dates_mon
+    and ts_mon columns of df if not given
     """
-    
+
     ts_metrics_params = config_dict['ts_metrics_params']
     ts_band = config_dict['ts_params']['ts_band']
     point_id_name = config_dict['ts_params']['point_id']
-    
+    ts = ts if ts is not None else RaggedTimeSeries.from_frame(df, [ts_band], point_id_name, 'dates_mon', 'ts_mon')
+
     outlier_removal, z_threshhold = ts_metrics_params['outlier_removal'], ts_metrics_params['z_threshhold']
-    args_list, d = [], {}
-    for i, row in df.iterrows():
-        args_list.append([row.ts_mon[ts_band], row[point_id_name], outlier_removal, z_threshhold])
-        # d[i] = calc_timescan_metrics(args_list[i])
-    
-    executor = Executor(executor="concurrent_threads", max_workers=16)
-    for i, task in enumerate(executor.as_completed(
-        func=calc_timescan_metrics,
-        iterable=args_list
-    )):
-        try:
-            d[i] = list(task.result())
-        except ValueError:
-            print("timescan task failed")
-            
-    tscan_df = pd.DataFrame.from_dict(d, orient='index')
-    tscan_df.columns = ['ts_mean', 'ts_sd', 'ts_min', 'ts_max', point_id_name]
-    return pd.merge(df, tscan_df, on=point_id_name)    
\ No newline at end of file
+    extra_metrics = ts_metrics_params.get('extra_metrics', [])
+    done = np.ones(len(ts), dtype=bool)
+    if ts_metrics_params.get('executor', 'threads') != 'processes':
+        metrics = timescan_metrics(ts, ts_band, outlier_removal, z_threshhold, extra_metrics)
+    else:
+        points_per_block = ts_metrics_params.get('points_per_block', 4096)
+        blocks = [np.arange(i, min(i + points_per_block, len(ts))) for i in range(0, len(ts), points_per_block)]
+        metrics = {
+            metric: np.zeros(len(ts), dtype=np.int64 if metric == 'count' else np.float64)
+            for metric in ['mean', 'sd', 'min', 'max', *extra_metrics]
+        }
+        done[:] = False
+        with shared_time_series(ts, ts_metrics_params) as block_ts:
+            args_list = [
+                [block_ts.take(block), ts_band, outlier_removal, z_threshhold, extra_metrics, i]
+                for i, block in enumerate(blocks)
+            ]
+
+            executor = block_executor(ts_metrics_params)
+            for task in executor.as_completed(
+                func=timescan_block,
+                iterable=args_list
+            ):
+                try:
+                    block_metrics, block_id = task.result()
+                except ValueError:
+                    print("timescan task failed")
+                    continue
+
+                for metric, values in block_metrics.items():
+                    metrics[metric][blocks[block_id]] = values
+                done[blocks[block_id]] = True
+
+    # points of failed blocks are left out, so that they are processed again
+    tscan_df = pd.DataFrame({f'ts_{metric}': values for metric, values in metrics.items()})
+    tscan_df[point_id_name] = ts.point_ids
+    tscan_df = tscan_df[done]
+    return pd.merge(df, tscan_df, on=point_id_name)
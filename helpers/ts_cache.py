@@ -0,0 +1,182 @@
+import json
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from helpers.parquet import ts_to_arrow, ts_from_arrow
+
+
+def cache_key(config_dict):
+    """Hash of everything the downloaded time-series depend on, except the end date
+
+    Parameters
+    ----------
+    config_dict : dict
+        processing configuration, the lsat_params and the bands, scale,
+        satellite and start_calibration of the ts_params are used
+
+    Returns
+    -------
+    str
+    """
+
+    ts_params = config_dict['ts_params']
+    params = {
+        'lsat_params': config_dict['lsat_params'],
+        'bands': ts_params['bands'],
+        'scale': ts_params['scale'],
+        'satellite': ts_params['satellite'],
+        'start': ts_params['start_calibration']
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class TimeSeriesCache:
+    """On-disk store of downloaded time-series, as Parquet
+
+    Time-series are stored as returned by get_time_series (before outlier
+    removal and smoothing), in a folder per cache_key of the configuration, so
+    that re-running the algorithms with other settings does not download them
+    again. Every write goes to its own part file, written to a temporary file
+    first, so concurrent writers and interrupted runs leave no broken files.
+    Each point is stored with the end date it was downloaded for, and is only
+    served for that same end date, unless read with any_end (e.g. to extend it
+    with the images acquired since).
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+    config_dict : dict
+        processing configuration
+    """
+
+    def __init__(self, cache_dir, config_dict):
+        self.path = Path(cache_dir).joinpath(cache_key(config_dict))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.point_id_name = config_dict['ts_params']['point_id']
+        self.bands = config_dict['ts_params']['bands']
+        self.end = config_dict['ts_params']['end_monitor']
+        self._lock = threading.Lock()
+
+        # keep track of what the key stands for
+        params_file = self.path.joinpath('params.json')
+        if not params_file.exists():
+            with open(params_file, 'w') as f:
+                json.dump({
+                    'lsat_params': config_dict['lsat_params'],
+                    'ts_params': {k: config_dict['ts_params'][k] for k in ['bands', 'scale', 'satellite', 'start_calibration']}
+                }, f)
+
+        # point id -> (part file, end date) of the most recent entry
+        self._index = {}
+        for file in sorted(self.path.glob('part-*.parquet'), key=lambda file: file.stat().st_mtime):
+            table = pq.read_table(file, columns=[self.point_id_name, 'ts_end'])
+            self._index.update(
+                (point_id, (file, end)) for point_id, end in
+                zip(table.column(self.point_id_name).to_pylist(), table.column('ts_end').to_pylist())
+            )
+
+    def __len__(self):
+        return len(self._index)
+
+    def cached(self, point_ids, end=None):
+        """The point ids with a time-series up to end (defaults to the configured end_monitor)"""
+
+        end = end or self.end
+        with self._lock:
+            return [point_id for point_id in point_ids if self._index.get(point_id, (None, None))[1] == end]
+
+    def outdated(self, point_ids, end=None):
+        """The point ids with a time-series up to an earlier date than end"""
+
+        end = end or self.end
+        with self._lock:
+            return [
+                point_id for point_id in point_ids
+                if point_id in self._index and pd.Timestamp(self._index[point_id][1]) < pd.Timestamp(end)
+            ]
+
+    def read(self, point_ids, end=None, any_end=False):
+        """Read the cached time-series of point_ids
+
+        Parameters
+        ----------
+        point_ids : list
+        end : str, optional
+            end date the time-series have been downloaded for, defaults to the
+            configured end_monitor
+        any_end : bool, default=False
+            read the most recent time-series of the points, whatever their end date
+
+        Returns
+        -------
+        GeoDataFrame or None
+            in the structure of get_time_series, for the cached points only
+        """
+
+        end = end or self.end
+        with self._lock:
+            by_file = {}
+            for point_id in point_ids:
+                file, point_end = self._index.get(point_id, (None, None))
+                if point_end == end or (any_end and file is not None):
+                    by_file.setdefault(file, []).append(point_id)
+
+        if not by_file:
+            return None
+
+        # each part file holds a single entry per point, the index points to the most recent one
+        tables = [
+            pq.read_table(file, filters=[(self.point_id_name, 'in', ids)])
+            for file, ids in by_file.items()
+        ]
+        table = pa.concat_tables(tables)
+
+        # in the order of point_ids
+        position = {point_id: i for i, point_id in enumerate(point_ids)}
+        order = np.argsort([position[point_id] for point_id in table.column(self.point_id_name).to_pylist()], kind='stable')
+        table = table.take(pa.array(order, type=pa.int64()))
+
+        dates, ts = ts_from_arrow(table, self.bands)
+        df = pd.DataFrame({
+            'point_idx': np.arange(table.num_rows),
+            self.point_id_name: table.column(self.point_id_name).to_pandas(),
+            'dates': [point_dates.rename('imageID') for point_dates in dates],
+            'ts': ts,
+            'images': table.column('images').to_pandas(),
+            'pathrow': table.column('pathrow').to_pandas() if 'pathrow' in table.column_names else None,
+            'geometry': shapely.from_wkb(table.column('geometry').to_numpy(zero_copy_only=False))
+        })
+        return gpd.GeoDataFrame(df).set_geometry('geometry')
+
+    def write(self, df, end=None):
+        """Add time-series in the structure of get_time_series to the cache"""
+
+        if df is None or len(df) == 0:
+            return
+
+        end = end or self.end
+        table = pa.table({
+            self.point_id_name: df[self.point_id_name].to_numpy(),
+            **ts_to_arrow(df, self.bands),
+            'images': df['images'].to_numpy(),
+            'pathrow': pa.array(df['pathrow'] if 'pathrow' in df.columns else [None] * len(df), type=pa.string()),
+            'geometry': pa.array(shapely.to_wkb(np.asarray(df['geometry'].values, dtype=object)), type=pa.binary()),
+            'ts_end': pa.array([end] * len(df), type=pa.string())
+        })
+
+        file = self.path.joinpath(f'part-{uuid.uuid4().hex}.parquet')
+        tmp_file = file.with_suffix('.tmp')
+        pq.write_table(table, tmp_file)
+        tmp_file.replace(file)
+
+        with self._lock:
+            self._index.update((point_id, (file, end)) for point_id in df[self.point_id_name].tolist())